@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import UserMovieList, UserProfile
+from .models import UserMovieList, UserProfile, CatalogMovie
 
 # Register your models here.
 admin.site.register(UserMovieList)
-admin.site.register(UserProfile)
\ No newline at end of file
+admin.site.register(UserProfile)
+admin.site.register(CatalogMovie)
\ No newline at end of file
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class MoviesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'movies'
\ No newline at end of file
+    name = 'movies'
+
+    def ready(self):
+        from . import metrics
+
+        # Count and time SQL on every database connection, in every thread
+        connection_created.connect(metrics.install_sql_hook, dispatch_uid='movies_metrics_sql')
@@ -0,0 +1,161 @@
+"""
+Async versions of the views that wait on TMDB. Under ASGI these don't hold a
+worker thread while TMDB responds, so one process can serve many requests
+at once. urls.py routes to them when settings.ASYNC_VIEWS is on; the sync
+views in views.py are used otherwise.
+"""
+import asyncio
+import random
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.db import connections
+from django.http import Http404
+from django.shortcuts import render, redirect, aget_object_or_404
+
+from .models import UserMovieList, UserProfile
+from .forms import MovieFilterForm
+from .views import LANGUAGE_MAP, TMDB_UNAVAILABLE_MESSAGE
+from . import list_details, page_cache, profile_lists, recommendation_queue, seen_movies, similar_movies, tmdb_api, tmdb_client
+
+def in_thread(func):
+    """
+    Wraps sync code that may touch the database to run on the executor's
+    threads instead of the one thread sync_to_async shares by default, so
+    concurrent requests don't queue behind each other for it. The thread's
+    database connections are closed afterwards, as at the end of a request.
+    """
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+    return sync_to_async(run, thread_sensitive=False)
+
+# Templates may touch request.user and messages, which hit the database,
+# so rendering happens in a thread.
+arender = in_thread(render)
+
+# Warm-ahead runs on a thread pool; this only hands the work off
+awarm_movies = sync_to_async(tmdb_api.warm_movies, thread_sensitive=False)
+
+afor_movie = in_thread(similar_movies.for_movie)
+
+async def auser(request):
+    """
+    request.auser(), also set as request.user. The two cache separately, so
+    otherwise templates (and the auth context processor) load the user again.
+    """
+    user = await request.auser()
+    request.user = user
+    return user
+
+async def filter_page(request):
+    if request.method == 'GET' and 'genre' in request.GET:
+        form = MovieFilterForm(request.GET)
+        if form.is_valid():
+            seen = await seen_movies.afor_user(await auser(request))
+            first_movie_id = await recommendation_queue.astart(request.session, form.cleaned_data, seen)
+
+            if first_movie_id:
+                await awarm_movies(await recommendation_queue.aupcoming(request.session, tmdb_api.WARM_AHEAD, seen))
+                return redirect('movie_recommendation', movie_id=first_movie_id)
+            if not tmdb_client.is_available():
+                await sync_to_async(messages.error)(request, TMDB_UNAVAILABLE_MESSAGE)
+    else:
+        form = MovieFilterForm()
+
+    return await arender(request, 'movies/filter_page.html', {'form': form})
+
+async def next_movie(request):
+    seen = await seen_movies.afor_user(await auser(request))
+    next_movie_id = await recommendation_queue.aadvance(request.session, seen)
+    if next_movie_id:
+        return redirect('movie_recommendation', movie_id=next_movie_id)
+    return redirect('filter_page')
+
+async def movie_recommendation_page(request, movie_id):
+    user = await auser(request)
+    cacheable = not await page_cache.ahas_pending_messages(request)
+    stamp = await tmdb_api.amovie_version(movie_id) if cacheable else None
+    validators = page_cache.Validators(request, user, movie_id, stamp) if stamp else None
+    if validators:
+        response = await page_cache.acheck(request, validators)
+        if response:
+            return page_cache.finish(response, validators)
+
+    seen = await seen_movies.afor_user(user)
+    await awarm_movies(await recommendation_queue.aupcoming(request.session, tmdb_api.WARM_AHEAD, seen))
+
+    movie, credits = await tmdb_api.aget_movie_with_credits(movie_id)
+    if not movie:
+        if not tmdb_client.is_available():
+            await sync_to_async(messages.error)(request, TMDB_UNAVAILABLE_MESSAGE)
+            return redirect('filter_page')
+        raise Http404("Movie not found.")
+
+    context = {
+        'movie': movie,
+        'cast': credits.get('cast'),
+        'director': credits.get('director'),
+        'full_language_name': LANGUAGE_MAP.get(movie.get('original_language'), movie.get('original_language')),
+        'similar': await afor_movie(movie_id),
+    }
+    response = await arender(request, 'movies/movie_recommendation.html', context)
+
+    if cacheable and not validators:
+        stamp = await tmdb_api.amovie_version(movie_id)
+        validators = page_cache.Validators(request, user, movie_id, stamp) if stamp else None
+    if validators:
+        await page_cache.astore(validators, response)
+    return page_cache.finish(response, validators)
+
+@login_required
+async def profile_page(request):
+    user = await auser(request)
+
+    user_profile, _ = await UserProfile.objects.aget_or_create(
+        user=user, defaults={'avatar_choice': random.randint(1, 6)}
+    )
+
+    (watch_later_movies, watch_later_next), (watched_movies, watched_next), counts = await asyncio.gather(
+        profile_lists.apage(user, 'watch_later'),
+        profile_lists.apage(user, 'watched'),
+        profile_lists.acounts(user),
+    )
+
+    context = {
+        'user_profile': user_profile,
+        'watch_later_movies': watch_later_movies,
+        'watched_movies': watched_movies,
+        'watch_later_next': watch_later_next,
+        'watched_next': watched_next,
+        'watch_later_count': counts['watch_later'],
+        'watched_count': counts['watched'],
+    }
+    return await arender(request, 'movies/profile_page.html', context)
+
+@login_required
+async def my_movie_details(request, movie_id):
+    user = await auser(request)
+
+    # As in the sync view: a movie that isn't on the list is a 404 without
+    # spending a TMDB request on it
+    list_entry = await aget_object_or_404(UserMovieList, user=user, movie_id=movie_id)
+    movie, credits = await tmdb_api.aget_movie_with_credits(movie_id)
+    if not movie:
+        if not tmdb_client.is_available():
+            await sync_to_async(messages.error)(request, TMDB_UNAVAILABLE_MESSAGE)
+            return redirect('profile_page')
+        # TMDB doesn't have it any more; show what the row has so it can still be removed
+        movie, credits = list_details.as_movie(list_entry), {}
+
+    context = {
+        'movie': movie,
+        'cast': credits.get('cast'),
+        'director': credits.get('director'),
+        'full_language_name': LANGUAGE_MAP.get(movie.get('original_language'), movie.get('original_language')),
+        'list_entry': list_entry,
+    }
+    return await arender(request, 'movies/my_movie_details.html', context)
@@ -0,0 +1,313 @@
+"""
+Two-tier cache backend shared by all workers on a host.
+
+L1 is a small in-process LRU that serves hot keys without any I/O. L2 is a
+SQLite file that every worker process reads and writes, so a movie fetched by
+one worker is a cache hit for the rest, and entries survive restarts.
+
+L1 entries live for at most L1_TIMEOUT seconds, which bounds how long a worker
+can serve a value another worker has since changed or deleted. add() and
+incr() always go to L2, so they stay atomic across processes.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'movies.cache_backends.TieredCache',
+            'LOCATION': BASE_DIR / 'cache.sqlite3',
+            'OPTIONS': {
+                'L1_MAX_ENTRIES': 500,
+                'L1_TIMEOUT': 30,
+                'MAX_BYTES': 256 * 1024 * 1024,
+            },
+        }
+    }
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+_MISSING = object()
+
+STAT_NAMES = ('l1_hits', 'l2_hits', 'misses', 'sets', 'evictions')
+
+# location -> (L1 store, its lock, stats)
+_process_state = {}
+
+# Reads only bump an entry's access time when it is older than this, so
+# lookups don't turn into writes. Eviction order is LRU to this precision.
+ACCESS_RESOLUTION = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_entries_expires ON cache_entries (expires);
+CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (accessed);
+"""
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = str(location)
+        self._l1_max_entries = options.get('L1_MAX_ENTRIES', 500)
+        self._l1_timeout = options.get('L1_TIMEOUT', 30)
+        self._max_bytes = options.get('MAX_BYTES', 256 * 1024 * 1024)
+        # Check the L2 size every this many writes
+        self._cull_every = options.get('CULL_EVERY', 200)
+
+        # Django creates a cache object per thread, so the L1 store, its lock
+        # and the counters are shared per process through module globals
+        self._l1, self._l1_lock, self._stats = _process_state.setdefault(
+            self._path, (OrderedDict(), threading.Lock(), dict.fromkeys(STAT_NAMES, 0))
+        )
+        self._local = threading.local()
+
+    # SQLite connections can't cross threads or forks, so each gets its own
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # L1
+
+    def _l1_get(self, key, now):
+        with self._l1_lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return _MISSING
+            expires, data = entry
+            if expires <= now:
+                del self._l1[key]
+                return _MISSING
+            self._l1.move_to_end(key)
+        # Stored pickled, so callers can't mutate each other's copies
+        return pickle.loads(data)
+
+    def _l1_set(self, key, data, expires, now):
+        l1_expires = now + self._l1_timeout
+        if expires is not None:
+            l1_expires = min(l1_expires, expires)
+        with self._l1_lock:
+            self._l1[key] = (l1_expires, data)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self._l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, key):
+        with self._l1_lock:
+            self._l1.pop(key, None)
+
+    # L2
+
+    def _l2_get_many(self, keys, now):
+        conn = self._connection()
+        found = {}
+        stale = []
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT key, value, expires, accessed FROM cache_entries WHERE key IN ({placeholders})"
+                " AND (expires IS NULL OR expires > ?)",
+                [*chunk, now],
+            ).fetchall()
+            for key, data, expires, accessed in rows:
+                found[key] = (data, expires)
+                if accessed < now - ACCESS_RESOLUTION:
+                    stale.append(key)
+        if stale:
+            conn.executemany("UPDATE cache_entries SET accessed = ? WHERE key = ?", [(now, key) for key in stale])
+        return found
+
+    def _l2_set_many(self, items, expires, now):
+        rows = [(key, data, expires, len(key) + len(data), now) for key, data in items]
+
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO cache_entries (key, value, expires, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+        sets = self._stats['sets']
+        self._stats['sets'] = sets + len(rows)
+        if sets // self._cull_every != self._stats['sets'] // self._cull_every:
+            self._cull(now)
+
+    def _cull(self, now):
+        """Drops expired entries, then least recently used ones until under MAX_BYTES."""
+        conn = self._connection()
+        conn.execute("DELETE FROM cache_entries WHERE expires IS NOT NULL AND expires <= ?", [now])
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total <= self._max_bytes:
+            return
+
+        # Evict down to 90% so we don't cull again on the next write
+        target = total - int(self._max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM cache_entries ORDER BY accessed"):
+            victims.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        conn.executemany("DELETE FROM cache_entries WHERE key = ?", victims)
+        self._stats['evictions'] += len(victims)
+
+    # Django cache API
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        now = time.time()
+        result = {}
+        to_fetch = {}
+        for key in keys:
+            cache_key = self.make_and_validate_key(key, version=version)
+            value = self._l1_get(cache_key, now)
+            if value is _MISSING:
+                to_fetch[cache_key] = key
+            else:
+                result[key] = value
+        self._stats['l1_hits'] += len(result)
+
+        if to_fetch:
+            found = self._l2_get_many(list(to_fetch), now)
+            for cache_key, (data, expires) in found.items():
+                result[to_fetch[cache_key]] = pickle.loads(data)
+                self._l1_set(cache_key, data, expires, now)
+            self._stats['l2_hits'] += len(found)
+            self._stats['misses'] += len(to_fetch) - len(found)
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        expires = self.get_backend_timeout(timeout)
+        items = [
+            (self.make_and_validate_key(key, version=version), pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+            for key, value in data.items()
+        ]
+        if expires is not None and expires <= now:
+            # A zero or negative timeout means "don't cache"
+            self.delete_many(list(data), version=version)
+            return []
+
+        self._l2_set_many(items, expires, now)
+        for cache_key, pickled in items:
+            self._l1_set(cache_key, pickled, expires, now)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        expires = self.get_backend_timeout(timeout)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        # Only overwrite an existing row if it has expired; atomic in SQLite
+        cursor = self._connection().execute(
+            "INSERT INTO cache_entries (key, value, expires, size, accessed) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires,"
+            " size = excluded.size, accessed = excluded.accessed"
+            " WHERE cache_entries.expires IS NOT NULL AND cache_entries.expires <= ?",
+            [key, data, expires, len(key) + len(data), now, now],
+        )
+        added = cursor.rowcount == 1
+        if added:
+            self._l1_set(key, data, expires, now)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT value FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                [key, now],
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            conn.execute(
+                "UPDATE cache_entries SET value = ?, size = ?, accessed = ? WHERE key = ?",
+                [data, len(key) + len(data), now, key],
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._l1_delete(key)
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE cache_entries SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            [self.get_backend_timeout(timeout), key, now],
+        )
+        self._l1_delete(key)
+        return cursor.rowcount == 1
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def delete(self, key, version=None):
+        return self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        cache_keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        for cache_key in cache_keys:
+            self._l1_delete(cache_key)
+        conn = self._connection()
+        deleted = 0
+        for cache_key in cache_keys:
+            deleted += conn.execute("DELETE FROM cache_entries WHERE key = ?", [cache_key]).rowcount
+        return deleted > 0
+
+    def clear(self):
+        with self._l1_lock:
+            self._l1.clear()
+        self._connection().execute("DELETE FROM cache_entries")
+
+    def close(self, **kwargs):
+        # Connections are reused across requests; nothing to do per request
+        pass
+
+    def stats(self):
+        """Per-process hit counters and hit rates for each tier."""
+        stats = dict(self._stats)
+        lookups = stats['l1_hits'] + stats['l2_hits'] + stats['misses']
+        stats['lookups'] = lookups
+        stats['l1_hit_rate'] = stats['l1_hits'] / lookups if lookups else 0.0
+        stats['l2_hit_rate'] = stats['l2_hits'] / lookups if lookups else 0.0
+        stats['l1_entries'] = len(self._l1)
+        return stats
@@ -0,0 +1,126 @@
+import datetime
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import catalog_index
+from .models import CatalogMovie
+
+# Same page size TMDB uses for /discover/movie
+PAGE_SIZE = 20
+
+# Same floor the TMDB discover query uses, so both sources agree
+MIN_VOTE_COUNT = 100
+
+CATALOG_ENABLED = getattr(settings, 'TMDB_CATALOG_ENABLED', True)
+
+def is_available():
+    """
+    True if the local catalog has been ingested and should be used. Rows
+    without vote data (TMDB's daily export has none) never match a
+    discover query, so a catalog of only those doesn't count.
+    """
+    if not CATALOG_ENABLED:
+        return False
+
+    available = cache.get('catalog_available')
+    if available is None:
+        available = CatalogMovie.objects.filter(vote_count__gte=MIN_VOTE_COUNT).exists()
+        cache.set('catalog_available', available, 60 * 5)
+    return available
+
+def has_titles():
+    """True if the catalog has any rows to match imported titles against, voted or not."""
+    if not CATALOG_ENABLED:
+        return False
+
+    has_rows = cache.get('catalog_has_titles')
+    if has_rows is None:
+        has_rows = CatalogMovie.objects.exists()
+        cache.set('catalog_has_titles', has_rows, 60 * 5)
+    return has_rows
+
+def _clamp_year(year):
+    # The form doesn't bound years, but dates only go from 1 to 9999
+    return min(max(year, datetime.MINYEAR), datetime.MAXYEAR)
+
+def filter_movies(filters):
+    """Returns a CatalogMovie queryset matching the MovieFilterForm filters."""
+    movies = CatalogMovie.objects.filter(vote_count__gte=MIN_VOTE_COUNT)
+
+    if filters.get('genre'):
+        movies = movies.filter(genres__genre_id=filters['genre'])
+    if filters.get('year_from'):
+        movies = movies.filter(release_date__gte=datetime.date(_clamp_year(filters['year_from']), 1, 1))
+    if filters.get('year_to'):
+        movies = movies.filter(release_date__lte=datetime.date(_clamp_year(filters['year_to']), 12, 31))
+    if filters.get('rating'):
+        movies = movies.filter(vote_average__gte=float(filters['rating']))
+    if filters.get('language'):
+        movies = movies.filter(original_language=filters['language'])
+    return movies
+
+def discover(filters, max_pages, rng=None):
+    """
+    Catalog version of a TMDB discover call: a shuffled page of results
+    picked at random from the top max_pages pages by popularity. Returns
+    dicts with the same keys as TMDB discover results. Pass a seeded
+    random.Random as rng to get the same results again.
+
+    When a NumPy snapshot of the catalog is available (see catalog_index),
+    a popularity-weighted sample is taken from it instead; those results
+    only carry the movie 'id'.
+    """
+    index = catalog_index.get_index()
+    if index is not None:
+        np_rng = catalog_index.np.random.default_rng(rng.getrandbits(64)) if rng else None
+        return [{'id': movie_id} for movie_id in index.sample(filters, PAGE_SIZE, np_rng)]
+    return discover_from_database(filters, max_pages, rng)
+
+def discover_from_database(filters, max_pages, rng=None):
+    """The SQL version of discover(), used when there's no NumPy snapshot."""
+    top_movies = list(
+        filter_movies(filters)
+        .order_by('-popularity')
+        .values('id', 'title', 'poster_path', 'release_date', 'vote_average', 'original_language', 'popularity')
+        [:PAGE_SIZE * max_pages]
+    )
+    if not top_movies:
+        return []
+    rng = rng or random
+
+    total_pages = (len(top_movies) + PAGE_SIZE - 1) // PAGE_SIZE
+    start = (rng.randint(1, total_pages) - 1) * PAGE_SIZE
+    results = top_movies[start:start + PAGE_SIZE]
+
+    for movie in results:
+        if movie['release_date']:
+            movie['release_date'] = movie['release_date'].isoformat()
+    rng.shuffle(results)
+    return results
+
+def find_titles(queries):
+    """
+    Matches (title, year) pairs against the catalog by exact title. With a
+    year, only a movie released that year counts; without one, the most
+    popular movie with the title does. Returns {(title, year): (id, title,
+    poster_path)} for the pairs that matched.
+    """
+    titles = {title for title, _ in queries}
+    by_title = {}
+    rows = (
+        CatalogMovie.objects.filter(title__in=titles)
+        .order_by('-popularity')
+        .values_list('id', 'title', 'poster_path', 'release_date')
+    )
+    for movie_id, title, poster_path, release_date in rows:
+        by_title.setdefault(title, []).append((movie_id, title, poster_path, release_date))
+
+    matches = {}
+    for title, year in queries:
+        for movie_id, _, poster_path, release_date in by_title.get(title, ()):
+            if not year or (release_date and release_date.year == year):
+                matches[(title, year)] = (movie_id, title, poster_path)
+                break
+    return matches
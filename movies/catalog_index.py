@@ -0,0 +1,221 @@
+"""
+Columnar, memory-mapped snapshot of the local catalog for fast filtering.
+
+build_snapshot() writes one .npy file per column into a new directory under
+CATALOG_INDEX_DIR and then points the CURRENT file at it. Workers open the
+columns with mmap_mode='r', so they all share the page cache instead of each
+holding a copy. Filtering is a handful of vectorized comparisons, and picking
+movies is a popularity-weighted random sample.
+
+NumPy is optional. Without it, or before a snapshot has been built, catalog
+discovery falls back to SQL.
+"""
+import os
+import shutil
+import threading
+import time
+
+from django.conf import settings
+
+from .forms import GENRE_CHOICES
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INDEX_DIR = getattr(settings, 'CATALOG_INDEX_DIR', os.path.join(settings.BASE_DIR, 'catalog_index'))
+
+# How often a worker checks CURRENT for a newer snapshot, in seconds
+RELOAD_INTERVAL = 60
+
+# One bit per genre in the form, in GENRE_CHOICES order
+GENRE_BITS = {genre_id: 1 << bit for bit, (genre_id, _) in enumerate(choice for choice in GENRE_CHOICES if choice[0])}
+
+COLUMNS = {
+    'id': 'int32',
+    'genres': 'uint32',
+    'year': 'int16',
+    'vote_average': 'float32',
+    'vote_count': 'int32',
+    'language': 'uint16',
+    'popularity': 'float32',
+}
+
+# Same floor as catalog.MIN_VOTE_COUNT
+MIN_VOTE_COUNT = 100
+
+
+def language_code(language):
+    """Packs a two-letter language code into a uint16 (0 for none)."""
+    language = (language or '')[:2].encode('ascii', 'ignore')
+    if not language:
+        return 0
+    return (language[0] << 8) | (language[1] if len(language) > 1 else 0)
+
+
+class CatalogIndex:
+    def __init__(self, columns):
+        self.columns = columns
+        self.size = len(columns['id'])
+
+    @classmethod
+    def load(cls, path):
+        return cls({
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+            for name in COLUMNS
+        })
+
+    def mask(self, filters):
+        """Boolean array of the movies matching the MovieFilterForm filters."""
+        c = self.columns
+        mask = c['vote_count'] >= MIN_VOTE_COUNT
+
+        if filters.get('genre'):
+            bit = GENRE_BITS.get(int(filters['genre']), 0)
+            mask &= (c['genres'] & np.uint32(bit)) != 0
+        if filters.get('year_from'):
+            mask &= c['year'] >= filters['year_from']
+        if filters.get('year_to'):
+            # year is 0 for movies without a release date
+            mask &= (c['year'] <= filters['year_to']) & (c['year'] > 0)
+        if filters.get('rating'):
+            mask &= c['vote_average'] >= float(filters['rating'])
+        if filters.get('language'):
+            mask &= c['language'] == language_code(filters['language'])
+        return mask
+
+    def sample(self, filters, count, rng=None):
+        """
+        Returns up to `count` matching movie IDs, drawn at random without
+        replacement with probability proportional to popularity.
+        """
+        rng = rng or np.random.default_rng()
+        candidates = np.flatnonzero(self.mask(filters))
+        if len(candidates) == 0:
+            return []
+
+        # Efraimidis-Spirakis: the top-k of log(u) / w is a weighted sample
+        weights = np.maximum(self.columns['popularity'][candidates], 1e-3)
+        keys = np.log(rng.random(len(candidates))) / weights
+        if len(candidates) > count:
+            top = np.argpartition(keys, -count)[-count:]
+            candidates = candidates[top]
+        rng.shuffle(candidates)
+        return self.columns['id'][candidates].tolist()
+
+
+_index = None
+_index_path = None
+_checked_at = 0
+_lock = threading.Lock()
+
+
+def current_path(index_dir=INDEX_DIR):
+    """The snapshot directory CURRENT points at, or None if there isn't one."""
+    try:
+        with open(os.path.join(index_dir, 'CURRENT')) as f:
+            return os.path.join(index_dir, f.read().strip())
+    except OSError:
+        return None
+
+
+def get_index():
+    """Returns the current snapshot, or None if NumPy or a snapshot is missing."""
+    global _index, _index_path, _checked_at
+    if np is None:
+        return None
+
+    now = time.monotonic()
+    if now - _checked_at < RELOAD_INTERVAL:
+        return _index
+
+    with _lock:
+        if now - _checked_at >= RELOAD_INTERVAL:
+            path = current_path()
+            if path != _index_path:
+                try:
+                    _index = CatalogIndex.load(path) if path else None
+                except OSError:
+                    _index = None
+                _index_path = path
+            _checked_at = now
+    return _index
+
+
+def write_snapshot(columns, index_dir=INDEX_DIR, keep=2, dtypes=COLUMNS):
+    """
+    Writes the column arrays as a new snapshot and makes it current. Older
+    snapshots beyond `keep` are removed; workers that still have them mapped
+    keep reading them until they reload.
+    """
+    name = f"snapshot-{time.time_ns()}"
+    path = os.path.join(index_dir, name)
+    os.makedirs(path)
+    for column, dtype in dtypes.items():
+        np.save(os.path.join(path, f"{column}.npy"), np.ascontiguousarray(columns[column], dtype=dtype))
+
+    pointer = os.path.join(index_dir, 'CURRENT')
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(name)
+    os.replace(pointer + '.tmp', pointer)
+
+    snapshots = sorted(entry for entry in os.listdir(index_dir) if entry.startswith('snapshot-'))
+    for old in snapshots[:-keep]:
+        shutil.rmtree(os.path.join(index_dir, old), ignore_errors=True)
+    return path
+
+
+def build_snapshot(index_dir=INDEX_DIR, chunk_size=5000):
+    """Builds a snapshot from the CatalogMovie table. Returns (path, size)."""
+    columns = read_columns(chunk_size)
+    return write_snapshot(columns, index_dir), len(columns['id'])
+
+
+def read_columns(chunk_size=5000):
+    """Reads the CatalogMovie table into column arrays, ordered by ID."""
+    from .models import CatalogMovie, CatalogMovieGenre
+
+    size = CatalogMovie.objects.count()
+    columns = {name: np.zeros(size, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+    rows = CatalogMovie.objects.order_by('id').values_list(
+        'id', 'release_date', 'vote_average', 'vote_count', 'original_language', 'popularity'
+    )
+    i = 0
+    for movie_id, release_date, vote_average, vote_count, language, popularity in rows.iterator(chunk_size=chunk_size):
+        if i >= size:
+            break
+        columns['id'][i] = movie_id
+        columns['year'][i] = release_date.year if release_date else 0
+        columns['vote_average'][i] = vote_average
+        columns['vote_count'][i] = vote_count
+        columns['language'][i] = language_code(language)
+        columns['popularity'][i] = popularity
+        i += 1
+    for name in columns:
+        columns[name] = columns[name][:i]
+
+    # Genres are OR-ed into each movie's bitmask, a chunk at a time
+    ids = columns['id']
+    genre_rows = CatalogMovieGenre.objects.filter(genre_id__in=list(GENRE_BITS)).values_list('movie_id', 'genre_id')
+    chunk = []
+    for row in genre_rows.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            _apply_genres(columns['genres'], ids, chunk)
+            chunk = []
+    if chunk:
+        _apply_genres(columns['genres'], ids, chunk)
+    return columns
+
+
+def _apply_genres(masks, ids, rows):
+    if len(ids) == 0:
+        return
+    pairs = np.array(rows, dtype='int64')
+    positions = np.searchsorted(ids, pairs[:, 0])
+    positions = np.minimum(positions, len(ids) - 1)
+    found = ids[positions] == pairs[:, 0]
+    bits = np.array([GENRE_BITS[genre_id] for genre_id in pairs[:, 1].tolist()], dtype='uint32')
+    np.bitwise_or.at(masks, positions[found], bits[found])
@@ -0,0 +1,346 @@
+"""
+Caching for TMDB lookups: stale-while-revalidate plus single-flight.
+
+Entries are stored with a soft and a hard TTL. Until the soft TTL an entry is
+fresh. Between the soft and hard TTL it is stale: it is still returned right
+away, and one background refresh is started for it. The cache itself drops
+entries at the hard TTL.
+
+On a miss only one caller per key goes to TMDB. Other threads in the same
+process wait for that result, and other workers wait briefly for it to show
+up in the shared cache.
+
+A fetch function returns the value to cache, or None if it failed. Failures
+are never cached, and a stale entry keeps being served until a refresh
+succeeds.
+
+Entries are stored as (RECORD_VERSION, fresh_until, data) tuples. An entry
+written under another RECORD_VERSION reads as a miss.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+SOFT_TTL = getattr(settings, 'TMDB_CACHE_SOFT_TTL', 60 * 60 * 24)
+HARD_TTL = getattr(settings, 'TMDB_CACHE_HARD_TTL', 60 * 60 * 24 * 7)
+
+# Lifetime of the fetching_/refreshing_ markers, in case their owner dies
+LOCK_TIMEOUT = 30
+
+# How long to wait for another worker's fetch before doing it ourselves
+WAIT_TIMEOUT = 3
+POLL_INTERVAL = 0.05
+
+BACKGROUND_WORKERS = getattr(settings, 'TMDB_WARM_WORKERS', 4)
+
+# Bump when the layout of cached values changes (see records.py)
+RECORD_VERSION = 2
+
+MISSING = object()
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+# Per event loop, since asyncio futures belong to one loop
+_async_in_flight = weakref.WeakKeyDictionary()
+
+_executor = None
+_executor_pid = None
+
+
+def run_in_background(fn, *args):
+    """Runs fn on this process's small background thread pool."""
+    global _executor, _executor_pid
+    # Threads don't survive a fork, so each worker starts its own pool
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix='tmdb-background')
+        _executor_pid = os.getpid()
+    return _executor.submit(fn, *args)
+
+
+def wrap(data):
+    return (RECORD_VERSION, time.time() + SOFT_TTL, data)
+
+
+def unwrap(entry):
+    """Returns (data, is_fresh) for a cache entry, or (MISSING, False)."""
+    if not isinstance(entry, tuple) or len(entry) != 3 or entry[0] != RECORD_VERSION:
+        return MISSING, False
+    _, fresh_until, data = entry
+    return data, fresh_until > time.time()
+
+
+def stamp(key):
+    """
+    When the value cached under key was fetched, as a Unix time, or None if
+    there is no fresh entry. Only reads the cache; a stale entry gives None
+    so the caller goes through lookup() and the refresh gets scheduled.
+    """
+    return _stamp(cache.get(key))
+
+
+async def astamp(key):
+    return _stamp(await cache.aget(key))
+
+
+def _stamp(entry):
+    data, fresh = unwrap(entry)
+    return entry[1] - SOFT_TTL if fresh and data is not MISSING else None
+
+
+def _record(key, data, fresh):
+    if data is MISSING:
+        metrics.record_cache(metrics.key_family(key), misses=1)
+    elif fresh:
+        metrics.record_cache(metrics.key_family(key), hits=1)
+    else:
+        metrics.record_cache(metrics.key_family(key), stale=1)
+
+
+def _record_many(keys, results, misses, stale):
+    if keys:
+        family = metrics.key_family(next(iter(keys)))
+        metrics.record_cache(family, hits=len(results) - stale, misses=len(misses), stale=stale)
+
+
+def store(key, data):
+    cache.set(key, wrap(data), HARD_TTL)
+
+
+def _refresh(key, fetch):
+    try:
+        data = fetch()
+        if data is not None:
+            store(key, data)
+    finally:
+        cache.delete(f"refreshing_{key}")
+
+
+def schedule_refresh(key, fetch):
+    """Refreshes a stale entry in the background, once across all workers."""
+    if cache.add(f"refreshing_{key}", True, LOCK_TIMEOUT):
+        run_in_background(_refresh, key, fetch)
+
+
+def _fetch_and_store(key, fetch):
+    data = fetch()
+    if data is not None:
+        store(key, data)
+    return data
+
+
+def _fetch_across_workers(key, fetch):
+    lock_key = f"fetching_{key}"
+    if cache.add(lock_key, True, LOCK_TIMEOUT):
+        try:
+            return _fetch_and_store(key, fetch)
+        finally:
+            cache.delete(lock_key)
+
+    # Another worker is fetching it; wait for the result to be cached
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        data, _ = unwrap(cache.get(key))
+        if data is not MISSING:
+            return data
+    return _fetch_and_store(key, fetch)
+
+
+def _fetch_once(key, fetch):
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+
+    if not leader:
+        return future.result()
+
+    try:
+        data = _fetch_across_workers(key, fetch)
+        future.set_result(data)
+        return data
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
+
+
+def lookup(key, fetch):
+    """Returns the cached value for key, calling fetch() to fill or refresh it."""
+    data, fresh = unwrap(cache.get(key))
+    _record(key, data, fresh)
+    if data is MISSING:
+        return _fetch_once(key, fetch)
+    if not fresh:
+        schedule_refresh(key, fetch)
+    return data
+
+
+def lookup_many(args_by_key, fetch, max_workers):
+    """
+    Batch version of lookup(). args_by_key maps cache keys to the argument
+    passed to fetch() for that key. Cached entries are read with one get_many;
+    misses are fetched in parallel on up to max_workers threads and written
+    back with one set_many. Returns {key: data or None}.
+    """
+    found = cache.get_many(list(args_by_key))
+    results = {}
+    misses = []
+    stale = 0
+    for key, arg in args_by_key.items():
+        data, fresh = unwrap(found.get(key))
+        if data is MISSING:
+            misses.append(key)
+            continue
+        results[key] = data
+        if not fresh:
+            stale += 1
+            schedule_refresh(key, partial(fetch, arg))
+    _record_many(args_by_key, results, misses, stale)
+    if not misses:
+        return results
+
+    # Fetch the misses nobody else in this process is already fetching
+    led, followed = {}, {}
+    with _in_flight_lock:
+        for key in misses:
+            if key in _in_flight:
+                followed[key] = _in_flight[key]
+            else:
+                led[key] = _in_flight[key] = Future()
+
+    try:
+        if led:
+            keys = list(led)
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+                # Each fetch gets a copy of our context so its TMDB calls
+                # count towards this request
+                futures = [executor.submit(contextvars.copy_context().run, fetch, args_by_key[key]) for key in keys]
+                fetched = {key: future.result() for key, future in zip(keys, futures)}
+            to_cache = {key: wrap(data) for key, data in fetched.items() if data is not None}
+            if to_cache:
+                cache.set_many(to_cache, HARD_TTL)
+            for key, data in fetched.items():
+                results[key] = data
+                led[key].set_result(data)
+    except BaseException as e:
+        for future in led.values():
+            if not future.done():
+                future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            for key in led:
+                _in_flight.pop(key, None)
+
+    for key, future in followed.items():
+        results[key] = future.result()
+    return results
+
+
+# Async versions. Fetches run on the event loop; stale refreshes still go
+# through the background thread pool using the sync fetch, so they outlive
+# the request that noticed them.
+
+async def _afetch_and_store(key, afetch):
+    data = await afetch()
+    if data is not None:
+        await cache.aset(key, wrap(data), HARD_TTL)
+    return data
+
+
+async def _afetch_across_workers(key, afetch):
+    lock_key = f"fetching_{key}"
+    if await cache.aadd(lock_key, True, LOCK_TIMEOUT):
+        try:
+            return await _afetch_and_store(key, afetch)
+        finally:
+            await cache.adelete(lock_key)
+
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        data, _ = unwrap(await cache.aget(key))
+        if data is not MISSING:
+            return data
+    return await _afetch_and_store(key, afetch)
+
+
+async def _afetch_once(key, afetch):
+    flights = _async_in_flight.setdefault(asyncio.get_running_loop(), {})
+    if key in flights:
+        return await asyncio.shield(flights[key])
+
+    future = flights[key] = asyncio.get_running_loop().create_future()
+    try:
+        data = await _afetch_across_workers(key, afetch)
+        future.set_result(data)
+        return data
+    except asyncio.CancelledError:
+        # Only this request was cancelled; the others see a miss, like a failed fetch
+        future.set_result(None)
+        raise
+    except BaseException as e:
+        # Waiters get the real error, as in _fetch_once
+        future.set_exception(e)
+        # Marks it retrieved, so asyncio doesn't log it when nobody was waiting
+        future.exception()
+        raise
+    finally:
+        flights.pop(key, None)
+
+
+async def alookup(key, afetch, fetch):
+    """Async version of lookup(). fetch is the sync fetch used for refreshes."""
+    data, fresh = unwrap(await cache.aget(key))
+    _record(key, data, fresh)
+    if data is MISSING:
+        return await _afetch_once(key, afetch)
+    if not fresh:
+        await sync_to_async(schedule_refresh)(key, fetch)
+    return data
+
+
+async def alookup_many(args_by_key, afetch, fetch, concurrency):
+    """Async version of lookup_many(); misses are fetched concurrently."""
+    found = await cache.aget_many(list(args_by_key))
+    results = {}
+    misses = []
+    stale = 0
+    for key, arg in args_by_key.items():
+        data, fresh = unwrap(found.get(key))
+        if data is MISSING:
+            misses.append(key)
+            continue
+        results[key] = data
+        if not fresh:
+            stale += 1
+            await sync_to_async(schedule_refresh)(key, partial(fetch, arg))
+    _record_many(args_by_key, results, misses, stale)
+    if not misses:
+        return results
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(key):
+        async with semaphore:
+            return await _afetch_once(key, partial(afetch, args_by_key[key]))
+
+    fetched = await asyncio.gather(*(fetch_one(key) for key in misses))
+    results.update(zip(misses, fetched))
+    return results
@@ -2,6 +2,8 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.models import User
 
+from .models import UserMovieList
+
 # 1. Hardcoded list of genres with their TMDB IDs
 GENRE_CHOICES = [
     ('', 'Any Genre'),
@@ -119,4 +121,24 @@ class CustomUserCreationForm(UserCreationForm):
 
 class CustomAuthenticationForm(AuthenticationForm):
     username = forms.CharField(widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Username'}))
-    password = forms.CharField(widget=forms.PasswordInput(attrs={'class': 'form-control', 'placeholder': 'Password'}))
\ No newline at end of file
+    password = forms.CharField(widget=forms.PasswordInput(attrs={'class': 'form-control', 'placeholder': 'Password'}))
+
+class ListImportForm(forms.Form):
+    file = forms.FileField(
+        label="CSV file",
+        widget=forms.ClearableFileInput(attrs={'class': 'w-full p-3 border border-dark-border rounded bg-dark-surface text-white text-base', 'accept': '.csv,text/csv'})
+    )
+    status = forms.ChoiceField(
+        label="Add to",
+        choices=UserMovieList.STATUS_CHOICES,
+        widget=forms.Select(attrs={'class': MovieFilterForm.form_select_classes})
+    )
+
+    def __init__(self, *args, **kwargs):
+        # list_import imports catalog_index, which imports this module
+        from . import list_import
+        super().__init__(*args, **kwargs)
+        self.fields['file'].help_text = (
+            f"Up to {list_import.MAX_ROWS} rows are imported per upload; rows past that, or past "
+            f"{list_import.TIME_LIMIT} seconds of lookups, are skipped."
+        )
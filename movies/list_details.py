@@ -0,0 +1,119 @@
+"""
+Keeps the TMDB display fields on UserMovieList rows (title and poster_path)
+filled in, so the profile page can render from the database alone.
+
+add_to_list fills them in when a row is written, and the
+backfill_list_details command fills in older rows. Rows that are missing
+them or are older than REFRESH_AFTER are refreshed in the background when a
+profile page shows them; the page itself never waits for that.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from . import fetch_cache, records, tmdb_api
+from .models import UserMovieList
+
+# Titles and posters rarely change; refresh them about once a month
+REFRESH_AFTER = getattr(settings, 'LIST_DETAILS_REFRESH_AFTER', 60 * 60 * 24 * 30)
+
+FIELDS = ('title', 'poster_path', 'details_refreshed_on')
+
+# Shown for rows that have never been filled in: older rows not yet
+# backfilled, refreshes that failed, and movies TMDB no longer has
+PLACEHOLDER_TITLE = "Title unavailable"
+
+
+def display_fields(movie):
+    """The UserMovieList fields for a movie from tmdb_api, or {} if there is none."""
+    if not movie:
+        return {}
+    return {'title': movie['title'], 'poster_path': movie['poster_path'], 'details_refreshed_on': timezone.now()}
+
+
+def is_stale(entry, now=None):
+    if entry.details_refreshed_on is None:
+        return True
+    now = now or timezone.now()
+    return entry.details_refreshed_on < now - datetime.timedelta(seconds=REFRESH_AFTER)
+
+
+def refresh(entries):
+    """
+    Looks up the display fields for the rows in one batch and saves them
+    with one bulk_update. Rows whose movie TMDB couldn't give us are left
+    unchanged. Returns the number of rows updated.
+    """
+    entries = list(entries)
+    if not entries:
+        return 0
+    movie_ids = list({entry.movie_id for entry in entries})
+    movies = dict(zip(movie_ids, tmdb_api.get_movie_details_many(movie_ids)))
+
+    updated = []
+    for entry in entries:
+        fields = display_fields(movies.get(entry.movie_id))
+        if fields:
+            for name, value in fields.items():
+                setattr(entry, name, value)
+            updated.append(entry)
+    UserMovieList.objects.bulk_update(updated, FIELDS)
+    return len(updated)
+
+
+def _refresh_in_background(entry_ids, lock_key):
+    try:
+        refresh(UserMovieList.objects.filter(id__in=entry_ids))
+    finally:
+        cache.delete(lock_key)
+        # Pool threads outlive the request cycle that would close this
+        connection.close()
+
+
+def prepare(entries):
+    """
+    Gets rows ready to render. Rows that are stale or were never filled in
+    are refreshed in the background (once across workers), so rendering
+    never waits on TMDB. Returns the rows; as_movie gives the ones with
+    nothing to show yet a placeholder title, so they still appear (and can
+    be removed) and the page agrees with the list counts.
+    """
+    now = timezone.now()
+    stale = [entry.id for entry in entries if is_stale(entry, now)]
+    if stale:
+        # One lock for the page rather than one per row, so a page of stale
+        # rows costs a single cache write
+        lock_key = f"refreshing_list_{entries[0].user_id}_{entries[0].id}"
+        if cache.add(lock_key, True, fetch_cache.LOCK_TIMEOUT):
+            fetch_cache.run_in_background(_refresh_in_background, stale, lock_key)
+
+    return entries
+
+
+def from_cache(movie_ids):
+    """
+    {movie_id: (title, poster_path)} for the movies whose details are in the
+    cache, read with one get_many. Never calls TMDB.
+    """
+    keys = {}
+    for movie_id in movie_ids:
+        keys[f"movie_full_{movie_id}"] = movie_id
+        keys[f"movie_details_{movie_id}"] = movie_id
+    found = {}
+    for key, entry in cache.get_many(list(keys)).items():
+        data, _ = fetch_cache.unwrap(entry)
+        if data is fetch_cache.MISSING or not data:
+            # Written under another RECORD_VERSION
+            continue
+        # movie_full_ entries are (movie record, credits record)
+        movie = records.movie_from_record(data[0] if key.startswith('movie_full_') else data)
+        found[keys[key]] = (movie['title'], movie['poster_path'])
+    return found
+
+
+def as_movie(entry):
+    """The movie dict shape profile_page.html expects."""
+    return {'id': entry.movie_id, 'title': entry.title or PLACEHOLDER_TITLE, 'poster_path': entry.poster_path}
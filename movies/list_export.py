@@ -0,0 +1,123 @@
+"""
+Streams a user's lists as CSV or JSON lines for the profile/export/ view.
+
+Rows are read BATCH_SIZE at a time with keyset pagination on the
+(user, status, added_on) index, and each batch is written out as soon as
+it's ready, so memory use is the same for ten movies or ten thousand and
+nothing waits for the whole file. Rows whose display fields were never
+filled in get them from the cache, one get_many per batch; the export
+never waits on TMDB.
+
+Under ASGI the response needs an async iterator, or Django collects a sync
+one into a list before sending anything. achunks() fetches each batch with
+sync_to_async instead.
+
+The CSV has a tmdb_id column, so it can be imported again with the
+import page (see list_import).
+"""
+import csv
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+
+from . import list_details
+from .models import UserMovieList
+
+BATCH_SIZE = getattr(settings, 'LIST_EXPORT_BATCH_SIZE', 500)
+
+FIELDS = ('tmdb_id', 'title', 'status', 'added_on', 'poster_path')
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def _batch(user, status, after, batch_size):
+    """
+    The batch_size rows in export order that come after the row keyed by
+    after, or the first ones for None, as tuples in FIELDS order. Returns
+    (rows, key of the last row).
+    """
+    entries = UserMovieList.objects.filter(user=user)
+    if status:
+        entries = entries.filter(status=status)
+    if after:
+        after_status, after_added_on, after_id = after
+        entries = entries.filter(
+            Q(status__gt=after_status)
+            | Q(status=after_status, added_on__lt=after_added_on)
+            | Q(status=after_status, added_on=after_added_on, id__lt=after_id)
+        )
+    batch = list(entries.order_by('status', '-added_on', '-id').values_list(
+        'id', 'movie_id', 'title', 'status', 'added_on', 'poster_path',
+    )[:batch_size])
+    if not batch:
+        return [], None
+
+    missing = {movie_id for _, movie_id, title, *_ in batch if not title}
+    cached = list_details.from_cache(missing) if missing else {}
+    exported = []
+    for _, movie_id, title, list_status, added_on, poster_path in batch:
+        if not title and movie_id in cached:
+            title, poster_path = cached[movie_id]
+        exported.append((movie_id, title, list_status, added_on.isoformat(), poster_path))
+    entry_id, _, _, list_status, added_on, _ = batch[-1]
+    return exported, (list_status, added_on, entry_id)
+
+
+def rows(user, status=None, batch_size=BATCH_SIZE):
+    """Yields lists of up to batch_size rows, as tuples in FIELDS order."""
+    after = None
+    while True:
+        batch, after = _batch(user, status, after, batch_size)
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+
+
+async def arows(user, status=None, batch_size=BATCH_SIZE):
+    """Async version of rows(); each batch is read in a thread."""
+    after = None
+    while True:
+        batch, after = await sync_to_async(_batch)(user, status, after, batch_size)
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+
+
+def _csv(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _jsonl(rows):
+    return ''.join(json.dumps(dict(zip(FIELDS, row))) + '\n' for row in rows)
+
+
+def chunks(export_format, user, status=None, batch_size=BATCH_SIZE):
+    """Yields the export one batch of lines at a time, after the CSV header."""
+    if export_format == 'jsonl':
+        write = _jsonl
+    else:
+        write = _csv
+        yield _csv([FIELDS])
+    for batch in rows(user, status, batch_size):
+        yield write(batch)
+
+
+async def achunks(export_format, user, status=None, batch_size=BATCH_SIZE):
+    """Async version of chunks(), for StreamingHttpResponse under ASGI."""
+    if export_format == 'jsonl':
+        write = _jsonl
+    else:
+        write = _csv
+        yield _csv([FIELDS])
+    async for batch in arows(user, status, batch_size):
+        yield write(batch)
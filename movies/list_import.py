@@ -0,0 +1,230 @@
+"""
+Imports a watchlist or watched list from a CSV export into UserMovieList.
+
+The file is read as a stream and handled CHUNK_SIZE rows at a time, so
+memory use doesn't grow with the file. Each chunk costs a few queries:
+1. rows that carry a TMDB ID are used as they are;
+2. titles are matched against the local catalog in one query;
+3. the rest are looked up with tmdb_api.search_movies, which reads cached
+   searches with one get_many and searches TMDB in parallel for the misses;
+4. matches are upserted with one bulk_create(update_conflicts=True) on
+   the (user, movie_id) unique constraint.
+
+The import page runs inside the request, so it stops after MAX_ROWS rows
+or once TIME_LIMIT seconds have passed, whichever comes first; the
+import_list command can be given more room.
+
+Letterboxd exports (Date, Name, Year, Letterboxd URI) work as they are.
+Other CSVs need a title/name column, or a tmdb_id column, and may have a
+year column.
+"""
+import csv
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import catalog, seen_movies, tmdb_api
+from .models import UserMovieList
+
+CHUNK_SIZE = getattr(settings, 'LIST_IMPORT_CHUNK_SIZE', 200)
+
+# Rows past this are ignored, so one upload can't keep a worker busy for long.
+# Each title that isn't cached or in the catalog costs a TMDB search behind
+# the shared rate limit.
+MAX_ROWS = getattr(settings, 'LIST_IMPORT_MAX_ROWS', 1000)
+
+# No new chunk is started after this many seconds, so an upload finishes
+# well inside the worker timeout (gunicorn's default is 30s)
+TIME_LIMIT = getattr(settings, 'LIST_IMPORT_TIME_LIMIT', 20)
+
+# How many unmatched (or failed) titles to report back
+MAX_UNMATCHED = 20
+
+TITLE_COLUMNS = ('name', 'title', 'movie', 'film')
+YEAR_COLUMNS = ('year', 'release year')
+ID_COLUMNS = ('tmdb_id', 'tmdbid', 'tmdb id', 'movie_id')
+
+
+class ListImportError(ValueError):
+    """The file isn't a CSV we can import."""
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        # The first MAX_UNMATCHED titles that didn't match, and how many didn't
+        self.unmatched = []
+        self.unmatched_count = 0
+        # Likewise for titles that couldn't be searched because TMDB failed
+        self.failed = []
+        self.failed_count = 0
+        # False if the row limit or time limit stopped the import early
+        self.complete = True
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"Imported {self.imported} of {self.rows} movies in {self.seconds:.1f}s "
+                f"({self.rows_per_second:.0f} rows/s)")
+
+
+def _find_column(header, names):
+    for name in names:
+        if name in header:
+            return header[name]
+    return None
+
+
+def _parse_year(value):
+    try:
+        year = int((value or '').strip()[:4])
+    except ValueError:
+        return None
+    return year if 1850 <= year <= 2100 else None
+
+
+def read_rows(lines):
+    """
+    Yields (tmdb_id, title, year) for each row of a CSV, where tmdb_id or
+    year may be None. lines is any iterable of text lines, e.g. a file
+    opened with newline=''.
+    """
+    reader = csv.reader(lines)
+    try:
+        header_row = next(reader, None)
+    except csv.Error as e:
+        raise ListImportError(f"Not a CSV file: {e}")
+    if not header_row:
+        raise ListImportError("The file is empty.")
+
+    header = {name.strip().lower(): i for i, name in enumerate(header_row)}
+    id_column = _find_column(header, ID_COLUMNS)
+    title_column = _find_column(header, TITLE_COLUMNS)
+    year_column = _find_column(header, YEAR_COLUMNS)
+    if id_column is None and title_column is None:
+        raise ListImportError("The file needs a Title (or Name) column or a tmdb_id column.")
+
+    def cell(row, column):
+        return row[column].strip() if column is not None and column < len(row) else ''
+
+    try:
+        for row in reader:
+            tmdb_id = cell(row, id_column)
+            title = cell(row, title_column)[:255]
+            if tmdb_id.isdigit():
+                yield int(tmdb_id), title, None
+            elif title:
+                yield None, title, _parse_year(cell(row, year_column))
+    except csv.Error as e:
+        raise ListImportError(f"Couldn't read line {reader.line_num}: {e}")
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _match(chunk):
+    """
+    Returns {movie_id: (title, poster_path)} for the rows of one chunk, the
+    titles that didn't match anything and the titles that couldn't be
+    searched for because TMDB failed. title and poster_path are '' when
+    only the ID is known; list_details fills them in later.
+    """
+    matched = {}
+    queries = set()
+    for tmdb_id, title, year in chunk:
+        if tmdb_id:
+            matched.setdefault(tmdb_id, ('', ''))
+        else:
+            queries.add((title, year))
+
+    if queries and catalog.has_titles():
+        for query, (movie_id, title, poster_path) in catalog.find_titles(queries).items():
+            matched[movie_id] = (title, poster_path)
+            queries.discard(query)
+
+    unmatched, failed = [], []
+    if queries:
+        for (title, year), found in tmdb_api.search_movies(queries).items():
+            if found:
+                movie_id, found_title, poster_path = found
+                matched[movie_id] = (found_title, poster_path)
+            elif found is None:
+                failed.append(f"{title} ({year})" if year else title)
+            else:
+                unmatched.append(f"{title} ({year})" if year else title)
+    return matched, unmatched, failed
+
+
+@transaction.atomic
+def _save(user, status, matched):
+    now = timezone.now()
+    with_details, without_details = [], []
+    for movie_id, (title, poster_path) in matched.items():
+        if title:
+            with_details.append(UserMovieList(
+                user=user, movie_id=movie_id, status=status,
+                title=title, poster_path=poster_path, details_refreshed_on=now,
+            ))
+        else:
+            without_details.append(UserMovieList(user=user, movie_id=movie_id, status=status))
+
+    # Like add_to_list, importing a movie that's already saved moves it to
+    # this list. Rows we have no title for keep the details they had.
+    UserMovieList.objects.bulk_create(
+        with_details, update_conflicts=True, unique_fields=['user', 'movie_id'],
+        update_fields=['status', 'title', 'poster_path', 'details_refreshed_on'],
+    )
+    UserMovieList.objects.bulk_create(
+        without_details, update_conflicts=True, unique_fields=['user', 'movie_id'], update_fields=['status'],
+    )
+    # Only once the rows are committed: a read in between would cache the
+    # old set again, and a rollback would leave nothing to drop
+    transaction.on_commit(lambda: seen_movies.changed(user))
+    return len(matched)
+
+
+def import_rows(user, lines, status, chunk_size=CHUNK_SIZE, max_rows=MAX_ROWS, time_limit=TIME_LIMIT):
+    """
+    Imports a CSV (an iterable of text lines) into the user's list with the
+    given status, stopping after max_rows rows or at the end of the first
+    chunk that finishes after time_limit seconds (None for no limit).
+    Raises ListImportError if the file can't be read as a list. Returns an
+    ImportResult.
+    """
+    result = ImportResult()
+    started = time.perf_counter()
+
+    rows = read_rows(lines)
+    for chunk in _chunks(rows, chunk_size):
+        # The first chunk always runs, so every upload makes progress
+        out_of_time = time_limit is not None and time.perf_counter() - started >= time_limit
+        if result.rows >= max_rows or (result.rows and out_of_time):
+            result.complete = False
+            break
+        if len(chunk) > max_rows - result.rows:
+            chunk = chunk[:max_rows - result.rows]
+            result.complete = False
+        result.rows += len(chunk)
+        matched, unmatched, failed = _match(chunk)
+        result.imported += _save(user, status, matched)
+        result.unmatched.extend(unmatched[:MAX_UNMATCHED - len(result.unmatched)])
+        result.unmatched_count += len(unmatched)
+        result.failed.extend(failed[:MAX_UNMATCHED - len(result.failed)])
+        result.failed_count += len(failed)
+
+    result.seconds = time.perf_counter() - started
+    return result
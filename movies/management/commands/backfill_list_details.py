@@ -0,0 +1,54 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from movies import list_details
+from movies.models import UserMovieList
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills in the title and poster on saved movies that don't have them yet, "
+        "in batches. Safe to stop and re-run; it picks up where it left off."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--stale', action='store_true',
+                            help="Also refresh rows last refreshed more than LIST_DETAILS_REFRESH_AFTER seconds ago")
+        parser.add_argument('--start-after', type=int, default=0, metavar='ID',
+                            help="Skip rows up to and including this id")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Seconds to sleep between batches, to go easy on TMDB")
+
+    def handle(self, *args, **options):
+        pending = Q(details_refreshed_on__isnull=True)
+        if options['stale']:
+            cutoff = timezone.now() - datetime.timedelta(seconds=list_details.REFRESH_AFTER)
+            pending |= Q(details_refreshed_on__lt=cutoff)
+        rows = UserMovieList.objects.filter(pending).order_by('id')
+
+        # Walk the rows by id, so rows TMDB can't give us don't get retried forever
+        last_id = options['start_after']
+        total = updated = 0
+        started = time.monotonic()
+        while True:
+            batch = list(rows.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            updated += list_details.refresh(batch)
+            total += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f"Up to id {last_id}: {updated}/{total} rows filled in")
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {updated} of {total} rows filled in in {elapsed:.1f}s"
+        ))
+        if updated < total:
+            self.stdout.write(f"{total - updated} rows couldn't be fetched; run again later to retry them.")
@@ -0,0 +1,155 @@
+import datetime
+import random
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from movies import catalog, catalog_index, tmdb_api, tmdb_client
+from movies.forms import GENRE_CHOICES, LANGUAGE_CHOICES, RATING_CHOICES
+from movies.models import CatalogMovie, CatalogMovieGenre
+
+GENRE_IDS = [genre_id for genre_id, _ in GENRE_CHOICES if genre_id]
+LANGUAGES = [code for code, _ in LANGUAGE_CHOICES if code]
+
+
+def random_filters(rng):
+    """A random MovieFilterForm submission; each field is left blank half the time."""
+    filters = {}
+    if rng.random() < 0.5:
+        filters['genre'] = str(rng.choice(GENRE_IDS))
+    if rng.random() < 0.5:
+        filters['year_from'] = rng.randint(1950, 2015)
+        if rng.random() < 0.5:
+            filters['year_to'] = filters['year_from'] + rng.randint(5, 30)
+    if rng.random() < 0.5:
+        filters['rating'] = str(rng.choice([code for code, _ in RATING_CHOICES if code]))
+    if rng.random() < 0.5:
+        filters['language'] = rng.choice(LANGUAGES[:8])
+    return filters
+
+
+def synthetic_catalog(size, seed):
+    """Column arrays for `size` made-up movies with roughly TMDB-like distributions."""
+    np = catalog_index.np
+    rng = np.random.default_rng(seed)
+
+    bits = np.array(list(catalog_index.GENRE_BITS.values()), dtype='uint32')
+    genres = np.zeros(size, dtype='uint32')
+    for _ in range(3):
+        picked = bits[rng.integers(0, len(bits), size)]
+        genres |= np.where(rng.random(size) < 0.7, picked, 0).astype('uint32')
+
+    # English dominates, then a long tail
+    weights = np.array([0.5] + [0.5 / (len(LANGUAGES) - 1)] * (len(LANGUAGES) - 1))
+    languages = rng.choice(LANGUAGES, size=size, p=weights)
+
+    return {
+        'id': np.arange(1, size + 1, dtype='int32'),
+        'genres': genres,
+        'year': rng.integers(1920, 2026, size).astype('int16'),
+        'vote_average': np.clip(rng.normal(6.2, 1.2, size), 0, 10).astype('float32'),
+        'vote_count': rng.lognormal(4, 2, size).astype('int32'),
+        'language': np.array([catalog_index.language_code(code) for code in languages], dtype='uint16'),
+        'popularity': rng.lognormal(1, 1.5, size).astype('float32'),
+        '_languages': languages,
+    }
+
+
+def summarize(name, timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return f"{name:<8} n={len(timings):<5} mean={statistics.mean(timings):8.2f} ms  p50={statistics.median(timings):8.2f} ms  p95={p95:8.2f} ms"
+
+
+def time_queries(queries, run):
+    timings = []
+    for filters in queries:
+        started = time.perf_counter()
+        run(filters)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares filter+sample latency of the NumPy catalog index against the "
+        "SQL catalog and live TMDB, on a synthetic catalog."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=500_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--sql', action='store_true',
+                            help="Also load the catalog into a throwaway test database and time the SQL path (slow to set up)")
+        parser.add_argument('--tmdb', type=int, default=0, metavar='N',
+                            help="Also time N uncached TMDB discover calls (needs TMDB_API_KEY)")
+
+    def handle(self, *args, **options):
+        if catalog_index.np is None:
+            raise CommandError("NumPy is not installed.")
+
+        size = options['movies']
+        rng = random.Random(options['seed'])
+        queries = [random_filters(rng) for _ in range(options['queries'])]
+
+        self.stdout.write(f"Generating {size} synthetic movies...")
+        columns = synthetic_catalog(size, options['seed'])
+
+        with tempfile.TemporaryDirectory() as index_dir:
+            path = catalog_index.write_snapshot(columns, index_dir)
+            index = catalog_index.CatalogIndex.load(path)
+            index.sample(queries[0], catalog.PAGE_SIZE) # Fault the pages in
+            results = [summarize('numpy', time_queries(queries, lambda f: index.sample(f, catalog.PAGE_SIZE)))]
+
+        if options['sql']:
+            results.append(summarize('sql', self.time_sql(columns, queries)))
+
+        if options['tmdb']:
+            results.append(summarize('tmdb', time_queries(queries[:options['tmdb']], self.fetch_from_tmdb)))
+
+        self.stdout.write("")
+        for line in results:
+            self.stdout.write(line)
+
+    def fetch_from_tmdb(self, filters):
+        params = tmdb_api._discover_params(filters)
+        tmdb_client.get(f"{tmdb_api.BASE_URL}/discover/movie", params=params)
+
+    def time_sql(self, columns, queries):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write("Loading the synthetic catalog into a test database...")
+            self.load_catalog(columns)
+            catalog.discover_from_database(queries[0], tmdb_api.MAX_DISCOVER_PAGES)
+            return time_queries(queries, lambda f: catalog.discover_from_database(f, tmdb_api.MAX_DISCOVER_PAGES))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def load_catalog(self, columns, batch_size=5000):
+        bits = list(catalog_index.GENRE_BITS.items())
+        for start in range(0, len(columns['id']), batch_size):
+            stop = start + batch_size
+            movies, genres = [], []
+            for i in range(start, min(stop, len(columns['id']))):
+                movie_id = int(columns['id'][i])
+                movies.append(CatalogMovie(
+                    id=movie_id,
+                    title=f"Movie {movie_id}",
+                    release_date=datetime.date(int(columns['year'][i]), 1, 1),
+                    vote_average=float(columns['vote_average'][i]),
+                    vote_count=int(columns['vote_count'][i]),
+                    original_language=str(columns['_languages'][i]),
+                    popularity=float(columns['popularity'][i]),
+                ))
+                mask = int(columns['genres'][i])
+                genres.extend(
+                    CatalogMovieGenre(movie_id=movie_id, genre_id=genre_id)
+                    for genre_id, bit in bits if mask & bit
+                )
+            CatalogMovie.objects.bulk_create(movies)
+            CatalogMovieGenre.objects.bulk_create(genres)
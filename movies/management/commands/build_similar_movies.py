@@ -0,0 +1,41 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies import similar_movies
+
+
+class Command(BaseCommand):
+    help = (
+        "Precomputes the 'more like this' neighbors of every catalog movie (and "
+        "every saved movie the cache has details for). Run it after "
+        "ingest_catalog; workers pick the new table up within a minute."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--neighbors', type=int, default=similar_movies.NEIGHBORS,
+                            help="Neighbors to keep per movie")
+        parser.add_argument('--batch-size', type=int, default=similar_movies.BATCH_SIZE,
+                            help="Movies compared per matrix product; memory grows with it")
+
+    def handle(self, *args, **options):
+        if similar_movies.np is None:
+            raise CommandError("NumPy is not installed.")
+
+        started = time.monotonic()
+        try:
+            path, size = similar_movies.build(k=options['neighbors'], batch_size=options['batch_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Found neighbors for {size} movies in {elapsed:.1f}s, in {path}"))
+
+        # Time lookups against the table just written, the way a worker reads it
+        table = similar_movies.SimilarTable.load(path)
+        movie_ids = random.Random(0).choices(table.ids.tolist(), k=10_000)
+        started = time.perf_counter()
+        for movie_id in movie_ids:
+            table.lookup(movie_id)
+        per_lookup = (time.perf_counter() - started) / len(movie_ids)
+        self.stdout.write(f"Lookup: {per_lookup * 1_000_000:.1f} us per movie")
@@ -0,0 +1,272 @@
+import json
+import random
+import zlib
+from io import BytesIO
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from movies.forms import GENRE_CHOICES, LANGUAGE_CHOICES
+
+GENRES = {genre_id: name for genre_id, name in GENRE_CHOICES if genre_id}
+LANGUAGES = [code for code, _ in LANGUAGE_CHOICES if code]
+
+PAGE_SIZE = 20
+# TMDB never serves pages past this
+MAX_PAGES = 500
+
+WORDS = (
+    "Last Night Dark Summer Return Secret City Road Love Dead Storm River House Empire "
+    "Shadow Light Lost Blood Silent Golden Iron Winter Ghost Star War Heart Edge Fire"
+).split()
+
+
+def synthetic_movies(count, seed):
+    """Made-up movies with roughly TMDB-like distributions, keyed by id."""
+    rng = random.Random(seed)
+    movies = {}
+    for movie_id in range(1, count + 1):
+        genre_ids = rng.sample(list(GENRES), rng.choice((1, 2, 2, 3)))
+        year = rng.randint(1930, 2025)
+        movies[movie_id] = {
+            'id': movie_id,
+            'title': ' '.join(rng.sample(WORDS, rng.randint(1, 3))),
+            'overview': ' '.join(rng.choices(WORDS, k=rng.randint(20, 60))).capitalize() + '.',
+            'release_date': f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            'genre_ids': genre_ids,
+            'vote_average': round(min(10, max(0, rng.gauss(6.3, 1.1))), 1),
+            'vote_count': int(rng.lognormvariate(5, 1.8)),
+            'popularity': round(rng.lognormvariate(1.5, 1.3), 3),
+            # English dominates, then a long tail
+            'original_language': 'en' if rng.random() < 0.6 else rng.choice(LANGUAGES),
+            # Shaped like TMDB's names, which posters.py insists on
+            'poster_path': f"/fake{movie_id:0>23}.jpg",
+            'runtime': rng.randint(75, 180),
+        }
+    return movies
+
+
+def matches(movie, query):
+    """Applies the /discover/movie filters tmdb_api sends."""
+    def param(name):
+        return query.get(name, [None])[0]
+
+    if param('with_genres') and int(param('with_genres')) not in movie['genre_ids']:
+        return False
+    if param('primary_release_date.gte') and movie['release_date'] < param('primary_release_date.gte'):
+        return False
+    if param('primary_release_date.lte') and movie['release_date'] > param('primary_release_date.lte'):
+        return False
+    if param('vote_average.gte') and movie['vote_average'] < float(param('vote_average.gte')):
+        return False
+    if param('vote_count.gte') and movie['vote_count'] < int(param('vote_count.gte')):
+        return False
+    if param('with_original_language') and movie['original_language'] != param('with_original_language'):
+        return False
+    return True
+
+
+class FakeTMDBServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, movies, latency, jitter, error_rate, throttle_rate, seed):
+        super().__init__(address, FakeTMDBHandler)
+        self.movies = movies
+        # Popularity order, like sort_by=popularity.desc
+        self.by_popularity = sorted(movies.values(), key=lambda movie: -movie['popularity'])
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.discover_cache = {}
+        self.images = {}
+        self.counts = {'requests': 0, 'errors': 0, 'throttled': 0}
+
+    def random(self):
+        with self.lock:
+            return self.rng.random()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+
+class FakeTMDBHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        # One line per request would drown the load test output
+        pass
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.count('requests')
+
+        delay = server.latency + server.jitter * server.random()
+        if delay:
+            time.sleep(delay / 1000)
+
+        if server.random() < server.throttle_rate:
+            server.count('throttled')
+            return self.send_json(429, {'status_code': 25, 'status_message': "Your request count is over the allowed limit."},
+                                  {'Retry-After': '1'})
+        if server.random() < server.error_rate:
+            server.count('errors')
+            return self.send_json(503, {'status_code': 11, 'status_message': "Internal error."})
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+        # Poster images, as under TMDB_IMAGE_BASE_URL=http://host:port/t/p
+        if parts[:2] == ['t', 'p'] and len(parts) == 4:
+            return self.send_image(parts[3])
+        # Accept paths with or without the /3 version prefix
+        if parts and parts[0] == '3':
+            parts = parts[1:]
+
+        if parts == ['discover', 'movie']:
+            return self.send_json(200, self.discover(query))
+        if parts == ['search', 'movie']:
+            return self.send_json(200, self.search(query))
+        if len(parts) >= 2 and parts[0] == 'movie' and parts[1].isdigit():
+            movie = server.movies.get(int(parts[1]))
+            if movie is None:
+                return self.send_json(404, {'status_code': 34, 'status_message': "The resource you requested could not be found."})
+            if parts[2:] == ['credits']:
+                return self.send_json(200, self.credits(movie))
+            if not parts[2:]:
+                return self.send_json(200, self.details(movie, query))
+        self.send_json(404, {'status_code': 34, 'status_message': "The resource you requested could not be found."})
+
+    def send_image(self, name):
+        body = self.server.images.get(name)
+        if body is None:
+            # A flat 500x750 poster in a color picked from the name
+            color = zlib.crc32(name.encode()).to_bytes(4, 'big')[:3]
+            out = BytesIO()
+            Image.new('RGB', (500, 750), tuple(color)).save(out, 'JPEG', quality=90)
+            body = self.server.images[name] = out.getvalue()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def discover(self, query):
+        key = tuple(sorted((name, tuple(values)) for name, values in query.items() if name not in ('page', 'api_key')))
+        results = self.server.discover_cache.get(key)
+        if results is None:
+            results = [movie for movie in self.server.by_popularity if matches(movie, query)]
+            self.server.discover_cache[key] = results
+
+        page = max(1, int(query.get('page', ['1'])[0]))
+        total_pages = min(MAX_PAGES, (len(results) + PAGE_SIZE - 1) // PAGE_SIZE)
+        start = (page - 1) * PAGE_SIZE
+        fields = ('id', 'title', 'overview', 'release_date', 'genre_ids', 'vote_average', 'vote_count',
+                  'popularity', 'original_language', 'poster_path')
+        return {
+            'page': page,
+            'results': [{name: movie[name] for name in fields} for movie in results[start:start + PAGE_SIZE]] if page <= total_pages else [],
+            'total_pages': total_pages,
+            'total_results': len(results),
+        }
+
+    def search(self, query):
+        # Exact title match only, most popular first, like a good TMDB search
+        title = query.get('query', [''])[0].casefold()
+        year = query.get('primary_release_year', [None])[0]
+        results = [
+            movie for movie in self.server.by_popularity
+            if movie['title'].casefold() == title and (not year or movie['release_date'][:4] == year)
+        ]
+        fields = ('id', 'title', 'release_date', 'poster_path', 'popularity')
+        return {
+            'page': 1,
+            'results': [{name: movie[name] for name in fields} for movie in results[:PAGE_SIZE]],
+            'total_pages': 1,
+            'total_results': len(results),
+        }
+
+    def details(self, movie, query):
+        data = {name: value for name, value in movie.items() if name != 'genre_ids'}
+        data['genres'] = [{'id': genre_id, 'name': GENRES[genre_id]} for genre_id in movie['genre_ids']]
+        data['original_title'] = movie['title']
+        data['status'] = 'Released'
+        if 'credits' in query.get('append_to_response', [''])[0].split(','):
+            data['credits'] = self.credits(movie)
+        return data
+
+    def credits(self, movie):
+        rng = random.Random(movie['id'])
+        people = list(range(1, 5001))
+        cast = rng.sample(people, 12)
+        return {
+            'id': movie['id'],
+            'cast': [{'id': person, 'name': f"Actor {person}", 'character': f"Role {i + 1}", 'order': i}
+                     for i, person in enumerate(cast)],
+            'crew': [{'id': person, 'name': f"Crew {person}", 'job': job}
+                     for person, job in zip(rng.sample(people, 4), ('Producer', 'Director', 'Writer', 'Editor'))],
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves a local stand-in for the TMDB API (/discover/movie, /search/movie, "
+        "/movie/<id>, /movie/<id>/credits) from a synthetic dataset, with configurable latency "
+        "and injected errors. Run the app with TMDB_BASE_URL=http://127.0.0.1:<port>/3 "
+        "(and TMDB_IMAGE_BASE_URL=http://127.0.0.1:<port>/t/p for posters)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--movies', type=int, default=20_000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--latency', type=float, default=80, help="Minimum response time in ms")
+        parser.add_argument('--jitter', type=float, default=120, help="Extra random response time, up to this many ms")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with a 503")
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of requests answered with a 429")
+        parser.add_argument('--export', metavar='PATH',
+                            help="Write the dataset as JSON lines (for ingest_catalog) and exit")
+
+    def handle(self, *args, **options):
+        movies = synthetic_movies(options['movies'], options['seed'])
+
+        if options['export']:
+            with open(options['export'], 'w') as f:
+                for movie in movies.values():
+                    f.write(json.dumps(movie) + '\n')
+            self.stdout.write(f"Wrote {len(movies)} movies to {options['export']}")
+            return
+
+        server = FakeTMDBServer(
+            (options['host'], options['port']), movies,
+            options['latency'], options['jitter'], options['error_rate'], options['throttle_rate'], options['seed'],
+        )
+        self.stdout.write(
+            f"Fake TMDB with {len(movies)} movies on http://{options['host']}:{options['port']}/3 "
+            f"(latency {options['latency']:g}+{options['jitter']:g} ms, "
+            f"{options['error_rate']:.0%} errors, {options['throttle_rate']:.0%} throttled)"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {server.counts['requests']} requests "
+                              f"({server.counts['errors']} errors, {server.counts['throttled']} throttled)")
@@ -0,0 +1,49 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from movies import list_import
+from movies.models import UserMovieList
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports a CSV watchlist (e.g. a Letterboxd export) into a user's list, "
+        "the same way the import page does, and reports rows/sec."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path', help="CSV with Title/Name (and Year) or tmdb_id columns")
+        parser.add_argument('--status', default='watch_later',
+                            choices=[status for status, _ in UserMovieList.STATUS_CHOICES])
+        parser.add_argument('--chunk-size', type=int, default=list_import.CHUNK_SIZE)
+        # Unlike the import page this doesn't hold up a web worker, so it
+        # reads the whole file unless told otherwise
+        parser.add_argument('--max-rows', type=int, default=1_000_000)
+        parser.add_argument('--time-limit', type=float, default=None,
+                            help="Stop starting new chunks after this many seconds")
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user named {options['username']!r}")
+
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+                result = list_import.import_rows(
+                    user, lines, options['status'], options['chunk_size'], options['max_rows'],
+                    options['time_limit'],
+                )
+        except (OSError, UnicodeDecodeError, list_import.ListImportError) as e:
+            raise CommandError(f"Couldn't import {options['path']}: {e}")
+
+        self.stdout.write(self.style.SUCCESS(str(result)))
+        if result.unmatched:
+            self.stdout.write(f"No match for {result.unmatched_count} titles, e.g. {', '.join(result.unmatched[:5])}")
+        if result.failed:
+            self.stdout.write(self.style.WARNING(
+                f"TMDB failed for {result.failed_count} titles, e.g. {', '.join(result.failed[:5])}; run again to retry them"
+            ))
+        if not result.complete:
+            self.stdout.write(self.style.WARNING(f"Stopped after {result.rows} rows"))
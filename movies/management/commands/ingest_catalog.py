@@ -0,0 +1,130 @@
+import datetime
+import gzip
+import json
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from movies import catalog
+from movies.models import CatalogMovie, CatalogMovieGenre
+
+UPDATE_FIELDS = [
+    'title', 'release_date', 'vote_average', 'vote_count',
+    'original_language', 'poster_path', 'popularity',
+]
+
+
+def parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def parse_movie(record):
+    """
+    Maps one JSON-lines record to a CatalogMovie and its genre IDs. Accepts
+    TMDB's daily export fields (id, original_title, popularity) as well as
+    full discover/details records with votes, dates and genres.
+    """
+    genre_ids = record.get('genre_ids')
+    if genre_ids is None:
+        genre_ids = [genre['id'] for genre in record.get('genres') or []]
+
+    movie = CatalogMovie(
+        id=int(record['id']),
+        title=(record.get('title') or record.get('original_title') or '')[:255],
+        release_date=parse_date(record.get('release_date')),
+        vote_average=record.get('vote_average') or 0,
+        vote_count=record.get('vote_count') or 0,
+        original_language=record.get('original_language') or '',
+        poster_path=record.get('poster_path') or '',
+        popularity=record.get('popularity') or 0,
+    )
+    return movie, genre_ids
+
+
+class Command(BaseCommand):
+    help = (
+        "Loads a gzipped (or plain) JSON-lines movie dump into the local catalog. "
+        "Rows are read and upserted in batches, so memory use doesn't grow with the file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path to a .json.gz or .jsonl file, one movie per line")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--include-adult', action='store_true', help="Keep records flagged adult or video")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        opener = gzip.open if path.endswith('.gz') else open
+        batch_size = options['batch_size']
+
+        started = time.monotonic()
+        total = skipped = 0
+        batch = {}
+        try:
+            with opener(path, 'rt', encoding='utf-8') as lines:
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        skipped += 1
+                        continue
+                    if not options['include_adult'] and (record.get('adult') or record.get('video')):
+                        skipped += 1
+                        continue
+                    if 'id' not in record:
+                        skipped += 1
+                        continue
+
+                    # Keyed by ID so a repeated movie in one batch is written once
+                    movie, genre_ids = parse_movie(record)
+                    batch[movie.id] = (movie, genre_ids)
+                    if len(batch) >= batch_size:
+                        total += self.write_batch(batch.values())
+                        batch = {}
+                        self.stdout.write(f"  {total} movies...")
+        except OSError as e:
+            raise CommandError(f"Couldn't read {path}: {e}")
+
+        if batch:
+            total += self.write_batch(batch.values())
+
+        # Let discovery start using the catalog without waiting for the flag to expire
+        cache.delete_many(['catalog_available', 'catalog_has_titles'])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingested {total} movies ({skipped} skipped) in {elapsed:.1f}s"
+        ))
+        if not catalog.is_available():
+            self.stdout.write(self.style.WARNING(
+                f"No movies with {catalog.MIN_VOTE_COUNT}+ votes, so discovery keeps using TMDB. "
+                "Ingest records with vote_count (e.g. from discover or details) to use the catalog."
+            ))
+
+    @transaction.atomic
+    def write_batch(self, batch):
+        batch = list(batch)
+        movies = [movie for movie, _ in batch]
+        CatalogMovie.objects.bulk_create(
+            movies,
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=UPDATE_FIELDS,
+        )
+
+        # Replace the genre rows for this batch
+        movie_ids = [movie.id for movie in movies]
+        CatalogMovieGenre.objects.filter(movie_id__in=movie_ids).delete()
+        CatalogMovieGenre.objects.bulk_create([
+            CatalogMovieGenre(movie_id=movie.id, genre_id=genre_id)
+            for movie, genre_ids in batch
+            for genre_id in set(genre_ids)
+        ])
+        return len(movies)
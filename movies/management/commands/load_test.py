@@ -0,0 +1,172 @@
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.forms import GENRE_CHOICES, LANGUAGE_CHOICES, RATING_CHOICES
+
+GENRE_IDS = [genre_id for genre_id, _ in GENRE_CHOICES if genre_id]
+LANGUAGES = [code for code, _ in LANGUAGE_CHOICES if code]
+RATINGS = [code for code, _ in RATING_CHOICES if code]
+
+
+def percentile(sorted_values, fraction):
+    # Nearest rank
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def random_search(rng):
+    """Query string values for a MovieFilterForm search, most fields left blank."""
+    search = {'genre': '', 'year_from': '', 'year_to': '', 'rating': '', 'language': ''}
+    if rng.random() < 0.7:
+        search['genre'] = str(rng.choice(GENRE_IDS))
+    if rng.random() < 0.3:
+        search['year_from'] = str(rng.randint(1960, 2015))
+    if rng.random() < 0.3:
+        search['rating'] = rng.choice(RATINGS[:3])
+    if rng.random() < 0.2:
+        search['language'] = rng.choice(LANGUAGES[:5])
+    return search
+
+
+class Recorder:
+    def __init__(self):
+        self.timings = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def add(self, step, seconds, ok):
+        with self.lock:
+            self.timings.setdefault(step, []).append(seconds * 1000)
+            if not ok:
+                self.errors[step] = self.errors.get(step, 0) + 1
+
+
+class VirtualUser:
+    """One browser: signs up, then runs search sessions."""
+
+    def __init__(self, base_url, recorder, rng, next_clicks, think_time):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.rng = rng
+        self.next_clicks = next_clicks
+        self.think_time = think_time
+        self.http = requests.Session()
+
+    def request(self, step, method, path, expect=(200, 302), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, urljoin(self.base_url, path), allow_redirects=False, timeout=30, **kwargs)
+            ok = response.status_code in expect
+        except requests.RequestException:
+            response, ok = None, False
+        self.recorder.add(step, time.perf_counter() - started, ok)
+        if self.think_time:
+            time.sleep(self.rng.uniform(0, 2 * self.think_time))
+        return response if ok else None
+
+    def post(self, step, path, data):
+        data = dict(data, csrfmiddlewaretoken=self.http.cookies.get('csrftoken', ''))
+        return self.request(step, 'POST', path, data=data, headers={'Referer': urljoin(self.base_url, path)})
+
+    def sign_up(self):
+        self.request('signup_form', 'GET', '/signup/')
+        password = uuid.uuid4().hex
+        response = self.post('signup', '/signup/', {
+            'username': f"load-{uuid.uuid4().hex[:12]}", 'email': 'load@example.com',
+            'password1': password, 'password2': password,
+        })
+        return response is not None and response.status_code == 302
+
+    def view_movie(self, response):
+        """Follows a redirect to a movie page. Returns the movie ID, or None."""
+        if response is None or response.status_code != 302:
+            return None
+        location = response.headers['Location']
+        if '/movie/' not in location:
+            return None
+        self.request('movie_page', 'GET', location)
+        return location.rstrip('/').rsplit('/', 1)[-1]
+
+    def run_session(self):
+        """filter -> next x N -> add_to_list -> profile"""
+        movie_id = self.view_movie(self.request('filter', 'GET', '/find/', params=random_search(self.rng)))
+        if movie_id is None:
+            return
+        for _ in range(self.next_clicks):
+            movie_id = self.view_movie(self.request('next', 'GET', '/next/')) or movie_id
+        self.post('add_to_list', '/list/add/', {'movie_id': movie_id, 'status': self.rng.choice(('watch_later', 'watched'))})
+        self.request('profile', 'GET', '/profile/', expect=(200,))
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays user sessions (search, next x N, add to list, profile) against a "
+        "running instance and reports latency percentiles and throughput per step. "
+        "Run the app against `manage.py fake_tmdb`, not the real TMDB, with "
+        "DJANGO_ALLOWED_HOSTS=127.0.0.1."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the app under test")
+        parser.add_argument('--users', type=int, default=20, help="Concurrent virtual users")
+        parser.add_argument('--sessions', type=int, default=5, help="Search sessions per user")
+        parser.add_argument('--next', type=int, default=8, dest='next_clicks', help="'Next movie' clicks per session")
+        parser.add_argument('--think', type=float, default=0, help="Mean pause between requests, in seconds")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        recorder = Recorder()
+        seed_rng = random.Random(options['seed'])
+
+        def run_user(_):
+            user = VirtualUser(options['url'], recorder, random.Random(seed_rng.random()),
+                               options['next_clicks'], options['think'])
+            if not user.sign_up():
+                return
+            for _ in range(options['sessions']):
+                user.run_session()
+
+        try:
+            requests.get(options['url'], timeout=5)
+        except requests.RequestException as e:
+            raise CommandError(f"Can't reach {options['url']}: {e}")
+
+        self.stdout.write(f"{options['users']} users x {options['sessions']} sessions against {options['url']}...")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['users']) as executor:
+            list(executor.map(run_user, range(options['users'])))
+        elapsed = time.perf_counter() - started
+
+        self.report(recorder, elapsed)
+
+    def report(self, recorder, elapsed):
+        total = sum(len(timings) for timings in recorder.timings.values())
+        if not total:
+            raise CommandError("No requests were made.")
+
+        self.stdout.write("")
+        self.stdout.write(f"{'step':<14}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        everything = []
+        for step, timings in recorder.timings.items():
+            timings = sorted(timings)
+            everything.extend(timings)
+            self.stdout.write(
+                f"{step:<14}{len(timings):>7}{recorder.errors.get(step, 0):>8}"
+                f"{percentile(timings, 0.5):>10.1f}{percentile(timings, 0.95):>10.1f}"
+                f"{percentile(timings, 0.99):>10.1f}{timings[-1]:>10.1f}"
+            )
+        everything.sort()
+        errors = sum(recorder.errors.values())
+        self.stdout.write(
+            f"{'all':<14}{total:>7}{errors:>8}{percentile(everything, 0.5):>10.1f}"
+            f"{percentile(everything, 0.95):>10.1f}{percentile(everything, 0.99):>10.1f}{everything[-1]:>10.1f}"
+        )
+        self.stdout.write("")
+        self.stdout.write(f"{total} requests in {elapsed:.1f}s: {total / elapsed:.1f} requests/s, {errors / total:.1%} errors")
@@ -0,0 +1,88 @@
+import json
+import pickle
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from movies import fetch_cache, records, tmdb_api, tmdb_client
+
+
+def pickled_size(value):
+    # Same serialization the cache backend uses
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+def legacy_entries(document):
+    """
+    What was cached for a movie before compact records: the TMDB document
+    as it came (movie_details_) and the top 3 cast and director, as TMDB
+    sent them (movie_credits_and_director_).
+    """
+    movie = dict(document)
+    credits = movie.pop('credits', {})
+    director = next((member for member in credits.get('crew', []) if member.get('job') == 'Director'), None)
+    return [movie, {'cast': credits.get('cast', [])[:3], 'director': director}]
+
+
+def compact_entry(document):
+    return fetch_cache.wrap((records.movie_record(document), records.credits_record(document.get('credits', {}))))
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports the cached size of movies as the old movie_details_ and "
+        "movie_credits_and_director_ entries and as one compact movie_full_ "
+        "record, in bytes per movie."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('movie_ids', nargs='*', type=int,
+                            help="TMDB movie IDs to fetch (with append_to_response=credits)")
+        parser.add_argument('--file', help="Read movie documents from a JSON or JSON Lines file instead of TMDB")
+
+    def handle(self, *args, **options):
+        documents = self.load_file(options['file']) if options['file'] else self.fetch(options['movie_ids'])
+        if not documents:
+            raise CommandError("Give some movie IDs or --file.")
+
+        legacy_total = compact_total = 0
+        for document in documents:
+            legacy = sum(pickled_size(entry) for entry in legacy_entries(document))
+            compact = pickled_size(compact_entry(document))
+            legacy_total += legacy
+            compact_total += compact
+            self.stdout.write(f"{document['id']:>8}  {legacy:>7} B -> {compact:>6} B  {document.get('title', '')}")
+
+        count = len(documents)
+        legacy_avg, compact_avg = legacy_total / count, compact_total / count
+        self.stdout.write("")
+        self.stdout.write(f"Movies measured:  {count}")
+        self.stdout.write(f"TMDB documents:   {legacy_avg:,.0f} bytes per movie")
+        self.stdout.write(f"Compact records:  {compact_avg:,.0f} bytes per movie ({legacy_avg / compact_avg:.1f}x smaller)")
+
+        max_bytes = settings.CACHES['default'].get('OPTIONS', {}).get('MAX_BYTES')
+        if max_bytes:
+            self.stdout.write(
+                f"Movies per {max_bytes // (1024 * 1024)} MB cache: "
+                f"{max_bytes / legacy_avg:,.0f} -> {max_bytes / compact_avg:,.0f}"
+            )
+
+    def load_file(self, path):
+        with open(path) as f:
+            text = f.read()
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+        return data if isinstance(data, list) else [data]
+
+    def fetch(self, movie_ids):
+        documents = []
+        for movie_id in movie_ids:
+            params = {'api_key': tmdb_api.API_KEY, 'append_to_response': 'credits'}
+            try:
+                documents.append(tmdb_client.get(f"{tmdb_api.BASE_URL}/movie/{movie_id}", params=params))
+            except requests.RequestException as e:
+                self.stderr.write(f"Skipping {movie_id}: {e}")
+        return documents
@@ -0,0 +1,380 @@
+"""
+Per-request performance metrics.
+
+PerformanceMiddleware starts a RequestMetrics for each request in a context
+variable. The hooks below add to it from wherever the work happens:
+- tmdb_client records TMDB calls;
+- fetch_cache and tmdb_api record cache hits and misses per key family;
+- a database execute wrapper records SQL;
+- the TimedDjangoTemplates backend records render time.
+Context variables follow the request into sync_to_async threads and into
+lookup_many's fetch threads. Work on the background pool isn't counted
+against any request.
+
+At the end of a request the numbers go out in a Server-Timing header and
+into this process's running totals. Every FLUSH_INTERVAL seconds those are
+added to a small SQLite file shared by all workers on the host. /metrics
+serves the combined totals in Prometheus text format.
+
+Each flush also picks up the process-wide counters kept elsewhere: the
+TMDB clients' rate limiters, circuit breakers and connection reuse, and
+TieredCache's per-tier hits. Counters are added as deltas since the last
+flush, so they sum across workers like the rest. Breaker states and L1
+sizes are gauges, kept per worker (pid label) and dropped once a worker
+hasn't flushed for GAUGE_MAX_AGE seconds.
+"""
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+METRICS_ENABLED = getattr(settings, 'METRICS_ENABLED', True)
+METRICS_DB = str(getattr(settings, 'METRICS_DB', os.path.join(settings.BASE_DIR, 'metrics.sqlite3')))
+SERVER_TIMING = getattr(settings, 'METRICS_SERVER_TIMING', True)
+
+# How often a worker adds its totals to the shared file, in seconds
+FLUSH_INTERVAL = 5
+
+# Gauges from workers that haven't flushed for this long are left out
+GAUGE_MAX_AGE = 60
+
+# Request duration histogram buckets, in seconds
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    'pickamovie_requests_total': ('counter', "Requests handled, by view and status code."),
+    'pickamovie_request_duration_seconds': ('histogram', "Request duration, by view."),
+    'pickamovie_tmdb_calls_total': ('counter', "TMDB calls made while handling requests, by view and outcome."),
+    'pickamovie_tmdb_seconds_total': ('counter', "Time spent waiting on TMDB, by view."),
+    'pickamovie_cache_requests_total': ('counter', "Cache lookups by key family and result (hit, stale, miss)."),
+    'pickamovie_sql_queries_total': ('counter', "SQL queries, by view."),
+    'pickamovie_sql_seconds_total': ('counter', "Time spent in SQL, by view."),
+    'pickamovie_template_seconds_total': ('counter', "Time spent rendering templates, by view."),
+    'pickamovie_tmdb_rate_limited_total': ('counter', "TMDB calls refused for lack of quota, by client (api, images)."),
+    'pickamovie_tmdb_rate_limit_wait_seconds_total': ('counter', "Time spent waiting for TMDB quota, by client."),
+    'pickamovie_tmdb_breaker_short_circuited_total': ('counter', "TMDB calls failed fast by an open circuit breaker, by client."),
+    'pickamovie_tmdb_breaker_opened_total': ('counter', "Times a TMDB circuit breaker opened, by client."),
+    'pickamovie_tmdb_breaker_state': ('gauge', "1 for each worker's current TMDB circuit breaker state, by client."),
+    'pickamovie_tmdb_http_requests_total': ('counter', "HTTP requests sent on the pooled TMDB session."),
+    'pickamovie_tmdb_connections_total': ('counter', "Connections opened by the pooled TMDB session; the rest of the requests reused one."),
+    'pickamovie_cache_tier_requests_total': ('counter', "TieredCache lookups by the tier that answered (l1, l2, miss)."),
+    'pickamovie_cache_evictions_total': ('counter', "Entries evicted from the L2 cache to stay under MAX_BYTES."),
+    'pickamovie_cache_l1_entries': ('gauge', "Entries in each worker's L1 cache."),
+}
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.tmdb_calls = 0
+        self.tmdb_errors = 0
+        self.tmdb_seconds = 0.0
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        # family -> {'hit': n, 'stale': n, 'miss': n}
+        self.cache = {}
+        # lookup_many fetches on several threads at once
+        self._lock = threading.Lock()
+
+    def add(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def add_cache(self, family, result, count):
+        with self._lock:
+            results = self.cache.setdefault(family, {'hit': 0, 'stale': 0, 'miss': 0})
+            results[result] += count
+
+    def server_timing(self, total):
+        entries = [
+            f'tmdb;dur={self.tmdb_seconds * 1000:.1f};desc="{self.tmdb_calls} calls"',
+            f'sql;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_queries} queries"',
+            f'tpl;dur={self.template_seconds * 1000:.1f}',
+        ]
+        for family, results in sorted(self.cache.items()):
+            entries.append(f'cache-{family.rstrip("_")};desc="{results["hit"]} hit, {results["stale"]} stale, {results["miss"]} miss"')
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+
+# Hooks
+
+@contextmanager
+def tmdb_call():
+    """Wraps one TMDB call (including its retries)."""
+    metrics = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        if metrics:
+            metrics.add(tmdb_errors=1)
+        raise
+    finally:
+        if metrics:
+            metrics.add(tmdb_calls=1, tmdb_seconds=time.perf_counter() - started)
+
+
+def record_cache(family, hits=0, misses=0, stale=0):
+    metrics = _current.get()
+    if metrics:
+        for result, count in (('hit', hits), ('miss', misses), ('stale', stale)):
+            if count:
+                metrics.add_cache(family, result, count)
+
+
+def key_family(key):
+    """movie_details_550 -> movie_details_"""
+    return key[:key.rfind('_') + 1]
+
+
+def record_template(seconds):
+    metrics = _current.get()
+    if metrics:
+        metrics.add(template_seconds=seconds)
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add(sql_queries=1, sql_seconds=time.perf_counter() - started)
+
+
+def install_sql_hook(sender, connection, **kwargs):
+    """connection_created receiver; see MoviesConfig.ready()."""
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_wrapper)
+
+
+def start():
+    """Starts collecting for a request. Returns (metrics, token for stop())."""
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+# Process-wide counters and gauges kept by other modules
+
+def _runtime_counters():
+    """{(name, labels): running total} for this process."""
+    # Imported here; tmdb_client imports this module
+    from django.core.cache import cache
+
+    from . import tmdb_client
+
+    stats = tmdb_client.get_client_stats()
+    counters = {
+        ('pickamovie_tmdb_http_requests_total', ''): stats['connections']['requests'],
+        ('pickamovie_tmdb_connections_total', ''): stats['connections']['connections'],
+    }
+    for client in ('api', 'images'):
+        label = f'client="{client}"'
+        limiter, breaker = stats[client]['rate_limiter'], stats[client]['breaker']
+        counters[('pickamovie_tmdb_rate_limited_total', label)] = limiter['rejected']
+        counters[('pickamovie_tmdb_rate_limit_wait_seconds_total', label)] = limiter['waited_seconds']
+        counters[('pickamovie_tmdb_breaker_short_circuited_total', label)] = breaker['short_circuited']
+        counters[('pickamovie_tmdb_breaker_opened_total', label)] = breaker['times_opened']
+
+    # Only TieredCache keeps per-tier counters
+    cache_stats = cache.stats() if hasattr(cache, 'stats') else None
+    if cache_stats:
+        for tier, name in (('l1', 'l1_hits'), ('l2', 'l2_hits'), ('miss', 'misses')):
+            counters[('pickamovie_cache_tier_requests_total', f'tier="{tier}"')] = cache_stats[name]
+        counters[('pickamovie_cache_evictions_total', '')] = cache_stats['evictions']
+    return counters
+
+
+def _runtime_gauges():
+    """{(name, labels): current value} for this process."""
+    from django.core.cache import cache
+
+    from . import resilience, tmdb_client
+
+    stats = tmdb_client.get_client_stats()
+    gauges = {}
+    for client in ('api', 'images'):
+        current = stats[client]['breaker']['state']
+        for state in (resilience.CLOSED, resilience.OPEN, resilience.HALF_OPEN):
+            gauges[('pickamovie_tmdb_breaker_state', f'client="{client}",state="{state}"')] = int(state == current)
+    cache_stats = cache.stats() if hasattr(cache, 'stats') else None
+    if cache_stats:
+        gauges[('pickamovie_cache_l1_entries', '')] = cache_stats['l1_entries']
+    return gauges
+
+
+# Aggregation across requests and workers
+
+class MetricsStore:
+    """
+    Running totals for this process, added to a SQLite table that all
+    workers share. Every series is a counter, so totals from different
+    workers can simply be summed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._local = threading.local()
+        # _runtime_counters() as of the last flush
+        self._counted = {}
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metrics (name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL,"
+                " PRIMARY KEY (name, labels))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS gauges (name TEXT NOT NULL, labels TEXT NOT NULL, pid INTEGER NOT NULL,"
+                " value REAL NOT NULL, updated REAL NOT NULL, PRIMARY KEY (name, labels, pid))"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def observe(self, view, status, metrics, duration, flush=True):
+        """
+        Adds one finished request to the running totals. With flush=False
+        the caller is left to call flush() when flush_due(), e.g. off the
+        event loop.
+        """
+        view_label = f'view="{view}"'
+        with self._lock:
+            pending = self._pending
+
+            def add(name, labels, value):
+                if value:
+                    pending[(name, labels)] = pending.get((name, labels), 0) + value
+
+            add('pickamovie_requests_total', f'{view_label},status="{status}"', 1)
+            for bucket in BUCKETS:
+                if duration <= bucket:
+                    add('pickamovie_request_duration_seconds_bucket', f'{view_label},le="{bucket}"', 1)
+            add('pickamovie_request_duration_seconds_bucket', f'{view_label},le="+Inf"', 1)
+            add('pickamovie_request_duration_seconds_sum', view_label, duration)
+            add('pickamovie_request_duration_seconds_count', view_label, 1)
+            add('pickamovie_tmdb_calls_total', f'{view_label},outcome="ok"', metrics.tmdb_calls - metrics.tmdb_errors)
+            add('pickamovie_tmdb_calls_total', f'{view_label},outcome="error"', metrics.tmdb_errors)
+            add('pickamovie_tmdb_seconds_total', view_label, metrics.tmdb_seconds)
+            add('pickamovie_sql_queries_total', view_label, metrics.sql_queries)
+            add('pickamovie_sql_seconds_total', view_label, metrics.sql_seconds)
+            add('pickamovie_template_seconds_total', view_label, metrics.template_seconds)
+            for family, results in metrics.cache.items():
+                for result, count in results.items():
+                    add('pickamovie_cache_requests_total', f'family="{family}",result="{result}"', count)
+
+        if flush and self.flush_due():
+            self.flush()
+
+    def flush_due(self):
+        return time.monotonic() - self._flushed_at >= FLUSH_INTERVAL
+
+    def flush(self):
+        counters = _runtime_counters()
+        gauges = _runtime_gauges()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+            for key, value in counters.items():
+                # A counter that went down was reset (e.g. a new session after a fork)
+                delta = value - self._counted.get(key, 0)
+                if delta > 0:
+                    pending[key] = pending.get(key, 0) + delta
+            self._counted = counters
+        try:
+            conn = self._connection()
+            if pending:
+                conn.executemany(
+                    "INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?)"
+                    " ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                    [(name, labels, value) for (name, labels), value in pending.items()],
+                )
+            now = time.time()
+            conn.executemany(
+                "INSERT OR REPLACE INTO gauges (name, labels, pid, value, updated) VALUES (?, ?, ?, ?, ?)",
+                [(name, labels, os.getpid(), value, now) for (name, labels), value in gauges.items()],
+            )
+        except sqlite3.Error as e:
+            # Metrics must never break a request; keep the numbers for next time
+            print(f"Could not write metrics: {e}")
+            with self._lock:
+                for key, value in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + value
+
+    def render(self):
+        """All workers' totals in Prometheus text format."""
+        self.flush()
+        conn = self._connection()
+        rows = conn.execute("SELECT name, labels, value FROM metrics ORDER BY name, labels").fetchall()
+        rows += [
+            (name, f'{labels},pid="{pid}"' if labels else f'pid="{pid}"', value)
+            for name, labels, pid, value in conn.execute(
+                "SELECT name, labels, pid, value FROM gauges WHERE updated > ? ORDER BY name, labels, pid",
+                [time.time() - GAUGE_MAX_AGE],
+            )
+        ]
+
+        lines = []
+        for metric, (kind, help_text) in METRICS.items():
+            series = [(name, labels, value) for name, labels, value in rows if name == metric or name.startswith(metric + '_')]
+            if not series:
+                continue
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, labels, value in series:
+                lines.append(f"{name}{{{labels}}} {value:g}" if labels else f"{name} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+
+store = MetricsStore(METRICS_DB)
+
+
+# Template hook
+
+class TimedTemplate:
+    """Wraps a backend template so render() time is recorded."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            record_template(time.perf_counter() - started)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates backend whose templates time their rendering."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
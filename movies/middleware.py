@@ -0,0 +1,94 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics
+
+
+class PerformanceMiddleware:
+    """
+    Collects metrics.RequestMetrics for each request, adds a Server-Timing
+    header with them (visible in the browser's network tab) and adds them to
+    the totals served at /metrics. Goes first in MIDDLEWARE so the other
+    middleware's queries are counted too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not metrics.METRICS_ENABLED:
+            return self.get_response(request)
+
+        request_metrics, token = metrics.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.stop(token)
+        return self.finish(request, response, request_metrics)
+
+    async def __acall__(self, request):
+        if not metrics.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        # sync_to_async copies the context, so sync views and ORM calls
+        # record into the same RequestMetrics
+        request_metrics, token = metrics.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.stop(token)
+        response = self.finish(request, response, request_metrics, flush=False)
+        if metrics.store.flush_due():
+            # A SQLite write; keep it off the event loop
+            await sync_to_async(metrics.store.flush, thread_sensitive=False)()
+        return response
+
+    def finish(self, request, response, request_metrics, flush=True):
+        duration = time.perf_counter() - request_metrics.started
+        if metrics.SERVER_TIMING:
+            response['Server-Timing'] = request_metrics.server_timing(duration)
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        metrics.store.observe(view, response.status_code, request_metrics, duration, flush)
+        return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoiseMiddleware that can also run async. WhiteNoise is sync-only,
+    and one sync middleware makes Django run the whole chain, views
+    included, through the single thread sync_to_async shares by default,
+    so under ASGI requests went one at a time.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        # Static files are found in memory unless autorefresh is on (DEBUG)
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_userprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogMovie',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=255)),
+                ('release_date', models.DateField(blank=True, null=True)),
+                ('vote_average', models.FloatField(default=0)),
+                ('vote_count', models.IntegerField(default=0)),
+                ('original_language', models.CharField(blank=True, max_length=8)),
+                ('poster_path', models.CharField(blank=True, max_length=64)),
+                ('popularity', models.FloatField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['original_language', 'release_date'], name='movies_cata_origina_8c6108_idx'), models.Index(fields=['release_date'], name='movies_cata_release_d86714_idx'), models.Index(fields=['vote_average'], name='movies_cata_vote_av_9b0db1_idx'), models.Index(fields=['-popularity'], name='movies_cata_popular_724cd4_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CatalogMovieGenre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genre_id', models.IntegerField()),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='genres', to='movies.catalogmovie')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['genre_id', 'movie'], name='movies_cata_genre_i_12d82d_idx')],
+                'unique_together': {('movie', 'genre_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_catalogmovie'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usermovielist',
+            name='details_refreshed_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='usermovielist',
+            name='poster_path',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='usermovielist',
+            name='title',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
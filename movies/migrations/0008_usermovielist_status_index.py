@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0007_usermovielist_display_fields'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usermovielist',
+            index=models.Index(fields=['user', 'status', 'added_on'], name='movielist_user_status_added'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0008_usermovielist_status_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='catalogmovie',
+            index=models.Index(fields=['title'], name='movies_cata_title_a868b8_idx'),
+        ),
+    ]
@@ -39,8 +39,59 @@ class UserMovieList(models.Model):
     status = models.CharField(max_length=12, choices=STATUS_CHOICES)
     added_on = models.DateTimeField(auto_now_add=True)
 
+    # Copied from TMDB so the profile page can render without looking each
+    # movie up. details_refreshed_on is null until they have been filled in.
+    title = models.CharField(max_length=255, blank=True)
+    poster_path = models.CharField(max_length=64, blank=True)
+    details_refreshed_on = models.DateTimeField(null=True, blank=True)
+
     def __str__(self):
         return f"{self.user.username} - Movie ID: {self.movie_id} ({self.get_status_display()})"
 
     class Meta:
         unique_together = ('user', 'movie_id')
+        indexes = [
+            # Profile pages read one list at a time, newest first (see profile_lists)
+            models.Index(fields=['user', 'status', 'added_on'], name='movielist_user_status_added'),
+        ]
+
+class CatalogMovie(models.Model):
+    """
+    Local mirror of the TMDB fields we filter and display on, so discovery
+    can run without a network call. Filled by the ingest_catalog command.
+    """
+    id = models.IntegerField(primary_key=True) # TMDB movie ID
+    title = models.CharField(max_length=255)
+    release_date = models.DateField(null=True, blank=True)
+    vote_average = models.FloatField(default=0)
+    vote_count = models.IntegerField(default=0)
+    original_language = models.CharField(max_length=8, blank=True)
+    poster_path = models.CharField(max_length=64, blank=True)
+    popularity = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.title} ({self.id})"
+
+    class Meta:
+        # Match the MovieFilterForm fields; results are ordered by popularity
+        indexes = [
+            models.Index(fields=['original_language', 'release_date']),
+            models.Index(fields=['release_date']),
+            models.Index(fields=['vote_average']),
+            models.Index(fields=['-popularity']),
+            # Title lookups when importing lists (see list_import)
+            models.Index(fields=['title']),
+        ]
+
+class CatalogMovieGenre(models.Model):
+    movie = models.ForeignKey(CatalogMovie, on_delete=models.CASCADE, related_name='genres')
+    genre_id = models.IntegerField()
+
+    def __str__(self):
+        return f"Movie ID: {self.movie_id} - Genre ID: {self.genre_id}"
+
+    class Meta:
+        unique_together = ('movie', 'genre_id')
+        indexes = [
+            models.Index(fields=['genre_id', 'movie']),
+        ]
@@ -0,0 +1,125 @@
+"""
+HTTP caching for the movie detail page.
+
+The page's ETag is built from:
+- the version stamp of the cached movie, i.e. when fetch_cache stored it;
+- the template source and the similar-movies table it shows;
+- who is looking. Anonymous visitors all get the same page. A logged-in
+  user's page has their name and their CSRF token in its forms.
+A conditional GET that matches gets a 304 before the movie is looked up or
+the template rendered. That is what repeat views and back-navigation send.
+
+Anonymous pages may be kept by browsers and shared caches for MAX_AGE
+seconds. Logged-in pages are private and revalidated on every view. With
+MOVIE_PAGE_CACHE on, rendered anonymous pages are also kept in the Django
+cache under their ETag, so other visitors skip rendering too.
+
+Pages that show a flash message are never cached, because the message
+belongs to that one response.
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import get_template
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from . import similar_movies
+
+MAX_AGE = getattr(settings, 'MOVIE_PAGE_MAX_AGE', 300)
+
+# Opt-in: keep rendered anonymous pages in the shared cache
+SHARED_CACHE = getattr(settings, 'MOVIE_PAGE_CACHE', False)
+SHARED_CACHE_TIMEOUT = getattr(settings, 'MOVIE_PAGE_CACHE_TIMEOUT', 60 * 10)
+
+TEMPLATES = ('movies/movie_recommendation.html', 'movies/base.html')
+
+_template_version = None
+
+
+def template_version():
+    """A hash of the page's templates, so a deploy that changes them changes every ETag."""
+    global _template_version
+    if _template_version is None or settings.DEBUG:
+        digest = hashlib.sha1()
+        for name in TEMPLATES:
+            with open(get_template(name).origin.name, 'rb') as f:
+                digest.update(f.read())
+        _template_version = digest.hexdigest()[:12]
+    return _template_version
+
+
+def has_pending_messages(request):
+    # len() loads the messages without marking them as shown
+    return len(messages.get_messages(request)) > 0
+
+
+class Validators:
+    """ETag and Last-Modified for one viewer's copy of one movie page."""
+
+    def __init__(self, request, user, movie_id, stamp):
+        self.anonymous = not user.is_authenticated
+        viewer = 'anonymous' if self.anonymous else f"user:{user.pk}:{request.META.get('CSRF_COOKIE', '')}"
+        page_version = f"{template_version()}|{similar_movies.version()}"
+        self.digest = hashlib.sha1(f"{page_version}|{movie_id}|{stamp}|{viewer}".encode()).hexdigest()[:24]
+        self.etag = f'"{self.digest}"'
+        # Last-Modified can't tell viewers apart, so only anonymous pages get one
+        self.last_modified = int(stamp) if self.anonymous else None
+
+    @property
+    def cache_key(self):
+        return f"movie_page_{self.digest}"
+
+
+def check(request, validators):
+    """A 304, or the page from the shared cache, or None if it has to be rendered."""
+    response = get_conditional_response(request, etag=validators.etag, last_modified=validators.last_modified)
+    if response is None and SHARED_CACHE and validators.anonymous:
+        content = cache.get(validators.cache_key)
+        if content is not None:
+            response = HttpResponse(content)
+    return response
+
+
+def store(validators, response):
+    if SHARED_CACHE and validators.anonymous and response.status_code == 200:
+        cache.set(validators.cache_key, response.content, SHARED_CACHE_TIMEOUT)
+
+
+def finish(response, validators):
+    """Sets the caching headers. validators is None for a page that mustn't be cached."""
+    if validators is None:
+        response['Cache-Control'] = 'private, no-store'
+    else:
+        response['ETag'] = validators.etag
+        if validators.anonymous:
+            response['Last-Modified'] = http_date(validators.last_modified)
+            response['Cache-Control'] = f'public, max-age={MAX_AGE}'
+        else:
+            response['Cache-Control'] = 'private, no-cache'
+    # Logging in or out changes the page
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+# Async versions, for async_views.py
+
+ahas_pending_messages = sync_to_async(has_pending_messages)
+
+
+async def acheck(request, validators):
+    response = get_conditional_response(request, etag=validators.etag, last_modified=validators.last_modified)
+    if response is None and SHARED_CACHE and validators.anonymous:
+        content = await cache.aget(validators.cache_key)
+        if content is not None:
+            response = HttpResponse(content)
+    return response
+
+
+async def astore(validators, response):
+    if SHARED_CACHE and validators.anonymous and response.status_code == 200:
+        await cache.aset(validators.cache_key, response.content, SHARED_CACHE_TIMEOUT)
@@ -0,0 +1,199 @@
+"""
+Resized poster images, served from our own disk cache.
+
+TMDB posters are fetched once from the image CDN at ORIGIN_SIZE and stored
+under the SHA-256 of their bytes, so every variant of the same image is
+derived from one copy. The smaller sizes and WebP versions are made from
+it with Pillow on first request, and written next to it.
+
+Layout under POSTER_CACHE_DIR:
+    names/<tmdb file name>            sha256 of the original
+    originals/<sha[:2]>/<sha>         the image as TMDB served it
+    variants/<sha[:2]>/<sha>-<size>.<format>
+
+TMDB gives a poster a new file name when the image changes, so a variant
+URL always names the same bytes and is served as immutable. Writes go to a
+temporary file and are renamed into place, so workers that make the same
+variant at the same time can't leave a half-written file behind.
+
+The cache is kept under MAX_BYTES: at most once every EVICT_INTERVAL
+seconds a worker that has written something walks it on the background
+pool and deletes the oldest files. A variant whose original was deleted
+fetches it again. get_variant hands back an open file, so a variant
+deleted while it is being served is still sent whole.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import time
+from io import BytesIO
+
+import requests
+from django.conf import settings
+from django.urls import reverse
+from PIL import Image
+
+from . import fetch_cache, tmdb_client
+
+IMAGE_BASE_URL = getattr(settings, 'TMDB_IMAGE_BASE_URL', 'https://image.tmdb.org/t/p')
+CACHE_DIR = str(getattr(settings, 'POSTER_CACHE_DIR', os.path.join(settings.BASE_DIR, 'poster_cache')))
+MAX_BYTES = getattr(settings, 'POSTER_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024)
+EVICT_INTERVAL = getattr(settings, 'POSTER_CACHE_EVICT_INTERVAL', 60)
+
+# The size fetched from TMDB; the largest we serve
+ORIGIN_SIZE = 'w500'
+
+# TMDB's names for the widths we serve
+SIZES = {'w185': 185, 'w342': 342, 'w500': 500}
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+# Tile widths in the profile grids (2 to 6 columns, max-w-6xl)
+GRID_SIZES = '(min-width: 1280px) 185px, (min-width: 768px) 25vw, (min-width: 640px) 33vw, 50vw'
+
+# Posters are a few hundred KB; anything much bigger isn't one
+MAX_ORIGIN_BYTES = 5 * 1024 * 1024
+
+# TMDB file names look like kqjL17yufvn9OVLyXYpvtyrFfak.jpg. Anything else
+# is refused before it reaches the CDN.
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9]{20,32}\.(jpg|png)$')
+
+_evicted_at = 0.0
+
+
+def is_valid(size, image_format, name):
+    return size in SIZES and image_format in FORMATS and bool(NAME_PATTERN.match(name))
+
+
+def url(poster_path, size='w342', image_format='webp'):
+    """Our URL for a TMDB poster_path ('/abc.jpg') at one size and format."""
+    return reverse('poster', args=[size, image_format, poster_path.lstrip('/')])
+
+
+def srcset(poster_path, image_format='webp'):
+    return ', '.join(f"{url(poster_path, size, image_format)} {width}w" for size, width in SIZES.items())
+
+
+def image_attrs(poster_path, sizes=GRID_SIZES):
+    """What profile_page.html's script needs to build a poster <picture>."""
+    return {
+        'src': url(poster_path, 'w342', 'jpg'),
+        'srcset': srcset(poster_path, 'jpg'),
+        'webp_srcset': srcset(poster_path, 'webp'),
+        'sizes': sizes,
+    }
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _cache_files():
+    for root, _, names in os.walk(CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+
+def evict(max_bytes=None):
+    """Deletes the oldest cached files until the cache fits in max_bytes. Returns bytes freed."""
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    files = sorted(_cache_files())
+    excess = sum(size for _, size, _ in files) - max_bytes
+    freed = 0
+    for _, size, path in files:
+        if freed >= excess:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+        freed += size
+    return freed
+
+
+def _maybe_evict():
+    global _evicted_at
+    now = time.monotonic()
+    if now - _evicted_at >= EVICT_INTERVAL:
+        _evicted_at = now
+        # Walking the cache takes a while once it's large; keep it out of the request
+        fetch_cache.run_in_background(evict)
+
+
+def _original_path(digest):
+    return os.path.join(CACHE_DIR, 'originals', digest[:2], digest)
+
+
+def _original_digest(name):
+    """The sha256 of the original poster, fetching it first if needed."""
+    index_path = os.path.join(CACHE_DIR, 'names', name)
+    try:
+        with open(index_path) as f:
+            digest = f.read().strip()
+        if os.path.exists(_original_path(digest)):
+            return digest
+    except FileNotFoundError:
+        pass
+
+    data = tmdb_client.get_image(f"{IMAGE_BASE_URL}/{ORIGIN_SIZE}/{name}")
+    if len(data) > MAX_ORIGIN_BYTES:
+        raise ValueError(f"Poster {name} is {len(data)} bytes")
+    digest = hashlib.sha256(data).hexdigest()
+    if not os.path.exists(_original_path(digest)):
+        _write_atomic(_original_path(digest), data)
+    _write_atomic(index_path, digest.encode())
+    return digest
+
+
+def _make_variant(original_path, width, image_format):
+    pil_format, _, options = FORMATS[image_format]
+    with Image.open(original_path) as image:
+        image = image.convert('RGB')
+        if image.width > width:
+            image.thumbnail((width, round(image.height * width / image.width)), Image.Resampling.LANCZOS)
+        out = BytesIO()
+        image.save(out, pil_format, **options)
+    return out.getvalue()
+
+
+def _open_variant(digest, size, image_format):
+    path = os.path.join(CACHE_DIR, 'variants', digest[:2], f"{digest}-{size}.{image_format}")
+    try:
+        return open(path, 'rb')
+    except FileNotFoundError:
+        pass
+    _write_atomic(path, _make_variant(_original_path(digest), SIZES[size], image_format))
+    _maybe_evict()
+    return open(path, 'rb')
+
+
+def get_variant(size, image_format, name):
+    """
+    Returns (open file, content type, etag) for a poster variant, making it
+    if needed, or None if the poster couldn't be fetched or decoded. The
+    caller closes the file.
+    """
+    try:
+        digest = _original_digest(name)
+        variant_file = _open_variant(digest, size, image_format)
+    except (requests.RequestException, OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Poster {name} unavailable: {e}")
+        return None
+    return variant_file, FORMATS[image_format][1], f'"{digest[:32]}-{size}-{image_format}"'
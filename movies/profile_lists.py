@@ -0,0 +1,84 @@
+"""
+Pages of a user's Watch Later / Watched lists, newest first.
+
+Pages use keyset pagination: the cursor is the (added_on, id) of the last
+row shown, and the next page is the rows that sort after it. With the
+(user, status, added_on) index each page is one short index range scan,
+however many movies the user has saved, unlike OFFSET which reads and
+throws away every earlier row.
+"""
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Q
+
+from . import list_details
+from .models import UserMovieList
+
+PAGE_SIZE = getattr(settings, 'PROFILE_PAGE_SIZE', 24)
+
+STATUSES = [status for status, _ in UserMovieList.STATUS_CHOICES]
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def encode_cursor(entry):
+    # Microseconds since the epoch, exact, and safe to put in a URL
+    micros = (entry.added_on - EPOCH) // datetime.timedelta(microseconds=1)
+    return f"{micros}-{entry.id}"
+
+
+def decode_cursor(cursor):
+    """Returns (added_on, id), or None if the cursor is malformed."""
+    try:
+        micros, entry_id = cursor.split('-')
+        return EPOCH + datetime.timedelta(microseconds=int(micros)), int(entry_id)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def _page_queryset(user, status, after=None, page_size=PAGE_SIZE):
+    entries = UserMovieList.objects.filter(user=user, status=status)
+    position = decode_cursor(after) if after else None
+    if position:
+        added_on, entry_id = position
+        entries = entries.filter(Q(added_on__lt=added_on) | Q(added_on=added_on, id__lt=entry_id))
+    # One extra row tells us whether there is a next page
+    return entries.order_by('-added_on', '-id')[:page_size + 1]
+
+
+def _paginate(entries, page_size):
+    """Returns (movies, next cursor or None) for rows fetched by _page_queryset."""
+    entries, more = entries[:page_size], len(entries) > page_size
+    movies = [list_details.as_movie(entry) for entry in list_details.prepare(entries)]
+    return movies, encode_cursor(entries[-1]) if more else None
+
+
+def page(user, status, after=None, page_size=PAGE_SIZE):
+    """
+    Returns (movies, next_cursor) for one page of the list, starting after
+    the cursor (from the start if None). next_cursor is None on the last page.
+    """
+    return _paginate(list(_page_queryset(user, status, after, page_size)), page_size)
+
+
+def counts(user):
+    """{status: count} for the user's lists, in one aggregate query."""
+    return UserMovieList.objects.filter(user=user).aggregate(
+        **{status: Count('id', filter=Q(status=status)) for status in STATUSES}
+    )
+
+
+# Async versions, for async_views.py
+
+async def apage(user, status, after=None, page_size=PAGE_SIZE):
+    entries = [entry async for entry in _page_queryset(user, status, after, page_size)]
+    # prepare() may take cache locks and start a background refresh
+    return await sync_to_async(_paginate)(entries, page_size)
+
+
+async def acounts(user):
+    return await UserMovieList.objects.filter(user=user).aaggregate(
+        **{status: Count('id', filter=Q(status=status)) for status in STATUSES}
+    )
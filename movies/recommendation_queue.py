@@ -0,0 +1,151 @@
+"""
+The queue of recommendations a search creates, kept in the session as a few
+numbers instead of a list of movie IDs.
+
+A queue is stored as [filters, seed, batch, page_count, cursor]: the
+search's non-empty filters, a random seed, which batch of results the user
+is on, how many discover pages that batch was drawn from, and the position
+of the current movie in it. A batch pools several discover pages (see
+tmdb_api.discover_batch) and is re-derived from the cache when needed, so
+moving to the next movie only rewrites the cursor. When a batch runs out
+the queue moves on to the next one, drawn from other pages, instead of
+ending.
+
+Movies already in the user's lists (see seen_movies) are skipped as the
+cursor moves, before anything is fetched or warmed for them. The cursor
+still indexes the whole batch, so adding the current movie to a list
+doesn't shift the queue under it.
+"""
+import random
+
+from . import tmdb_api
+
+SESSION_KEY = 'recommendation_queue'
+
+# How many whole batches of already-seen movies to skip before giving up
+MAX_SKIPPED_BATCHES = 3
+
+
+def _normalize(filters):
+    # Only what discover needs; ints and strings, so it stores as JSON
+    return {name: filters[name] for name in tmdb_api.FILTER_FIELDS if filters.get(name)}
+
+
+def _first_unseen(movie_ids, cursor, seen):
+    for i in range(cursor, len(movie_ids)):
+        if movie_ids[i] not in seen:
+            return i
+    return None
+
+
+def _seek(filters, seed, batch, page_count, cursor, seen):
+    """
+    Finds the first movie not in seen at or after cursor in the batch, going
+    on to later batches when it runs out. page_count is None for a batch
+    that hasn't been drawn yet. Returns (batch, page_count, cursor,
+    movie_id), or None.
+    """
+    for _ in range(MAX_SKIPPED_BATCHES + 1):
+        rederived = page_count is not None
+        page_count, movie_ids = tmdb_api.discover_batch(filters, seed, batch, page_count)
+        cursor = _first_unseen(movie_ids, cursor, seen)
+        if cursor is not None:
+            return batch, page_count, cursor, movie_ids[cursor]
+        if not movie_ids and not rederived:
+            # Nothing matched, or TMDB couldn't be reached
+            return None
+        batch, page_count, cursor = batch + 1, None, 0
+    return None
+
+
+def start(session, filters, seen=()):
+    """
+    Starts a new queue for the search. Returns the first movie ID not in
+    seen, or None if nothing matched (or TMDB couldn't be reached).
+    """
+    filters = _normalize(filters)
+    seed = random.getrandbits(32)
+    found = _seek(filters, seed, 0, None, 0, seen)
+    if not found:
+        return None
+    batch, page_count, cursor, movie_id = found
+    session[SESSION_KEY] = [filters, seed, batch, page_count, cursor]
+    return movie_id
+
+
+def upcoming(session, count, seen=()):
+    """The IDs of up to count unseen movies after the current one, for warming."""
+    state = session.get(SESSION_KEY)
+    if not state:
+        return []
+    filters, seed, batch, page_count, cursor = state
+    _, movie_ids = tmdb_api.discover_batch(filters, seed, batch, page_count)
+    return [movie_id for movie_id in movie_ids[cursor + 1:] if movie_id not in seen][:count]
+
+
+def advance(session, seen=()):
+    """
+    Moves the queue to the next movie not in seen and returns its ID,
+    refilling from the next batch when the current one runs out. Returns
+    None if there is no queue or no more movies could be found.
+    """
+    state = session.get(SESSION_KEY)
+    if not state:
+        return None
+    filters, seed, batch, page_count, cursor = state
+
+    found = _seek(filters, seed, batch, page_count, cursor + 1, seen)
+    if not found:
+        return None
+    batch, page_count, cursor, movie_id = found
+    session[SESSION_KEY] = [filters, seed, batch, page_count, cursor]
+    return movie_id
+
+
+# Async versions, for async_views.py
+
+async def _aseek(filters, seed, batch, page_count, cursor, seen):
+    for _ in range(MAX_SKIPPED_BATCHES + 1):
+        rederived = page_count is not None
+        page_count, movie_ids = await tmdb_api.adiscover_batch(filters, seed, batch, page_count)
+        cursor = _first_unseen(movie_ids, cursor, seen)
+        if cursor is not None:
+            return batch, page_count, cursor, movie_ids[cursor]
+        if not movie_ids and not rederived:
+            return None
+        batch, page_count, cursor = batch + 1, None, 0
+    return None
+
+
+async def astart(session, filters, seen=()):
+    filters = _normalize(filters)
+    seed = random.getrandbits(32)
+    found = await _aseek(filters, seed, 0, None, 0, seen)
+    if not found:
+        return None
+    batch, page_count, cursor, movie_id = found
+    await session.aset(SESSION_KEY, [filters, seed, batch, page_count, cursor])
+    return movie_id
+
+
+async def aupcoming(session, count, seen=()):
+    state = await session.aget(SESSION_KEY)
+    if not state:
+        return []
+    filters, seed, batch, page_count, cursor = state
+    _, movie_ids = await tmdb_api.adiscover_batch(filters, seed, batch, page_count)
+    return [movie_id for movie_id in movie_ids[cursor + 1:] if movie_id not in seen][:count]
+
+
+async def aadvance(session, seen=()):
+    state = await session.aget(SESSION_KEY)
+    if not state:
+        return None
+    filters, seed, batch, page_count, cursor = state
+
+    found = await _aseek(filters, seed, batch, page_count, cursor + 1, seen)
+    if not found:
+        return None
+    batch, page_count, cursor, movie_id = found
+    await session.aset(SESSION_KEY, [filters, seed, batch, page_count, cursor])
+    return movie_id
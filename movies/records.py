@@ -0,0 +1,78 @@
+"""
+Compact records for the TMDB data we cache.
+
+A TMDB movie document is several kilobytes of JSON, and most of it is
+production companies, spoken languages, collection info and the full crew
+list. The templates only render a handful of fields. Those fields are
+projected into plain tuples before caching, which pickle packs far more
+tightly than nested dicts with repeated string keys. Reads rehydrate them
+into the dict shapes the templates expect (movie.genres[].name,
+cast[].name, director.name).
+
+The record layout is covered by fetch_cache.RECORD_VERSION. Bump it when
+these tuples change, so entries written in the old layout are treated as
+misses rather than unpacked wrongly.
+"""
+
+# Top-billed cast members shown on the details pages
+CAST_SIZE = 3
+
+MOVIE_FIELDS = (
+    'id', 'title', 'poster_path', 'release_date', 'vote_average',
+    'runtime', 'overview', 'original_language', 'genres',
+)
+
+
+def movie_record(data):
+    """Projects a TMDB movie document onto the fields the templates use."""
+    return (
+        data['id'],
+        data.get('title') or '',
+        data.get('poster_path') or '',
+        data.get('release_date') or '',
+        round(data.get('vote_average') or 0.0, 1),
+        data.get('runtime') or 0,
+        data.get('overview') or '',
+        data.get('original_language') or '',
+        tuple(genre['name'] for genre in data.get('genres', [])),
+    )
+
+
+def movie_from_record(record):
+    movie = dict(zip(MOVIE_FIELDS, record))
+    movie['genres'] = [{'name': name} for name in movie['genres']]
+    return movie
+
+
+def credits_record(data):
+    """
+    Reduces a TMDB credits document to the top-billed cast and the director:
+    (cast names, director name, cast IDs, director ID). The person IDs are
+    for similar_movies.
+    """
+    cast = data.get('cast', [])[:CAST_SIZE]
+    director = next((member for member in data.get('crew', []) if member.get('job') == 'Director'), None)
+    return (
+        tuple(member.get('name') for member in cast),
+        director.get('name') if director else None,
+        tuple(member.get('id') for member in cast),
+        director.get('id') if director else None,
+    )
+
+
+def credits_from_record(record):
+    """Returns {'cast': [...], 'director': ...} as the templates expect."""
+    if record is None:
+        return {'cast': [], 'director': None}
+    cast, director = record[:2]
+    return {
+        'cast': [{'name': name} for name in cast],
+        'director': {'name': director} if director else None,
+    }
+
+
+def credit_ids(record):
+    """Returns (cast IDs, director ID) from a credits record."""
+    if record is None:
+        return (), None
+    return record[2], record[3]
@@ -0,0 +1,147 @@
+"""
+Guards around the TMDB quota: a token bucket shared by every worker on the
+host, and a per-process circuit breaker.
+
+The bucket state is one row in a small SQLite file, and it is updated inside
+a write transaction. All gunicorn workers therefore draw from the same
+budget without needing a separate service.
+
+The breaker opens after a run of consecutive failures. While it is open,
+requests fail immediately instead of waiting on a service that is down, so
+callers serve cached data. After reset_timeout one trial request is let
+through (half-open). If it succeeds the breaker closes, otherwise it opens
+again.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class SharedTokenBucket:
+    def __init__(self, path, rate, capacity, name='tmdb'):
+        self.path = str(path)
+        self.rate = rate
+        self.capacity = capacity
+        self.name = name
+        self._local = threading.local()
+        self.waited = 0.0
+        self.rejected = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def try_acquire(self):
+        """
+        Takes a token if one is available. Returns 0 on success, or the
+        number of seconds until the next token would be available.
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT tokens, updated FROM token_buckets WHERE name = ?", [self.name]).fetchone()
+            tokens = self.capacity if row is None else min(self.capacity, row[0] + (now - row[1]) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute("INSERT OR REPLACE INTO token_buckets (name, tokens, updated) VALUES (?, ?, ?)", [self.name, tokens, now])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def acquire(self, max_wait):
+        """Blocks until a token is taken. Returns False if that would take longer than max_wait."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                self.rejected += 1
+                return False
+            self.waited += wait
+            time.sleep(wait)
+
+    def stats(self):
+        return {'rate': self.rate, 'capacity': self.capacity, 'waited_seconds': round(self.waited, 3), 'rejected': self.rejected}
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started = None
+        self._lock = threading.Lock()
+        self.short_circuited = 0
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """True if a request may go out now."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._trial_started = None
+            # Let one trial request through; if it never reports back, allow another later
+            if self._state == HALF_OPEN and (self._trial_started is None or now - self._trial_started >= self.reset_timeout):
+                self._trial_started = now
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                print("TMDB circuit closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    print(f"TMDB circuit opened after {self._failures} failures")
+                    self.times_opened += 1
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_started = None
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self._failures,
+            'short_circuited': self.short_circuited,
+            'times_opened': self.times_opened,
+        }
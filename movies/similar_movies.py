@@ -0,0 +1,339 @@
+"""
+"More like this": content-based neighbors for each movie, precomputed.
+
+Every movie in the catalog (and every saved movie the cache has details
+for) becomes a feature vector made of several blocks:
+- genres, one-hot;
+- release decade, one-hot, with half weight on the decades either side;
+- original language, one-hot over the most common ones;
+- vote average and vote count, standardized;
+- top-billed cast and director, hashed into PEOPLE_DIMS buckets. These
+  come from the cached credits, so only movies someone has viewed have them.
+Each block is scaled to unit length times its weight, and the rows are
+normalized so a dot product is the cosine similarity. The top-k neighbors
+of every row are found BATCH_SIZE rows at a time with matrix products.
+A little popularity is added so ties go to well-known movies.
+
+`manage.py build_similar_movies` writes the result as a catalog_index-style
+snapshot under SIMILAR_INDEX_DIR:
+    ids.npy        movie IDs, one per row
+    neighbors.npy  int32 (rows, k): each row's neighbors as movie IDs, best first
+    rows.npy       int32 indexed by movie ID: its row, or -1
+so a lookup is two array reads with no search. Workers memory-map the
+files and pick up a new snapshot within RELOAD_INTERVAL seconds.
+
+Needs NumPy; without it, or before the command has run, there are simply
+no similar movies.
+"""
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import catalog_index, fetch_cache, list_details, records
+from .catalog_index import GENRE_BITS, MIN_VOTE_COUNT, np
+from .forms import GENRE_CHOICES
+from .models import CatalogMovie, UserMovieList
+
+INDEX_DIR = getattr(settings, 'SIMILAR_INDEX_DIR', os.path.join(settings.BASE_DIR, 'similar_index'))
+
+# How many neighbors the table keeps per movie, and how many the page shows
+NEIGHBORS = getattr(settings, 'SIMILAR_NEIGHBORS', 20)
+SIMILAR_COUNT = getattr(settings, 'SIMILAR_COUNT', 6)
+
+# Rows per matrix product; memory use is about BATCH_SIZE * movies * 4 bytes
+BATCH_SIZE = 256
+
+TABLE_COLUMNS = {'ids': 'int32', 'neighbors': 'int32', 'rows': 'int32'}
+
+# Block weights; they only matter relative to each other
+GENRE_WEIGHT = 1.0
+PEOPLE_WEIGHT = 1.0
+DECADE_WEIGHT = 0.5
+LANGUAGE_WEIGHT = 0.5
+VOTES_WEIGHT = 0.3
+POPULARITY_TIE_BREAK = 0.01
+
+PEOPLE_DIMS = 512
+DIRECTOR_WEIGHT = 2.0
+LANGUAGES = 24
+FIRST_DECADE, LAST_DECADE = 1900, 2030
+
+RELOAD_INTERVAL = catalog_index.RELOAD_INTERVAL
+
+GENRE_NAME_BITS = {name: GENRE_BITS[genre_id] for genre_id, name in GENRE_CHOICES if genre_id}
+
+
+# Features
+
+def _unit_rows(block, weight):
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    return block * (weight / np.maximum(norms, 1e-12))
+
+
+def _person_bucket(person_id, salt):
+    # Knuth's multiplicative hash; cast and directors hash apart
+    return ((person_id * 2654435761 + salt) & 0xFFFFFFFF) % PEOPLE_DIMS
+
+
+def features(columns, people):
+    """
+    Unit-length float32 feature rows for the movies in columns (the
+    catalog_index layout). people maps movie IDs to (cast IDs, director ID).
+
+    Returns (dense, credit_rows, credits). The rows are split in two: dense
+    has the small blocks for every movie, and credits has the people block
+    only for credit_rows, the movies with cached credits. Most movies have
+    none, and the people block is most of the width, so it is multiplied
+    separately (see top_neighbors).
+    """
+    size = len(columns['id'])
+
+    genre_bits = np.array(list(GENRE_BITS.values()), dtype='uint32')
+    genres = ((columns['genres'][:, None] & genre_bits) != 0).astype('float32')
+
+    decade_count = (LAST_DECADE - FIRST_DECADE) // 10 + 1
+    decades = np.zeros((size, decade_count), dtype='float32')
+    known = columns['year'] > 0
+    decade = np.clip((columns['year'].astype('int32') - FIRST_DECADE) // 10, 0, decade_count - 1)
+    rows = np.flatnonzero(known)
+    decades[rows, decade[rows]] = 1.0
+    for offset in (-1, 1):
+        neighbor = decade[rows] + offset
+        inside = (neighbor >= 0) & (neighbor < decade_count)
+        decades[rows[inside], neighbor[inside]] = 0.5
+
+    codes, counts = np.unique(columns['language'][columns['language'] > 0], return_counts=True)
+    top_codes = np.sort(codes[np.argsort(-counts)][:LANGUAGES])
+    languages = np.zeros((size, max(len(top_codes), 1)), dtype='float32')
+    if len(top_codes):
+        position = np.minimum(np.searchsorted(top_codes, columns['language']), len(top_codes) - 1)
+        rows = np.flatnonzero(top_codes[position] == columns['language'])
+        languages[rows, position[rows]] = 1.0
+
+    average = columns['vote_average'].astype('float32')
+    count = np.log1p(columns['vote_count'].astype('float32'))
+    votes = np.stack([
+        (average - average.mean()) / max(average.std(), 1e-6),
+        (count - count.mean()) / max(count.std(), 1e-6),
+    ], axis=1).clip(-3, 3)
+
+    credit_rows = []
+    credits = []
+    for row, movie_id in enumerate(columns['id'].tolist()):
+        cast_ids, director_id = people.get(movie_id, ((), None))
+        buckets = np.zeros(PEOPLE_DIMS, dtype='float32')
+        for person_id in cast_ids:
+            if person_id:
+                buckets[_person_bucket(person_id, 0)] += 1.0
+        if director_id:
+            buckets[_person_bucket(director_id, 0x9E3779B9)] += DIRECTOR_WEIGHT
+        if buckets.any():
+            credit_rows.append(row)
+            credits.append(buckets)
+    credit_rows = np.array(credit_rows, dtype='int64')
+    credits = _unit_rows(np.array(credits, dtype='float32').reshape(-1, PEOPLE_DIMS), PEOPLE_WEIGHT)
+
+    dense = np.hstack([
+        _unit_rows(genres, GENRE_WEIGHT),
+        _unit_rows(decades, DECADE_WEIGHT),
+        _unit_rows(languages, LANGUAGE_WEIGHT),
+        votes * (VOTES_WEIGHT / 3),
+    ]).astype('float32')
+
+    # Normalize each whole row, both parts together
+    squared_norms = (dense * dense).sum(axis=1)
+    squared_norms[credit_rows] += PEOPLE_WEIGHT ** 2
+    scale = 1 / np.sqrt(np.maximum(squared_norms, 1e-12))
+    return dense * scale[:, None], credit_rows, credits * scale[credit_rows, None]
+
+
+def top_neighbors(features, popularity, k, batch_size=BATCH_SIZE):
+    """
+    The k most similar rows for every row (int32 row positions, best
+    first), by cosine similarity, BATCH_SIZE rows per matrix product.
+    features is what features() returns.
+    """
+    dense, credit_rows, credits = features
+    size = len(dense)
+    k = min(k, size - 1)
+    neighbors = np.zeros((size, max(k, 0)), dtype='int32')
+    if k <= 0:
+        return neighbors
+
+    log_popularity = np.log1p(np.maximum(popularity, 0)).astype('float32')
+    tie_break = POPULARITY_TIE_BREAK * log_popularity / max(float(log_popularity.max()), 1e-6)
+
+    for start in range(0, size, batch_size):
+        end = min(start + batch_size, size)
+        scores = dense[start:end] @ dense.T
+        # Only pairs of movies that both have credits share the people block
+        first, last = np.searchsorted(credit_rows, [start, end])
+        if first < last:
+            scores[np.ix_(credit_rows[first:last] - start, credit_rows)] += credits[first:last] @ credits.T
+        scores += tie_break
+        scores[np.arange(end - start), np.arange(start, end)] = -np.inf
+        top = np.argpartition(scores, -k, axis=1)[:, -k:]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        neighbors[start:end] = np.take_along_axis(top, order, axis=1)
+    return neighbors
+
+
+def build_table(columns, people, k=NEIGHBORS, batch_size=BATCH_SIZE):
+    """The arrays of a neighbor table (see TABLE_COLUMNS)."""
+    ids = columns['id'].astype('int32')
+    positions = top_neighbors(features(columns, people), columns['popularity'], k, batch_size)
+    rows = np.full(int(ids.max()) + 1 if len(ids) else 0, -1, dtype='int32')
+    rows[ids] = np.arange(len(ids), dtype='int32')
+    return {'ids': ids, 'neighbors': ids[positions], 'rows': rows}
+
+
+# Reading the movies
+
+def _cached_credits(movie_ids, chunk_size):
+    """
+    {movie_id: (movie record, credits record)} for the movies the cache has,
+    from the movie_full_ entries written by tmdb_api.get_movie_with_credits.
+    """
+    found = {}
+    for start in range(0, len(movie_ids), chunk_size):
+        keys = {f"movie_full_{movie_id}": movie_id for movie_id in movie_ids[start:start + chunk_size]}
+        for key, entry in cache.get_many(list(keys)).items():
+            data, _ = fetch_cache.unwrap(entry)
+            if data is not fetch_cache.MISSING and data:
+                found[keys[key]] = data
+    return found
+
+
+def _columns_from_record(movie):
+    # For saved movies that aren't in the catalog; the cache has no vote count
+    movie = records.movie_from_record(movie)
+    release_date = movie['release_date'] or ''
+    return {
+        'id': movie['id'],
+        'genres': sum(GENRE_NAME_BITS.get(genre['name'], 0) for genre in movie['genres']),
+        'year': int(release_date[:4]) if release_date[:4].isdigit() else 0,
+        'vote_average': movie['vote_average'],
+        'vote_count': MIN_VOTE_COUNT,
+        'language': catalog_index.language_code(movie['original_language']),
+        'popularity': 0.0,
+    }
+
+
+def read_movies(chunk_size=5000):
+    """
+    Returns (columns, people) for the catalog movies with enough votes plus
+    the saved movies the cache has details for.
+    """
+    columns = catalog_index.read_columns(chunk_size)
+    enough_votes = columns['vote_count'] >= MIN_VOTE_COUNT
+    columns = {name: values[enough_votes] for name, values in columns.items()}
+
+    catalog_ids = set(columns['id'].tolist())
+    saved_ids = sorted(set(UserMovieList.objects.values_list('movie_id', flat=True).distinct()) - catalog_ids)
+    cached = _cached_credits(sorted(catalog_ids) + saved_ids, chunk_size)
+
+    extra = [_columns_from_record(cached[movie_id][0]) for movie_id in saved_ids if cached.get(movie_id, (None,))[0]]
+    if extra:
+        columns = {
+            name: np.concatenate([values, np.array([row[name] for row in extra], dtype=values.dtype)])
+            for name, values in columns.items()
+        }
+        order = np.argsort(columns['id'], kind='stable')
+        columns = {name: values[order] for name, values in columns.items()}
+
+    people = {movie_id: records.credit_ids(credits) for movie_id, (_, credits) in cached.items()}
+    return columns, people
+
+
+def build(index_dir=None, k=NEIGHBORS, batch_size=BATCH_SIZE):
+    """Builds and writes a new neighbor table. Returns (path, movie count)."""
+    index_dir = index_dir or INDEX_DIR
+    columns, people = read_movies()
+    if len(columns['id']) < 2:
+        raise ValueError("Not enough movies to compare; ingest the catalog first.")
+    table = build_table(columns, people, k, batch_size)
+    os.makedirs(index_dir, exist_ok=True)
+    return catalog_index.write_snapshot(table, index_dir, dtypes=TABLE_COLUMNS), len(table['ids'])
+
+
+# Lookups
+
+class SimilarTable:
+    def __init__(self, columns, path=''):
+        self.ids = columns['ids']
+        self.neighbors = columns['neighbors']
+        self.rows = columns['rows']
+        self.version = os.path.basename(path)
+
+    @classmethod
+    def load(cls, path):
+        return cls({name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in TABLE_COLUMNS}, path)
+
+    def lookup(self, movie_id, count=SIMILAR_COUNT):
+        """Up to count similar movie IDs, best first; [] for a movie not in the table."""
+        movie_id = int(movie_id)
+        if not 0 <= movie_id < len(self.rows):
+            return []
+        row = self.rows[movie_id]
+        if row < 0:
+            return []
+        return self.neighbors[row, :count].tolist()
+
+
+_table = None
+_table_path = None
+_checked_at = 0
+_lock = threading.Lock()
+
+
+def get_table():
+    """Returns the current SimilarTable, or None if NumPy or a table is missing."""
+    global _table, _table_path, _checked_at
+    if np is None:
+        return None
+
+    now = time.monotonic()
+    if now - _checked_at < RELOAD_INTERVAL:
+        return _table
+
+    with _lock:
+        if now - _checked_at >= RELOAD_INTERVAL:
+            path = catalog_index.current_path(INDEX_DIR)
+            if path != _table_path:
+                try:
+                    _table = SimilarTable.load(path) if path else None
+                except OSError:
+                    _table = None
+                _table_path = path
+            _checked_at = now
+    return _table
+
+
+def version():
+    """Names the current table, so pages that show it can be revalidated (see page_cache)."""
+    table = get_table()
+    return table.version if table else ''
+
+
+def for_movie(movie_id, count=SIMILAR_COUNT):
+    """
+    [{'id', 'title', 'poster_path'}] for up to count movies like this one.
+    Titles and posters come from the cache, then the catalog; never TMDB.
+    """
+    table = get_table()
+    movie_ids = table.lookup(movie_id, count) if table else []
+    if not movie_ids:
+        return []
+
+    details = list_details.from_cache(movie_ids)
+    missing = [movie_id for movie_id in movie_ids if movie_id not in details]
+    if missing:
+        for movie in CatalogMovie.objects.filter(id__in=missing).values('id', 'title', 'poster_path'):
+            details[movie['id']] = (movie['title'], movie['poster_path'])
+    return [
+        {'id': movie_id, 'title': details[movie_id][0], 'poster_path': details[movie_id][1]}
+        for movie_id in movie_ids if movie_id in details
+    ]
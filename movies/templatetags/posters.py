@@ -0,0 +1,21 @@
+from django import template
+from django.utils.html import format_html
+
+from movies import posters
+
+register = template.Library()
+
+@register.simple_tag
+def poster(poster_path, alt, css_class='', sizes=posters.GRID_SIZES, loading='lazy'):
+    """
+    A <picture> for a TMDB poster_path served through the poster proxy:
+    WebP where the browser takes it, JPEG otherwise, and srcset so the
+    browser picks the smallest size that fills the slot.
+    """
+    return format_html(
+        '<picture class="block w-full h-full"><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="{}"></picture>',
+        posters.srcset(poster_path, 'webp'), sizes,
+        posters.url(poster_path, 'w342', 'jpg'), posters.srcset(poster_path, 'jpg'), sizes,
+        alt, css_class, loading,
+    )
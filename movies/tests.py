@@ -1,3 +1,1683 @@
-from django.test import TestCase
+"""
+Query-count and TMDB-call budgets for every route in movies/urls.py.
 
-# Create your tests here.
+TMDB is replaced by FakeTMDB at tmdb_client.get/aget, and background work
+(warm-ahead, stale refreshes) runs inline, so the numbers are deterministic.
+Each budget is a maximum; a new N+1 loop or an extra TMDB lookup pushes a
+view over it and fails the run.
+
+Wall-clock timings of the budgeted requests are written to
+perf_results.json (or $PERF_RESULTS). If perf_baseline.json (or
+$PERF_BASELINE) exists, requests that got more than twice as slow are
+printed; copy a results file over the baseline to accept new numbers.
+"""
+import asyncio
+import datetime
+import importlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+from unittest import mock
+
+import httpx
+import requests
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import LiveServerTestCase, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone
+from PIL import Image
+
+from pickAmovie import urls as project_urls
+
+from . import cache_backends, catalog, catalog_index, fetch_cache, list_details, list_export, list_import, metrics, page_cache, posters, profile_lists, records, resilience, seen_movies, similar_movies, tmdb_api, tmdb_client
+from . import async_views
+from . import urls as movies_urls
+from .management.commands import benchmark_discover, fake_tmdb
+from .middleware import PerformanceMiddleware
+from .models import CatalogMovie, UserMovieList
+
+RESULTS_PATH = os.getenv('PERF_RESULTS', os.path.join(settings.BASE_DIR, 'perf_results.json'))
+BASELINE_PATH = os.getenv('PERF_BASELINE', os.path.join(settings.BASE_DIR, 'perf_baseline.json'))
+
+# The real function, for tests that go past FakeTMDB into the client
+REAL_GET_IMAGE = tmdb_client.get_image
+
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'movies-tests'}}
+
+_timings = {}
+
+
+def record_timing(name, seconds):
+    _timings.setdefault(name, []).append(round(seconds * 1000, 3))
+
+
+def write_timings():
+    results = {name: min(runs) for name, runs in sorted(_timings.items())}
+    with open(RESULTS_PATH, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    if not os.path.exists(BASELINE_PATH):
+        return
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+    for name, ms in results.items():
+        if name in baseline and ms > 2 * baseline[name] and ms > 5:
+            print(f"\nSLOWER: {name} took {ms:.1f} ms (baseline {baseline[name]:.1f} ms)")
+
+
+class FakeTMDB:
+    """Answers the TMDB endpoints the app uses, and counts the calls."""
+
+    TOTAL_PAGES = 5
+    PAGE_SIZE = 20
+
+    def __init__(self):
+        self.calls = []
+        self.missing = set()
+
+    def get(self, url, params=None):
+        params = params or {}
+        self.calls.append(url)
+        if url.endswith('/discover/movie'):
+            page = params.get('page', 1)
+            if page > self.TOTAL_PAGES:
+                return {'results': [], 'total_pages': self.TOTAL_PAGES}
+            start = (page - 1) * self.PAGE_SIZE + 1
+            return {
+                'results': [{'id': movie_id} for movie_id in range(start, start + self.PAGE_SIZE)],
+                'total_pages': self.TOTAL_PAGES,
+            }
+
+        if url.endswith('/search/movie'):
+            # "Movie <id>" is found, anything else isn't
+            match = re.fullmatch(r'Movie (\d+)', params['query'])
+            if not match:
+                return {'results': []}
+            movie = self.movie(int(match.group(1)))
+            return {'results': [{name: movie[name] for name in ('id', 'title', 'poster_path', 'release_date')}]}
+
+        match = re.search(r'/movie/(\d+)(/credits)?$', url)
+        movie_id = int(match.group(1))
+        if movie_id in self.missing:
+            response = requests.Response()
+            response.status_code = 404
+            raise requests.HTTPError("404 Not Found", response=response)
+        if match.group(2):
+            return self.credits(movie_id)
+        movie = self.movie(movie_id)
+        if params.get('append_to_response') == 'credits':
+            movie['credits'] = self.credits(movie_id)
+        return movie
+
+    async def aget(self, url, params=None):
+        return self.get(url, params)
+
+    def get_image(self, url):
+        self.calls.append(url)
+        out = BytesIO()
+        Image.new('RGB', (500, 750), (200, 30, 30)).save(out, 'JPEG')
+        return out.getvalue()
+
+    def movie(self, movie_id):
+        return {
+            'id': movie_id,
+            'title': f"Movie {movie_id}",
+            'poster_path': f"/poster{movie_id}.jpg",
+            'release_date': '2001-02-03',
+            'vote_average': 7.25,
+            'runtime': 101,
+            'overview': "A movie.",
+            'original_language': 'en',
+            'genres': [{'id': 18, 'name': 'Drama'}],
+            'production_companies': [{'id': 1, 'name': 'Studio', 'logo_path': None, 'origin_country': 'US'}],
+        }
+
+    def credits(self, movie_id):
+        return {
+            'cast': [{'id': i, 'name': f"Actor {i}", 'character': 'Someone'} for i in range(10)],
+            'crew': [{'id': 99, 'name': 'A Director', 'job': 'Director'}],
+        }
+
+
+class FakeClock:
+    """Stands in for a module's `time`; sleep() moves the clock instead of waiting."""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    advance = sleep
+
+
+def run_inline(fn, *args):
+    fn(*args)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PerfTestCase(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        write_timings()
+
+    def setUp(self):
+        cache.clear()
+        self.tmdb = FakeTMDB()
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        for patcher in (
+            mock.patch.object(tmdb_client, 'get', self.tmdb.get),
+            mock.patch.object(tmdb_client, 'aget', self.tmdb.aget),
+            mock.patch.object(tmdb_client, 'get_image', self.tmdb.get_image),
+            mock.patch.object(posters, 'CACHE_DIR', os.path.join(files.name, 'posters')),
+            mock.patch.object(fetch_cache, 'run_in_background', run_inline),
+            mock.patch.object(metrics, 'store', metrics.MetricsStore(os.path.join(files.name, 'metrics.sqlite3'))),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def login(self, username='viewer'):
+        user = User.objects.create_user(username, password='password')
+        self.client.force_login(user)
+        return user
+
+    def save_movies(self, user, count, status='watch_later'):
+        now = timezone.now()
+        UserMovieList.objects.bulk_create(
+            UserMovieList(
+                user=user, movie_id=1000 + i, status=status,
+                title=f"Movie {1000 + i}", poster_path=f"/poster{1000 + i}.jpg", details_refreshed_on=now,
+            )
+            for i in range(count)
+        )
+
+    @contextmanager
+    def budget(self, name, queries, tmdb_calls):
+        """Fails if the block runs more than `queries` SQL queries or `tmdb_calls` TMDB calls."""
+        calls_before = len(self.tmdb.calls)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            yield
+            record_timing(name, time.perf_counter() - started)
+
+        made = self.tmdb.calls[calls_before:]
+        sql = '\n'.join(query['sql'] for query in captured.captured_queries)
+        self.assertLessEqual(len(captured), queries, f"{name}: {len(captured)} queries\n{sql}")
+        self.assertLessEqual(len(made), tmdb_calls, f"{name}: {len(made)} TMDB calls: {made}")
+
+
+class PublicPageTests(PerfTestCase):
+    def test_landing_page(self):
+        with self.budget('landing_page', queries=0, tmdb_calls=0):
+            response = self.client.get(reverse('landing_page'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_signup(self):
+        with self.budget('signup_form', queries=0, tmdb_calls=0):
+            self.client.get(reverse('signup'))
+
+        with self.budget('signup_submit', queries=12, tmdb_calls=0):
+            response = self.client.post(reverse('signup'), {
+                'username': 'newuser', 'email': 'new@example.com',
+                'password1': 'a-long-Passw0rd', 'password2': 'a-long-Passw0rd',
+            })
+        self.assertRedirects(response, reverse('filter_page'), fetch_redirect_response=False)
+
+
+class RecommendationTests(PerfTestCase):
+    search = {'genre': '18', 'year_from': '', 'year_to': '', 'rating': '', 'language': ''}
+
+    def start_queue(self):
+        response = self.client.get(reverse('filter_page'), self.search)
+        self.assertEqual(response.status_code, 302)
+        return response
+
+    def test_filter_form(self):
+        with self.budget('filter_page_form', queries=0, tmdb_calls=0):
+            response = self.client.get(reverse('filter_page'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_search_cold(self):
+        # One parallel round of pages, a second if the guessed page count was
+        # too high, then the warm-ahead
+        pages = tmdb_api.DISCOVER_PAGES_PER_BATCH
+        with self.budget('filter_page_search_cold', queries=5, tmdb_calls=2 * pages + tmdb_api.WARM_AHEAD):
+            self.start_queue()
+
+    def test_search_pools_several_pages(self):
+        self.tmdb.TOTAL_PAGES = 10
+        self.start_queue()
+        filters, seed, batch, page_count, cursor = self.client.session['recommendation_queue']
+        self.assertEqual(page_count, 10)
+
+        # The merged pool is cached, so re-deriving the batch is one cache read
+        with self.budget('discover_batch_pooled', queries=0, tmdb_calls=0):
+            _, movie_ids = tmdb_api.discover_batch(filters, seed, batch, page_count)
+        self.assertEqual(len(set(movie_ids)), FakeTMDB.PAGE_SIZE * tmdb_api.DISCOVER_PAGES_PER_BATCH)
+
+        # Pages are interleaved, and a movie on two pages comes up once
+        merged = tmdb_api._merge_pages(seed, 0, [1, 2], {1: (1, 2), 2: (3, 4)})
+        self.assertEqual([movie_id in (1, 2) for movie_id in merged], [True, False, True, False])
+        self.assertEqual(sorted(tmdb_api._merge_pages(seed, 0, [1, 2], {1: (1, 2, 3), 2: (3, 4)})), [1, 2, 3, 4])
+
+    def test_batch_page_order_agrees_with_guess(self):
+        depth = tmdb_api.MAX_DISCOVER_PAGES
+        guessed = [tmdb_api._batch_page('seed', position, None) for position in range(depth)]
+        self.assertEqual(sorted(guessed), list(range(1, depth + 1)))
+        for total_pages in (1, 3, depth - 1):
+            order = [tmdb_api._batch_page('seed', position, total_pages) for position in range(total_pages)]
+            # Every real page once per cycle, in the guessed order
+            self.assertEqual(order, [page for page in guessed if page <= total_pages])
+        # The next cycle is shuffled again
+        self.assertEqual(sorted(tmdb_api._batch_page('seed', depth + position, None) for position in range(depth)),
+                         list(range(1, depth + 1)))
+
+    def test_high_guess_keeps_the_real_pages_it_fetched(self):
+        # Fewer pages than the first batch guesses
+        self.tmdb.TOTAL_PAGES = 6
+        self.start_queue()
+        filters, seed, _, page_count, _ = self.client.session['recommendation_queue']
+        self.assertEqual(page_count, 6)
+
+        guessed = tmdb_api._batch_pages(seed, 0, tmdb_api.MAX_DISCOVER_PAGES)
+        picked = tmdb_api._batch_pages(seed, 0, page_count)
+        self.assertLessEqual({page for page in guessed if page <= page_count}, set(picked))
+        # Each page was asked for once
+        self.assertEqual(sum(url.endswith('/discover/movie') for url in self.tmdb.calls), len(set(guessed) | set(picked)))
+
+    def test_catalog_without_votes_falls_back_to_tmdb(self):
+        # TMDB's daily export has only id, original_title and popularity
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            for movie_id in range(1, 3001):
+                f.write(json.dumps({'adult': False, 'id': movie_id, 'original_title': f"Movie {movie_id}", 'popularity': 1.5, 'video': False}) + '\n')
+        self.addCleanup(os.unlink, f.name)
+        call_command('ingest_catalog', f.name, stdout=StringIO())
+        self.assertEqual(CatalogMovie.objects.count(), 3000)
+        self.assertEqual(CatalogMovie.objects.get(id=7).title, "Movie 7")
+
+        self.start_queue()
+        self.assertIsNotNone(self.client.session['recommendation_queue'])
+        self.assertTrue(any(url.endswith('/discover/movie') for url in self.tmdb.calls))
+
+    def test_search_warms_the_next_movies(self):
+        self.start_queue()
+        state = self.client.session['recommendation_queue']
+        _, movie_ids = tmdb_api.discover_batch(*state[:4])
+        for movie_id in movie_ids[1:1 + tmdb_api.WARM_AHEAD]:
+            self.assertIn(f"movie_full_{movie_id}", cache)
+
+    def test_recommendation_cold_and_warm(self):
+        with self.budget('movie_recommendation_cold', queries=0, tmdb_calls=1):
+            response = self.client.get(reverse('movie_recommendation', args=[550]))
+        self.assertContains(response, "Movie 550")
+        self.assertContains(response, "A Director")
+
+        with self.budget('movie_recommendation_warm', queries=0, tmdb_calls=0):
+            response = self.client.get(reverse('movie_recommendation', args=[550]))
+        self.assertContains(response, "Movie 550")
+
+    def test_recommendation_in_queue_is_warm(self):
+        self.client.get(self.start_queue()['Location'])
+        location = self.client.get(reverse('next_movie'))['Location']
+
+        # Only the movie after the warmed ones may be fetched; this one was warmed ahead
+        calls_before = len(self.tmdb.calls)
+        with self.budget('movie_recommendation_queued', queries=1, tmdb_calls=1):
+            self.client.get(location)
+        movie_id = re.search(r'/movie/(\d+)/', location).group(1)
+        self.assertFalse([url for url in self.tmdb.calls[calls_before:] if url.endswith(f"/movie/{movie_id}")])
+
+    def test_recommendation_revalidates_with_304(self):
+        url = reverse('movie_recommendation', args=[550])
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], f'public, max-age={page_cache.MAX_AGE}')
+        self.assertIn('Last-Modified', response)
+
+        # Back-navigation and repeat views don't render or touch TMDB
+        with self.budget('movie_recommendation_304', queries=0, tmdb_calls=0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # A refreshed movie is a new version
+        cache.delete('movie_full_550')
+        self.client.get(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_recommendation_304_skips_warm_ahead(self):
+        self.login()
+        location = self.start_queue()['Location']
+        response = self.client.get(location)
+        with mock.patch.object(tmdb_api, 'warm_movies') as warm_movies, \
+                mock.patch('movies.async_views.awarm_movies') as awarm_movies:
+            with self.budget('movie_recommendation_304_queued', queries=2, tmdb_calls=0):
+                response = self.client.get(location, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        warm_movies.assert_not_called()
+        awarm_movies.assert_not_called()
+
+    def test_recommendation_logged_in_is_private(self):
+        user = self.login()
+        url = reverse('movie_recommendation', args=[550])
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Another user's copy of the page has their own name and CSRF token in it
+        self.client.logout()
+        self.login('other')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # A page showing a flash message is never cached
+        self.client.force_login(user)
+        response = self.client.post(reverse('add_to_list'), {'movie_id': 550, 'status': 'watch_later'}, HTTP_REFERER=url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Movie list updated successfully!")
+        self.assertEqual(response['Cache-Control'], 'private, no-store')
+        self.assertNotIn('ETag', response)
+
+    def test_recommendation_shared_page_cache(self):
+        url = reverse('movie_recommendation', args=[550])
+        with mock.patch.object(page_cache, 'SHARED_CACHE', True):
+            first = self.client.get(url)
+            with mock.patch('movies.views.render') as render:
+                with self.budget('movie_recommendation_page_cache', queries=0, tmdb_calls=0):
+                    second = self.client.get(url)
+            render.assert_not_called()
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_missing_movie_is_404(self):
+        self.tmdb.missing.add(404)
+        with self.budget('movie_recommendation_missing', queries=0, tmdb_calls=1):
+            response = self.client.get(reverse('movie_recommendation', args=[404]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_next_movie(self):
+        self.start_queue()
+        with self.budget('next_movie', queries=4, tmdb_calls=0):
+            response = self.client.get(reverse('next_movie'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_next_movie_refills_from_another_page(self):
+        self.tmdb.TOTAL_PAGES = 10
+        batch_size = FakeTMDB.PAGE_SIZE * tmdb_api.DISCOVER_PAGES_PER_BATCH
+        seen = {self.start_queue()['Location']}
+        for _ in range(batch_size * 2 - 1):
+            response = self.client.get(reverse('next_movie'))
+            seen.add(response['Location'])
+        # Two batches, no repeats
+        self.assertEqual(len(seen), batch_size * 2)
+
+        discover_calls = [url for url in self.tmdb.calls if url.endswith('/discover/movie')]
+        self.assertLessEqual(len(discover_calls), 2 * tmdb_api.DISCOVER_PAGES_PER_BATCH)
+
+    def movie_id_of(self, response):
+        return int(re.search(r'/movie/(\d+)/', response['Location']).group(1))
+
+    def test_queue_skips_listed_movies(self):
+        user = self.login()
+        first = self.movie_id_of(self.start_queue())
+        filters, seed, batch, page, cursor = self.client.session['recommendation_queue']
+        _, movie_ids = tmdb_api.discover_batch(filters, seed, batch, page)
+        listed = movie_ids[cursor + 1:cursor + 4]
+        for movie_id in [first] + listed:
+            self.client.post(reverse('add_to_list'), {'movie_id': movie_id, 'status': 'watch_later'})
+
+        # Adding the current movie didn't shift the queue, and the listed ones are
+        # skipped without fetching them
+        calls_before = len(self.tmdb.calls)
+        response = self.client.get(reverse('next_movie'))
+        self.assertEqual(self.movie_id_of(response), movie_ids[cursor + 4])
+        self.client.get(response['Location'])
+        fetched = {int(url.rsplit('/', 1)[1]) for url in self.tmdb.calls[calls_before:] if '/movie/' in url}
+        self.assertFalse(fetched & set(listed))
+
+        # Deleting one from the list lets it come up again in a new queue
+        entry = UserMovieList.objects.get(user=user, movie_id=listed[0])
+        self.client.post(reverse('delete_from_list'), {'entry_id': entry.id})
+        # Rebuilt from the database after the change
+        with self.assertNumQueries(1):
+            seen = seen_movies.for_user(user)
+        self.assertNotIn(listed[0], seen)
+        self.assertIn(listed[1], seen)
+
+    def test_queue_with_10k_listed_movies(self):
+        user = self.login()
+        # Four in five of the movies TMDB returns are already listed
+        listed = [movie_id for movie_id in range(1, 10_001) if movie_id > 100 or movie_id % 5]
+        UserMovieList.objects.bulk_create(
+            UserMovieList(user=user, movie_id=movie_id, status='watched') for movie_id in listed
+        )
+
+        # The first search builds the seen set with one query
+        with self.budget('filter_page_search_10k_seen_cold', queries=7, tmdb_calls=2 * tmdb_api.DISCOVER_PAGES_PER_BATCH + tmdb_api.WARM_AHEAD):
+            response = self.start_queue()
+        self.assertEqual(self.movie_id_of(response) % 5, 0)
+
+        with self.budget('filter_page_search_10k_seen_warm', queries=6, tmdb_calls=tmdb_api.DISCOVER_PAGES_PER_BATCH + tmdb_api.WARM_AHEAD):
+            self.start_queue()
+
+        for _ in range(FakeTMDB.PAGE_SIZE):
+            response = self.client.get(reverse('next_movie'))
+            self.assertEqual(self.movie_id_of(response) % 5, 0)
+
+    def test_next_movie_without_queue(self):
+        with self.budget('next_movie_no_queue', queries=0, tmdb_calls=0):
+            response = self.client.get(reverse('next_movie'))
+        self.assertRedirects(response, reverse('filter_page'), fetch_redirect_response=False)
+
+
+class ListTests(PerfTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.login()
+
+    def test_add_to_list_uses_cached_movie(self):
+        self.client.get(reverse('movie_recommendation', args=[550]))
+        with self.budget('add_to_list', queries=8, tmdb_calls=0):
+            self.client.post(reverse('add_to_list'), {'movie_id': 550, 'status': 'watch_later'})
+
+        entry = UserMovieList.objects.get(user=self.user, movie_id=550)
+        self.assertEqual(entry.title, "Movie 550")
+        self.assertEqual(entry.poster_path, "/poster550.jpg")
+        self.assertIsNotNone(entry.details_refreshed_on)
+
+    def test_add_to_list_never_waits_on_tmdb(self):
+        # Not cached: saved without details, which the profile page fills in
+        with self.budget('add_to_list_uncached', queries=8, tmdb_calls=0):
+            self.client.post(reverse('add_to_list'), {'movie_id': 551, 'status': 'watched'})
+        entry = UserMovieList.objects.get(user=self.user, movie_id=551)
+        self.assertEqual((entry.title, entry.status), ('', 'watched'))
+        self.assertIsNone(entry.details_refreshed_on)
+
+        for data in ({'movie_id': 'x', 'status': 'watched'}, {'movie_id': 552, 'status': 'owned'}, {}):
+            with self.budget('add_to_list_invalid', queries=2, tmdb_calls=0):
+                self.assertEqual(self.client.post(reverse('add_to_list'), data).status_code, 400)
+        self.assertEqual(UserMovieList.objects.count(), 1)
+
+    def test_profile_page_makes_no_tmdb_calls(self):
+        self.save_movies(self.user, 150, 'watch_later')
+        self.save_movies_watched(50)
+        with self.budget('profile_page_200', queries=6, tmdb_calls=0):
+            response = self.client.get(reverse('profile_page'))
+        self.assertEqual(response.context['watch_later_count'], 150)
+        self.assertEqual(response.context['watched_count'], 50)
+
+    def save_movies_watched(self, count):
+        now = timezone.now()
+        UserMovieList.objects.bulk_create(
+            UserMovieList(user=self.user, movie_id=5000 + i, status='watched', title='x', details_refreshed_on=now)
+            for i in range(count)
+        )
+
+    def test_profile_page_queries_dont_grow_with_list_size(self):
+        self.save_movies(self.user, 5)
+        self.client.get(reverse('profile_page'))
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('profile_page'))
+
+        self.save_movies_watched(500)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(reverse('profile_page'))
+        self.assertEqual(len(small), len(large))
+
+    def test_profile_page_fills_in_missing_details(self):
+        UserMovieList.objects.create(user=self.user, movie_id=77, status='watched')
+        # The refresh runs inline here; in production it's on the background pool
+        with self.budget('profile_page_backfill', queries=8, tmdb_calls=1):
+            self.client.get(reverse('profile_page'))
+        self.assertEqual(UserMovieList.objects.get(movie_id=77).title, "Movie 77")
+
+    def test_backfill_list_details(self):
+        now = timezone.now()
+        filled = UserMovieList.objects.create(user=self.user, movie_id=90, status='watched', title='Kept', details_refreshed_on=now)
+        UserMovieList.objects.bulk_create(
+            UserMovieList(user=self.user, movie_id=100 + i, status='watched') for i in range(5)
+        )
+        self.tmdb.missing.add(104)
+        out = StringIO()
+        # A select and a bulk_update per batch of 2 (none for the batch TMDB
+        # had nothing for), and a last select that finds nothing
+        with self.budget('backfill_list_details', queries=6, tmdb_calls=5):
+            call_command('backfill_list_details', batch_size=2, stdout=out)
+        self.assertEqual(out.getvalue().count("Up to id"), 3)
+        self.assertIn("Done: 4 of 5 rows filled in", out.getvalue())
+
+        entries = {entry.movie_id: entry for entry in UserMovieList.objects.filter(user=self.user)}
+        self.assertEqual(entries[100].title, "Movie 100")
+        self.assertGreaterEqual(entries[100].details_refreshed_on, now)
+        self.assertIsNone(entries[104].details_refreshed_on)
+        self.assertEqual((entries[90].title, entries[90].details_refreshed_on), ('Kept', filled.details_refreshed_on))
+
+    def test_stale_page_takes_one_lock(self):
+        UserMovieList.objects.bulk_create(
+            UserMovieList(user=self.user, movie_id=100 + i, status='watched') for i in range(20)
+        )
+        entries = list(profile_lists._page_queryset(self.user, 'watched'))
+        with mock.patch.object(list_details.cache, 'add', wraps=list_details.cache.add) as add, \
+                mock.patch.object(fetch_cache, 'run_in_background') as run:
+            list_details.prepare(entries)
+            # Another worker rendering the same page finds the lock taken
+            list_details.prepare(entries)
+        self.assertEqual(add.call_count, 2)
+        run.assert_called_once()
+        self.assertEqual(len(run.call_args.args[1]), 20)
+
+    def test_profile_page_shows_unfilled_rows(self):
+        self.save_movies(self.user, 2)
+        self.tmdb.missing.add(77)
+        UserMovieList.objects.create(user=self.user, movie_id=77, status='watch_later')
+        response = self.client.get(reverse('profile_page'))
+        # The refresh failed, but the row is still there to be removed
+        self.assertEqual(len(response.context['watch_later_movies']), response.context['watch_later_count'])
+        self.assertContains(response, list_details.PLACEHOLDER_TITLE)
+        self.assertContains(response, reverse('my_movie_details', args=[77]))
+
+        response = self.client.get(reverse('my_movie_details', args=[77]))
+        self.assertContains(response, list_details.PLACEHOLDER_TITLE)
+        self.assertContains(response, reverse('delete_from_list'))
+
+    def test_profile_list_pages(self):
+        self.save_movies(self.user, 60)
+        url = reverse('profile_list_page', args=['watch_later'])
+        seen = []
+        after = ''
+        while True:
+            with self.budget('profile_list_page', queries=3, tmdb_calls=0):
+                data = self.client.get(url, {'after': after} if after else {}).json()
+            seen.extend(movie['id'] for movie in data['movies'])
+            if not data['next']:
+                break
+            after = data['next']
+        self.assertEqual(sorted(seen), list(range(1000, 1060)))
+
+    def test_profile_list_page_unknown_status(self):
+        response = self.client.get(reverse('profile_list_page', args=['nope']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_my_movie_details(self):
+        UserMovieList.objects.create(user=self.user, movie_id=550, status='watched')
+        with self.budget('my_movie_details_cold', queries=3, tmdb_calls=1):
+            response = self.client.get(reverse('my_movie_details', args=[550]))
+        self.assertContains(response, "Movie 550")
+
+        with self.budget('my_movie_details_warm', queries=3, tmdb_calls=0):
+            self.client.get(reverse('my_movie_details', args=[550]))
+
+    def test_delete_from_list(self):
+        entry = UserMovieList.objects.create(user=self.user, movie_id=550, status='watched')
+        with self.budget('delete_from_list', queries=4, tmdb_calls=0):
+            self.client.post(reverse('delete_from_list'), {'entry_id': entry.id})
+        self.assertFalse(UserMovieList.objects.filter(id=entry.id).exists())
+
+    def test_move_to_watched(self):
+        entry = UserMovieList.objects.create(user=self.user, movie_id=550, status='watch_later')
+        with self.budget('move_to_watched', queries=5, tmdb_calls=0):
+            self.client.post(reverse('move_to_watched'), {'entry_id': entry.id})
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'watched')
+
+    def test_delete_profile(self):
+        with self.budget('delete_profile_form', queries=2, tmdb_calls=0):
+            self.client.get(reverse('delete_profile'))
+
+        self.save_movies(self.user, 50)
+        with self.budget('delete_profile', queries=10, tmdb_calls=0):
+            response = self.client.post(reverse('delete_profile'))
+        self.assertRedirects(response, reverse('landing_page'), fetch_redirect_response=False)
+        self.assertFalse(UserMovieList.objects.exists())
+
+
+class AsyncViewTests(PerfTestCase):
+    """The async_views.py routes, requested through AsyncClient as under ASGI."""
+
+    search = RecommendationTests.search
+
+    def setUp(self):
+        super().setUp()
+        self.route_views(async_views=True)
+        self.addCleanup(self.route_views, async_views=False)
+
+    def route_views(self, async_views):
+        # urls.py picks its views at import time
+        with self.settings(ASYNC_VIEWS=async_views):
+            importlib.reload(movies_urls)
+            importlib.reload(project_urls)
+        clear_url_caches()
+
+    def get(self, *args, **kwargs):
+        return async_to_sync(self.async_client.get)(*args, **kwargs)
+
+    def test_routes_are_async(self):
+        for name, args in (('filter_page', []), ('movie_recommendation', [550]), ('next_movie', []), ('profile_page', [])):
+            self.assertTrue(iscoroutinefunction(resolve(reverse(name, args=args)).func), name)
+
+    def test_filter_movie_next(self):
+        pages = tmdb_api.DISCOVER_PAGES_PER_BATCH
+        with self.budget('async_filter_page_search_cold', queries=5, tmdb_calls=2 * pages + tmdb_api.WARM_AHEAD):
+            response = self.get(reverse('filter_page'), self.search)
+        self.assertEqual(response.status_code, 302)
+        first = response['Location']
+
+        # Warmed by the search
+        with self.budget('async_movie_recommendation_queued', queries=1, tmdb_calls=1):
+            response = self.get(first)
+        movie_id = int(re.search(r'/movie/(\d+)/', first).group(1))
+        self.assertContains(response, f"Movie {movie_id}")
+        self.assertEqual(response['Cache-Control'], f'public, max-age={page_cache.MAX_AGE}')
+
+        with self.budget('async_movie_recommendation_304', queries=1, tmdb_calls=0):
+            response = self.get(first, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        with self.budget('async_next_movie', queries=4, tmdb_calls=0):
+            response = self.get(reverse('next_movie'))
+        self.assertEqual(response.status_code, 302)
+        self.assertNotEqual(response['Location'], first)
+        self.assertContains(self.get(response['Location']), "Movie ")
+
+    def test_movie_not_on_list_is_404_without_tmdb(self):
+        self.async_client.force_login(User.objects.create_user('viewer', password='password'))
+        with self.budget('async_my_movie_details_404', queries=3, tmdb_calls=0):
+            self.assertEqual(self.get(reverse('my_movie_details', args=[550])).status_code, 404)
+
+    def test_slow_requests_overlap(self):
+        def slow_for_movie(movie_id):
+            time.sleep(0.5)
+            return []
+
+        async def two_requests():
+            started = time.perf_counter()
+            responses = await asyncio.gather(*(
+                self.async_client.get(reverse('movie_recommendation', args=[movie_id])) for movie_id in (550, 551)
+            ))
+            return time.perf_counter() - started, responses
+
+        # Off the shared thread, neither waits for the other's sync work
+        with mock.patch.object(async_views, 'afor_movie', async_views.in_thread(slow_for_movie)):
+            seconds, responses = async_to_sync(two_requests)()
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertLess(seconds, 0.9)
+
+    def test_next_movie_without_queue(self):
+        response = self.get(reverse('next_movie'))
+        self.assertRedirects(response, reverse('filter_page'), fetch_redirect_response=False)
+
+    def test_missing_movie_is_404(self):
+        self.tmdb.missing.add(404)
+        self.assertEqual(self.get(reverse('movie_recommendation', args=[404])).status_code, 404)
+
+    def test_profile_page(self):
+        user = User.objects.create_user('viewer', password='password')
+        self.async_client.force_login(user)
+        self.save_movies(user, 30)
+        UserMovieList.objects.create(user=user, movie_id=77, status='watched')
+        with self.budget('async_profile_page', queries=8, tmdb_calls=1):
+            response = self.get(reverse('profile_page'))
+        self.assertEqual(response.context['watch_later_count'], 30)
+        self.assertEqual(len(response.context['watch_later_movies']), profile_lists.PAGE_SIZE)
+        self.assertContains(response, 'viewer')
+        # Filled in by the background refresh, which runs inline here
+        self.assertEqual(UserMovieList.objects.get(movie_id=77).title, "Movie 77")
+
+        with self.budget('async_my_movie_details', queries=3, tmdb_calls=1):
+            response = self.get(reverse('my_movie_details', args=[1000]))
+        self.assertContains(response, "Movie 1000")
+
+    def test_export_streams_asynchronously(self):
+        user = User.objects.create_user('viewer', password='password')
+        self.async_client.force_login(user)
+        self.save_movies(user, 1200)
+
+        async def export():
+            with self.settings(ASYNC_VIEWS=True):
+                response = await self.async_client.get(reverse('export_list'))
+                # A sync iterator would be read into a list before sending
+                self.assertTrue(response.is_async)
+                return [chunk async for chunk in response.streaming_content]
+
+        with self.budget('async_export_list_1200', queries=5, tmdb_calls=0):
+            chunks = async_to_sync(export)()
+        # The header, then one chunk per batch
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [1, 500, 500, 200])
+        self.assertEqual(len({line.split(b',')[0] for line in b''.join(chunks).splitlines()[1:]}), 1200)
+
+
+class TMDBClientTestsMixin:
+    """
+    Tests for both TMDB clients. Subclasses send self.responses, each a
+    (status, json) pair or 'refused' for a connection error, through a fake
+    transport and record the URLs in self.sent.
+    """
+
+    def setUp(self):
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        self.responses = []
+        self.sent = []
+        self.breaker = resilience.CircuitBreaker(failure_threshold=5, reset_timeout=30)
+        self.bucket = resilience.SharedTokenBucket(os.path.join(files.name, 'ratelimit.sqlite3'), rate=100, capacity=100)
+        for patcher in (
+            mock.patch.object(tmdb_client, 'breaker', self.breaker),
+            mock.patch.object(tmdb_client, 'rate_limiter', self.bucket),
+            mock.patch.object(tmdb_client, '_backoff_delay', return_value=0),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def next_response(self, url):
+        self.sent.append(url)
+        return self.responses.pop(0)
+
+    def test_returns_json(self):
+        self.responses = [(200, {'id': 550})]
+        self.assertEqual(self.get('https://tmdb.test/3/movie/550', {'api_key': 'key'}), {'id': 550})
+        self.assertIn('api_key=key', self.sent[0])
+
+    def test_retries_server_errors(self):
+        self.responses = [(503, {}), (429, {}), (200, {'id': 550})]
+        self.assertEqual(self.get('https://tmdb.test/3/movie/550'), {'id': 550})
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(self.breaker.state, resilience.CLOSED)
+
+    def test_each_attempt_takes_a_token(self):
+        self.responses = [(503, {}), (503, {}), (200, {'id': 550})]
+        with mock.patch.object(self.bucket, 'try_acquire', wraps=self.bucket.try_acquire) as try_acquire:
+            self.get('https://tmdb.test/3/movie/550')
+        self.assertEqual(try_acquire.call_count, 3)
+
+        # Out of quota between retries: stop instead of going over it
+        self.responses = [(503, {})] * 2
+        with mock.patch.object(self.bucket, 'try_acquire', side_effect=[0] + [60] * 10):
+            with self.assertRaises(tmdb_client.RateLimitedError):
+                self.get('https://tmdb.test/3/movie/550')
+        self.assertEqual(len(self.sent), 4)
+
+    def test_errors_are_requests_exceptions(self):
+        self.responses = [(404, {'status_code': 34})]
+        with self.assertRaises(requests.HTTPError):
+            self.get('https://tmdb.test/3/movie/1')
+        # TMDB answered, so it isn't counted against the breaker
+        self.assertEqual(self.breaker.stats()['consecutive_failures'], 0)
+
+        self.responses = ['refused'] * (tmdb_client.MAX_RETRIES + 1)
+        with self.assertRaises(requests.ConnectionError):
+            self.get('https://tmdb.test/3/movie/1')
+        self.assertEqual(len(self.sent), 1 + tmdb_client.MAX_RETRIES + 1)
+
+    def test_breaker_sees_every_attempt(self):
+        self.breaker.failure_threshold = tmdb_client.MAX_RETRIES
+        self.responses = [(500, {})] * 10
+        with self.assertRaises(tmdb_client.CircuitOpenError):
+            self.get('https://tmdb.test/3/movie/1')
+        # Each failed attempt counts, so retrying stops once the breaker opens
+        self.assertEqual(len(self.sent), self.breaker.failure_threshold)
+
+        with self.assertRaises(tmdb_client.CircuitOpenError):
+            self.get('https://tmdb.test/3/movie/1')
+        self.assertEqual(len(self.sent), self.breaker.failure_threshold)
+
+
+class TMDBClientTests(TMDBClientTestsMixin, SimpleTestCase):
+    """tmdb_client.get() on requests, against a fake adapter."""
+
+    class Adapter(requests.adapters.BaseAdapter):
+        def __init__(self, respond):
+            super().__init__()
+            self.respond = respond
+            self.sent_with = []
+
+        def send(self, request, **kwargs):
+            self.sent_with.append(kwargs)
+            answer = self.respond(request.url)
+            if answer == 'refused':
+                raise requests.ConnectionError("refused")
+            response = requests.Response()
+            response.status_code, response._content = answer[0], json.dumps(answer[1]).encode()
+            response.request, response.url = request, request.url
+            return response
+
+        def close(self):
+            pass
+
+    def setUp(self):
+        super().setUp()
+        self.adapter = self.Adapter(self.next_response)
+        session = requests.Session()
+        session.mount('https://', self.adapter)
+        patcher = mock.patch.object(tmdb_client, 'get_session', lambda: session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, *args):
+        return tmdb_client.get(*args)
+
+    def test_no_retries_in_the_adapter(self):
+        adapter = tmdb_client._build_session().get_adapter('https://tmdb.test/')
+        self.assertEqual(adapter.max_retries.total, 0)
+
+    def test_timeouts_are_passed(self):
+        self.responses = [(503, {}), (200, {'id': 550})]
+        self.get('https://tmdb.test/3/movie/550')
+        # On the retry too
+        self.assertEqual(
+            [kwargs['timeout'] for kwargs in self.adapter.sent_with],
+            [(tmdb_client.CONNECT_TIMEOUT, tmdb_client.READ_TIMEOUT)] * 2,
+        )
+
+
+class TMDBSessionTests(SimpleTestCase):
+    """The shared requests session, its retry policy and its pool counters."""
+
+    def setUp(self):
+        # Leave the process-wide session as it was
+        for name in ('_session', '_session_pid'):
+            patcher = mock.patch.object(tmdb_client, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_session_is_shared(self):
+        self.assertIs(tmdb_client.get_session(), tmdb_client.get_session())
+
+    def test_session_is_rebuilt_after_fork(self):
+        session = tmdb_client.get_session()
+        with mock.patch.object(tmdb_client.os, 'getpid', return_value=os.getpid() + 1):
+            forked = tmdb_client.get_session()
+            self.assertIsNot(forked, session)
+            self.assertIs(tmdb_client.get_session(), forked)
+
+    def test_retry_delay(self):
+        with mock.patch.object(tmdb_client.random, 'uniform', return_value=0):
+            self.assertEqual(tmdb_client._retry_delay(0), tmdb_client.BACKOFF_FACTOR)
+            self.assertEqual(tmdb_client._retry_delay(1, 503), tmdb_client.BACKOFF_FACTOR * 2)
+        self.assertEqual(tmdb_client._retry_delay(0, 429, '2'), 2)
+        # TMDB can't make us wait longer than a read would
+        self.assertEqual(tmdb_client._retry_delay(0, 429, '3600'), tmdb_client.READ_TIMEOUT)
+        self.assertIsNone(tmdb_client._retry_delay(0, 404))
+        self.assertIsNone(tmdb_client._retry_delay(tmdb_client.MAX_RETRIES, 503))
+
+    def test_connection_stats(self):
+        self.assertEqual(tmdb_client.get_connection_stats(), {'requests': 0, 'connections': 0, 'reused': 0})
+
+        adapter = tmdb_client.get_session().get_adapter('https://tmdb.test/')
+        pools = {
+            'api': mock.Mock(num_requests=10, num_connections=2),
+            'images': mock.Mock(num_requests=3, num_connections=1),
+        }
+        with mock.patch.object(adapter.poolmanager, 'pools', pools):
+            # http:// and https:// share the adapter, so its pools count once
+            self.assertEqual(tmdb_client.get_connection_stats(), {'requests': 13, 'connections': 3, 'reused': 10})
+            # A forked worker hasn't sent anything on its own session yet
+            with mock.patch.object(tmdb_client.os, 'getpid', return_value=os.getpid() + 1):
+                self.assertEqual(tmdb_client.get_connection_stats()['reused'], 0)
+
+
+class AsyncTMDBClientTests(TMDBClientTestsMixin, SimpleTestCase):
+    """tmdb_client.aget() on httpx, against a mock transport."""
+
+    def setUp(self):
+        super().setUp()
+
+        def handler(request):
+            answer = self.next_response(str(request.url))
+            if answer == 'refused':
+                raise httpx.ConnectError("refused")
+            return httpx.Response(answer[0], json=answer[1])
+
+        patcher = mock.patch.object(tmdb_client, 'get_async_client', lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, *args):
+        return async_to_sync(tmdb_client.aget)(*args)
+
+
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        self.path = os.path.join(files.name, 'cache.sqlite3')
+        self.clock = FakeClock()
+        for patcher in (
+            mock.patch.object(cache_backends, 'time', self.clock),
+            # get_backend_timeout() turns timeouts into expiry times
+            mock.patch('django.core.cache.backends.base.time', self.clock),
+            mock.patch.dict(cache_backends._process_state, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def worker(self, **options):
+        """A TieredCache on the shared file, with the L1 of a separate worker process."""
+        options = {'L1_TIMEOUT': 30, **options}
+        backend = cache_backends.TieredCache(self.path, {'OPTIONS': options})
+        backend._l1, backend._l1_lock, backend._stats = OrderedDict(), threading.Lock(), dict.fromkeys(cache_backends.STAT_NAMES, 0)
+        return backend
+
+    def test_l2_hit_is_promoted_to_l1(self):
+        one, other = self.worker(), self.worker()
+        one.set('movie', {'title': "Movie 1"}, 600)
+        self.assertEqual(other.get('movie'), {'title': "Movie 1"})
+        self.assertEqual(other.get('movie'), {'title': "Movie 1"})
+        self.assertEqual(other.get('nothing'), None)
+        stats = other.stats()
+        self.assertEqual((stats['l2_hits'], stats['l1_hits'], stats['misses']), (1, 1, 1))
+        self.assertEqual(stats['l1_entries'], 1)
+
+    def test_l1_copies_expire_after_l1_timeout(self):
+        one, other = self.worker(), self.worker()
+        one.set('movie', 1, 600)
+        self.assertEqual(other.get('movie'), 1)
+
+        one.set('movie', 2, 600)
+        one.delete('gone')
+        # The other worker serves its L1 copy until L1_TIMEOUT, then reads L2 again
+        self.assertEqual(other.get('movie'), 1)
+        self.clock.advance(31)
+        self.assertEqual(other.get('movie'), 2)
+
+        one.delete('movie')
+        self.assertIsNone(one.get('movie'))
+        self.clock.advance(31)
+        self.assertIsNone(other.get('movie'))
+
+    def test_entries_expire(self):
+        backend = self.worker()
+        backend.set('short', 1, 10)
+        self.clock.advance(9)
+        self.assertEqual(backend.get('short'), 1)
+        self.clock.advance(2)
+        self.assertIsNone(backend.get('short'))
+
+    def test_add_and_incr_are_shared(self):
+        one, other = self.worker(), self.worker()
+        self.assertTrue(one.add('lock', True, 30))
+        self.assertFalse(other.add('lock', True, 30))
+        self.clock.advance(31)
+        self.assertTrue(other.add('lock', True, 30))
+
+        one.set('count', 1, 600)
+        self.assertEqual(other.get('count'), 1)
+        self.assertEqual(one.incr('count'), 2)
+        self.assertEqual(other.incr('count'), 3)
+        self.assertEqual(one.get('count'), 3)
+
+    def test_cull_evicts_least_recently_used(self):
+        backend = self.worker(MAX_BYTES=3500, CULL_EVERY=1, L1_TIMEOUT=0)
+        for i in range(3):
+            backend.set(f"key{i}", 'x' * 900, 600)
+            self.clock.advance(cache_backends.ACCESS_RESOLUTION + 1)
+        # Reading key0 makes key1 the least recently used
+        backend.get('key0')
+        backend.set('key3', 'x' * 900, 600)
+        self.assertEqual(set(backend.get_many(['key0', 'key1', 'key2', 'key3'])), {'key0', 'key2', 'key3'})
+        self.assertEqual(backend.stats()['evictions'], 1)
+
+
+class ResilienceTests(SimpleTestCase):
+    def setUp(self):
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        self.path = os.path.join(files.name, 'ratelimit.sqlite3')
+        self.clock = FakeClock()
+        patcher = mock.patch.object(resilience, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bucket_allows_a_burst_then_refills(self):
+        bucket = resilience.SharedTokenBucket(self.path, rate=10, capacity=5)
+        self.assertEqual([bucket.try_acquire() for _ in range(5)], [0] * 5)
+        self.assertAlmostEqual(bucket.try_acquire(), 0.1)
+
+        self.clock.advance(0.25)
+        self.assertEqual([bucket.try_acquire() for _ in range(2)], [0, 0])
+        self.assertGreater(bucket.try_acquire(), 0)
+
+        # Idle time refills up to capacity, no further
+        self.clock.advance(60)
+        self.assertEqual([bucket.try_acquire() for _ in range(5)], [0] * 5)
+        self.assertGreater(bucket.try_acquire(), 0)
+
+    def test_bucket_is_shared_by_workers(self):
+        one = resilience.SharedTokenBucket(self.path, rate=1, capacity=2)
+        other = resilience.SharedTokenBucket(self.path, rate=1, capacity=2)
+        self.assertEqual(one.try_acquire(), 0)
+        self.assertEqual(other.try_acquire(), 0)
+        self.assertGreater(one.try_acquire(), 0)
+        # Other buckets in the file have their own budget
+        self.assertEqual(resilience.SharedTokenBucket(self.path, rate=1, capacity=2, name='images').try_acquire(), 0)
+
+    def test_bucket_acquire_waits_up_to_max_wait(self):
+        bucket = resilience.SharedTokenBucket(self.path, rate=2, capacity=1)
+        self.assertTrue(bucket.acquire(max_wait=0))
+        started = self.clock.now
+        self.assertTrue(bucket.acquire(max_wait=1))
+        self.assertAlmostEqual(self.clock.now - started, 0.5)
+        self.assertFalse(bucket.acquire(max_wait=0.1))
+        self.assertEqual(bucket.stats()['rejected'], 1)
+
+    def test_breaker_opens_after_threshold(self):
+        breaker = resilience.CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        for _ in range(2):
+            breaker.record_failure()
+        breaker.record_success()
+        # Only consecutive failures count
+        for _ in range(2):
+            breaker.record_failure()
+        self.assertEqual(breaker.state, resilience.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, resilience.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.stats()['short_circuited'], 1)
+
+    def test_breaker_half_open_lets_one_trial_through(self):
+        breaker = resilience.CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        self.clock.advance(30)
+        self.assertEqual(breaker.state, resilience.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        # A failed trial opens it again for another reset_timeout
+        breaker.record_failure()
+        self.assertEqual(breaker.state, resilience.OPEN)
+        self.clock.advance(29)
+        self.assertFalse(breaker.allow())
+        self.clock.advance(1)
+        self.assertTrue(breaker.allow())
+
+        # A trial that succeeds closes it
+        breaker.record_success()
+        self.assertEqual(breaker.state, resilience.CLOSED)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.stats()['times_opened'], 2)
+
+    def test_breaker_allows_another_trial_if_one_never_reports(self):
+        breaker = resilience.CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        self.clock.advance(30)
+        self.assertTrue(breaker.allow())
+        self.clock.advance(30)
+        self.assertTrue(breaker.allow())
+
+
+class FetchCacheTests(PerfTestCase):
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock(time.time())
+        patcher = mock.patch.object(fetch_cache, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_concurrent_misses_fetch_once(self):
+        waiting = threading.Semaphore(0)
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            # Hold the fetch until every other thread is waiting on its result
+            future = fetch_cache._in_flight['movie_full_1']
+            result = future.result
+
+            def counted_result(*args):
+                waiting.release()
+                return result(*args)
+
+            future.result = counted_result
+            started.set()
+            for _ in range(4):
+                waiting.acquire()
+            return {'id': 1}
+
+        started = threading.Event()
+        results = []
+        leader = threading.Thread(target=lambda: results.append(fetch_cache.lookup('movie_full_1', fetch)))
+        leader.start()
+        started.wait()
+        waiters = [threading.Thread(target=lambda: results.append(fetch_cache.lookup('movie_full_1', fetch))) for _ in range(4)]
+        for thread in waiters:
+            thread.start()
+        for thread in [leader, *waiters]:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'id': 1}] * 5)
+
+    def test_waits_for_another_workers_fetch(self):
+        cache.add('fetching_movie_full_1', True)
+        other_worker_done = lambda seconds: fetch_cache.store('movie_full_1', {'id': 1})
+        with mock.patch.object(self.clock, 'sleep', side_effect=other_worker_done):
+            self.assertEqual(fetch_cache.lookup('movie_full_1', lambda: self.fail("Fetched twice")), {'id': 1})
+
+    def test_fetches_itself_when_another_worker_stalls(self):
+        cache.add('fetching_movie_full_1', True)
+        started = self.clock.now
+        self.assertEqual(fetch_cache.lookup('movie_full_1', lambda: {'id': 1}), {'id': 1})
+        self.assertGreaterEqual(self.clock.now - started, fetch_cache.WAIT_TIMEOUT)
+
+    def test_stale_entry_is_served_while_refreshing(self):
+        fetch_cache.store('movie_full_1', {'title': "Old"})
+        self.clock.advance(fetch_cache.SOFT_TTL + 1)
+
+        # A failed refresh keeps serving the stale entry
+        self.assertEqual(fetch_cache.lookup('movie_full_1', lambda: None), {'title': "Old"})
+        self.assertEqual(fetch_cache.unwrap(cache.get('movie_full_1')), ({'title': "Old"}, False))
+
+        # The refresh runs inline in tests; the caller still gets the stale copy
+        self.assertEqual(fetch_cache.lookup('movie_full_1', lambda: {'title': "New"}), {'title': "Old"})
+        self.assertEqual(fetch_cache.unwrap(cache.get('movie_full_1')), ({'title': "New"}, True))
+        self.assertIsNone(cache.get('refreshing_movie_full_1'))
+
+    def test_failures_are_not_cached(self):
+        self.assertIsNone(fetch_cache.lookup('movie_full_1', lambda: None))
+        self.assertIsNone(cache.get('movie_full_1'))
+        self.assertEqual(fetch_cache.lookup('movie_full_1', lambda: {'id': 1}), {'id': 1})
+
+    def test_async_waiters_get_the_leaders_error(self):
+        async def run():
+            release = asyncio.Event()
+
+            async def failing_fetch():
+                await release.wait()
+                raise requests.ConnectionError("down")
+
+            async def unused_fetch():
+                raise AssertionError("Only the leader fetches")
+
+            leader = asyncio.create_task(fetch_cache._afetch_once('movie_full_1', failing_fetch))
+            await asyncio.sleep(0.01)
+            waiters = [asyncio.create_task(fetch_cache._afetch_once('movie_full_1', unused_fetch)) for _ in range(3)]
+            await asyncio.sleep(0)
+            release.set()
+            return await asyncio.gather(leader, *waiters, return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertEqual([type(result) for result in results], [requests.ConnectionError] * 4)
+
+    def test_async_waiters_miss_when_the_leader_is_cancelled(self):
+        async def run():
+            async def slow_fetch():
+                await asyncio.sleep(10)
+
+            leader = asyncio.create_task(fetch_cache._afetch_once('movie_full_1', slow_fetch))
+            await asyncio.sleep(0.01)
+            waiter = asyncio.create_task(fetch_cache._afetch_once('movie_full_1', slow_fetch))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await asyncio.gather(leader, waiter, return_exceptions=True)
+
+        leader, waiter = asyncio.run(run())
+        self.assertIsInstance(leader, asyncio.CancelledError)
+        self.assertIsNone(waiter)
+
+
+    def test_measure_cache_footprint(self):
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        path = os.path.join(files.name, 'movies.jsonl')
+        with open(path, 'w') as f:
+            for movie_id in (550, 551):
+                f.write(json.dumps(self.tmdb.get(f"https://tmdb.test/3/movie/{movie_id}", {'append_to_response': 'credits'})) + '\n')
+
+        out = StringIO()
+        with self.budget('measure_cache_footprint_file', queries=0, tmdb_calls=0):
+            call_command('measure_cache_footprint', file=path, stdout=out)
+        report = out.getvalue()
+        self.assertRegex(report, r"(?m)^ +550 +\d+ B -> +\d+ B  Movie 550$")
+        self.assertIn("Movies measured:  2", report)
+        compact = int(re.search(r"Compact records: +([\d,]+) bytes", report).group(1).replace(',', ''))
+        legacy = int(re.search(r"TMDB documents: +([\d,]+) bytes", report).group(1).replace(',', ''))
+        self.assertLess(compact, legacy)
+
+        # Or fetched from TMDB, skipping what it doesn't have
+        self.tmdb.missing.add(552)
+        out, err = StringIO(), StringIO()
+        call_command('measure_cache_footprint', '550', '552', stdout=out, stderr=err)
+        self.assertIn("Movies measured:  1", out.getvalue())
+        self.assertIn("Skipping 552", err.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('measure_cache_footprint', stdout=StringIO())
+
+class MetricsTests(PerfTestCase):
+    def test_server_timing(self):
+        response = self.client.get(reverse('movie_recommendation', args=[550]))
+        self.assertIn('cache-movie_full;desc="0 hit, 0 stale, 1 miss"', response['Server-Timing'])
+        self.assertIn('sql;dur=', response['Server-Timing'])
+
+        response = self.client.get(reverse('movie_recommendation', args=[550]))
+        self.assertIn('cache-movie_full;desc="1 hit, 0 stale, 0 miss"', response['Server-Timing'])
+
+    def test_metrics_page(self):
+        self.client.get(reverse('movie_recommendation', args=[550]))
+        response = self.client.get(reverse('metrics'))
+        self.assertContains(response, 'pickamovie_requests_total{view="movie_recommendation",status="200"} 1')
+        self.assertContains(response, 'pickamovie_cache_requests_total{family="movie_full_",result="miss"} 1')
+
+    def test_metrics_page_exports_client_and_cache_stats(self):
+        breaker = resilience.CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        tier_stats = {'l1_hits': 7, 'l2_hits': 3, 'misses': 2, 'evictions': 1, 'l1_entries': 5}
+        with mock.patch.object(tmdb_client, 'breaker', breaker), \
+                mock.patch.object(tmdb_client.rate_limiter, 'rejected', 2), \
+                mock.patch.object(cache, 'stats', create=True, return_value=tier_stats):
+            response = self.client.get(reverse('metrics'))
+            # Counters are added as deltas, so a second flush doesn't double them
+            metrics.store.flush()
+            again = self.client.get(reverse('metrics'))
+        self.assertContains(response, 'pickamovie_tmdb_breaker_opened_total{client="api"} 1')
+        self.assertContains(response, f'pickamovie_tmdb_breaker_state{{client="api",state="open",pid="{os.getpid()}"}} 1')
+        self.assertContains(response, 'pickamovie_tmdb_rate_limited_total{client="api"} 2')
+        self.assertContains(response, 'pickamovie_cache_tier_requests_total{tier="l1"} 7')
+        self.assertContains(response, 'pickamovie_cache_evictions_total 1')
+        self.assertContains(again, 'pickamovie_cache_tier_requests_total{tier="l1"} 7')
+
+    def test_async_requests_flush_off_the_event_loop(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        flushed_on = []
+        middleware = PerformanceMiddleware(get_response)
+        with mock.patch.object(metrics.store, 'flush_due', return_value=True), \
+                mock.patch.object(metrics.store, 'flush', side_effect=lambda: flushed_on.append(threading.get_ident())):
+            asyncio.run(middleware(RequestFactory().get('/')))
+        self.assertEqual(len(flushed_on), 1)
+        self.assertNotEqual(flushed_on[0], threading.get_ident())
+
+    def test_metrics_page_is_not_public(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, 404)
+
+
+class ImportTests(PerfTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.login()
+
+    def upload(self, content, status='watch_later'):
+        return self.client.post(reverse('import_list'), {
+            'file': SimpleUploadedFile('watchlist.csv', content.encode(), content_type='text/csv'),
+            'status': status,
+        })
+
+    def test_import_form(self):
+        with self.budget('import_list_form', queries=2, tmdb_calls=0):
+            response = self.client.get(reverse('import_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f"Up to {list_import.MAX_ROWS} rows are imported per upload")
+
+    def test_import_letterboxd_export(self):
+        CatalogMovie.objects.create(id=603, title="The Matrix", release_date=datetime.date(1999, 3, 30), poster_path='/matrix.jpg')
+        CatalogMovie.objects.create(id=604, title="The Matrix", release_date=datetime.date(2003, 5, 15))
+        content = (
+            "Date,Name,Year,Letterboxd URI\n"
+            "2024-01-01,The Matrix,1999,https://boxd.it/1\n"
+            "2024-01-02,Movie 77,2001,https://boxd.it/2\n"
+            '2024-01-03,"Nothing, Here",2010,https://boxd.it/3\n'
+        )
+        # Only the titles that aren't in the catalog are searched for
+        with self.budget('import_list_small', queries=12, tmdb_calls=2):
+            response = self.upload(content)
+        self.assertRedirects(response, reverse('profile_page'), fetch_redirect_response=False)
+
+        entries = {entry.movie_id: entry for entry in UserMovieList.objects.filter(user=self.user)}
+        self.assertEqual(set(entries), {603, 77})
+        self.assertEqual(entries[603].poster_path, '/matrix.jpg')
+        self.assertEqual(entries[77].title, "Movie 77")
+        self.assertIsNotNone(entries[77].details_refreshed_on)
+        self.assertIn("Imported 2 of 3 movies", str(list(response.wsgi_request._messages)))
+
+        # Searches are cached
+        with self.budget('import_list_repeat', queries=12, tmdb_calls=0):
+            self.upload(content)
+
+    def test_import_updates_existing_entries(self):
+        UserMovieList.objects.create(user=self.user, movie_id=550, status='watch_later', title="Movie 550")
+        self.upload("tmdb_id\n550\n551\n", status='watched')
+
+        entries = {entry.movie_id: entry for entry in UserMovieList.objects.filter(user=self.user)}
+        self.assertEqual(entries[550].status, 'watched')
+        # Rows imported by ID keep the details they had; new ones get them later
+        self.assertEqual(entries[550].title, "Movie 550")
+        self.assertIsNone(entries[551].details_refreshed_on)
+
+    def test_import_writes_in_batches(self):
+        # SQLite takes at most 999 parameters, so Django splits each chunk's
+        # bulk_create into INSERTs of 142 rows; other databases use one
+        rows = "\n".join(str(movie_id) for movie_id in range(1, 1001))
+        with self.budget('import_list_1000_rows', queries=22, tmdb_calls=0):
+            response = self.upload(f"tmdb_id\n{rows}\n")
+        self.assertEqual(UserMovieList.objects.filter(user=self.user).count(), 1000)
+        self.assertNotIn("were skipped", str(list(response.wsgi_request._messages)))
+
+    def test_import_stops_at_row_limit(self):
+        rows = "\n".join(str(movie_id) for movie_id in range(1, list_import.MAX_ROWS + 51))
+        response = self.upload(f"tmdb_id\n{rows}\n")
+        self.assertEqual(UserMovieList.objects.filter(user=self.user).count(), list_import.MAX_ROWS)
+        self.assertIn(f"Only the first {list_import.MAX_ROWS} rows were imported", str(list(response.wsgi_request._messages)))
+        self.assertIn("the rows after them were skipped", str(list(response.wsgi_request._messages)))
+
+    def test_import_stops_after_time_limit(self):
+        lines = ["tmdb_id\n"] + [f"{movie_id}\n" for movie_id in range(1, 6)]
+        result = list_import.import_rows(self.user, lines, 'watch_later', chunk_size=2, time_limit=0)
+        # The chunk that ran out the clock is still saved
+        self.assertEqual((result.rows, result.imported, result.complete), (2, 2, False))
+
+        result = list_import.import_rows(self.user, lines, 'watch_later', chunk_size=2, time_limit=None)
+        self.assertEqual((result.rows, result.complete), (5, True))
+
+    def test_import_reports_tmdb_failures_separately(self):
+        def get(url, params=None):
+            if (params or {}).get('query') == "Movie 78":
+                raise tmdb_client.CircuitOpenError("TMDB circuit is open")
+            return self.tmdb.get(url, params)
+
+        content = "Name,Year\nMovie 77,2001\nNothing Here,2010\nMovie 78,2001\n"
+        with mock.patch.object(tmdb_client, 'get', get):
+            response = self.upload(content)
+        messages = [str(message) for message in response.wsgi_request._messages]
+        self.assertIn("No match found for: Nothing Here (2010)", messages)
+        self.assertIn("Couldn't reach TMDB to look up: Movie 78 (2001). Import the file again later to add them.", messages)
+        self.assertEqual(set(UserMovieList.objects.values_list('movie_id', flat=True)), {77})
+
+        # The failure wasn't cached, so importing again picks it up
+        self.upload(content)
+        self.assertEqual(set(UserMovieList.objects.values_list('movie_id', flat=True)), {77, 78})
+
+    def test_import_drops_the_seen_set_after_commit(self):
+        seen_movies.for_user(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload("tmdb_id\n550\n")
+            self.assertNotIn(550, seen_movies.for_user(self.user))
+        self.assertIn(550, seen_movies.for_user(self.user))
+
+    def test_import_rejects_other_files(self):
+        response = self.upload("a,b\n1,2\n")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Couldn&#x27;t import this file")
+        self.assertFalse(UserMovieList.objects.exists())
+
+
+# The sync path, as served by WSGI; AsyncViewTests covers ASGI
+@override_settings(ASYNC_VIEWS=False)
+class ExportTests(PerfTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.login()
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_list'), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_csv(self):
+        self.save_movies(self.user, 3)
+        UserMovieList.objects.create(user=self.user, movie_id=550, status='watched')
+        # Display fields come from the cache for rows that don't have them yet
+        tmdb_api.get_movie_with_credits(550)
+
+        lines = self.export().splitlines()
+        self.assertEqual(lines[0], 'tmdb_id,title,status,added_on,poster_path')
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[-1].startswith('550,Movie 550,watched,'))
+
+    def test_export_jsonl_one_list(self):
+        self.save_movies(self.user, 3)
+        UserMovieList.objects.filter(movie_id__in=[1000, 1001]).update(status='watched')
+        lines = self.export(format='jsonl', status='watched').splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])['status'], 'watched')
+
+    def test_export_queries_dont_grow_with_list_size(self):
+        self.save_movies(self.user, 1200)
+        with self.budget('export_list_1200', queries=5, tmdb_calls=0):
+            self.assertEqual(len(self.export().splitlines()), 1201)
+
+    def test_export_round_trips_through_import(self):
+        self.save_movies(self.user, 5)
+        content = self.export()
+        other = self.login('other')
+        self.client.post(reverse('import_list'), {
+            'file': SimpleUploadedFile('lists.csv', content.encode(), content_type='text/csv'), 'status': 'watched',
+        })
+        self.assertEqual(UserMovieList.objects.filter(user=other).count(), 5)
+
+    def test_export_unknown_format(self):
+        self.assertEqual(self.client.get(reverse('export_list'), {'format': 'xml'}).status_code, 404)
+
+
+class PosterTests(PerfTestCase):
+    NAME = 'kqjL17yufvn9OVLyXYpvtyrFfak.jpg'
+
+    def poster_url(self, size='w185', image_format='webp'):
+        return reverse('poster', args=[size, image_format, self.NAME])
+
+    def test_poster_is_resized_once(self):
+        with self.budget('poster_cold', queries=0, tmdb_calls=1):
+            response = self.client.get(self.poster_url())
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (185, 278))
+
+        # Other variants are made from the copy on disk
+        with self.budget('poster_other_variant', queries=0, tmdb_calls=0):
+            response = self.client.get(self.poster_url('w342', 'jpg'))
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    def test_poster_not_modified(self):
+        etag = self.client.get(self.poster_url())['ETag']
+        response = self.client.get(self.poster_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_poster_unknown_size(self):
+        self.assertEqual(self.client.get(self.poster_url('original')).status_code, 404)
+        self.assertEqual(self.client.get(reverse('poster', args=['w185', 'webp', '..secret'])).status_code, 404)
+
+    def test_poster_name_must_look_like_tmdb(self):
+        for name in ('abc123.jpg', 'kqjL17yufvn9OVLyXYpvtyrFfak.gif', 'kqjL17yufvn9OVLyXYpvtyrF-_k.jpg'):
+            with self.budget('poster_bad_name', queries=0, tmdb_calls=0):
+                self.assertEqual(self.client.get(reverse('poster', args=['w185', 'webp', name])).status_code, 404)
+
+    def test_poster_cache_evicts_oldest(self):
+        self.client.get(self.poster_url())
+        self.client.get(self.poster_url('w342', 'jpg'))
+        files = sorted(posters._cache_files())
+        total = sum(size for _, size, _ in files)
+        oldest = files[0][2]
+        self.assertGreater(posters.evict(max_bytes=total - 1), 0)
+        self.assertFalse(os.path.exists(oldest))
+        self.assertLess(sum(size for _, size, _ in posters._cache_files()), total)
+        # Whatever was deleted is fetched or made again
+        self.assertEqual(self.client.get(self.poster_url()).status_code, 200)
+
+    def test_poster_eviction_runs_in_the_background(self):
+        with mock.patch.object(posters, '_evicted_at', 0.0), \
+                mock.patch.object(fetch_cache, 'run_in_background') as run, \
+                mock.patch.object(posters, 'evict') as evict:
+            self.client.get(self.poster_url())
+            self.client.get(self.poster_url('w342', 'jpg'))
+        evict.assert_not_called()
+        # Once per EVICT_INTERVAL
+        run.assert_called_once_with(evict)
+
+    def test_poster_evicted_while_served(self):
+        self.client.get(self.poster_url())
+        variant_file, _, _ = posters.get_variant('w185', 'webp', self.NAME)
+        with variant_file:
+            posters.evict(max_bytes=0)
+            self.assertEqual(list(posters._cache_files()), [])
+            with Image.open(variant_file) as image:
+                self.assertEqual(image.size, (185, 278))
+        # And the next request makes it again
+        self.assertEqual(self.client.get(self.poster_url()).status_code, 200)
+
+    def test_poster_fetch_uses_image_breaker(self):
+        with mock.patch.object(tmdb_client, 'get_image', REAL_GET_IMAGE), \
+                mock.patch.object(tmdb_client.image_breaker, 'allow', return_value=False), \
+                mock.patch.object(tmdb_client, 'get_session') as get_session:
+            response = self.client.get(self.poster_url())
+        get_session.assert_not_called()
+        self.assertEqual(response.status_code, 302)
+
+    def test_poster_origin_unavailable(self):
+        with mock.patch.object(tmdb_client, 'get_image', side_effect=requests.ConnectionError("down")):
+            response = self.client.get(self.poster_url())
+        self.assertRedirects(response, f"{posters.IMAGE_BASE_URL}/w185/{self.NAME}", fetch_redirect_response=False)
+
+    def test_profile_grid_uses_srcset(self):
+        user = self.login()
+        self.save_movies(user, 1)
+        response = self.client.get(reverse('profile_page'))
+        self.assertContains(response, f'{reverse("poster", args=["w185", "webp", "poster1000.jpg"])} 185w')
+        self.assertNotContains(response, 'image.tmdb.org')
+
+
+class CatalogIndexTests(PerfTestCase):
+    def build(self, columns):
+        benchmark_discover.Command().load_catalog(columns)
+        # Edge cases the synthetic catalog doesn't have
+        CatalogMovie.objects.create(id=900_001, title="No date", vote_average=8, vote_count=500, original_language='en')
+        CatalogMovie.objects.create(id=900_002, title="No language", release_date=datetime.date(2000, 1, 1), vote_average=8, vote_count=500)
+        index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(index_dir.cleanup)
+        path, size = catalog_index.build_snapshot(index_dir.name)
+        self.assertEqual(size, len(columns['id']) + 2)
+        return catalog_index.CatalogIndex.load(path)
+
+    def test_mask_matches_filter_movies(self):
+        index = self.build(benchmark_discover.synthetic_catalog(2000, seed=7))
+        self.assertIsInstance(index.columns['id'], catalog_index.np.memmap)
+
+        rng = random.Random(7)
+        cases = [
+            {}, {'genre': '18'}, {'genre': '99'}, {'year_from': 1990}, {'year_to': 1990},
+            {'year_from': 1980, 'year_to': 1989}, {'rating': '7'}, {'rating': 9}, {'language': 'fr'},
+            {'genre': '35', 'year_from': 2000, 'rating': '6', 'language': 'en'},
+        ] + [benchmark_discover.random_filters(rng) for _ in range(40)]
+        for filters in cases:
+            with self.subTest(filters=filters):
+                expected = set(catalog.filter_movies(filters).values_list('id', flat=True))
+                self.assertEqual(set(index.columns['id'][index.mask(filters)].tolist()), expected)
+                self.assertLessEqual(set(index.sample(filters, catalog.PAGE_SIZE)), expected)
+
+    def test_benchmark_runs(self):
+        out = StringIO()
+        call_command('benchmark_discover', movies=1000, queries=5, stdout=out)
+        self.assertIn("numpy    n=5", out.getvalue())
+
+
+class SimilarMoviesTests(PerfTestCase):
+    def setUp(self):
+        super().setUp()
+        index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(index_dir.cleanup)
+        for name, value in (('INDEX_DIR', index_dir.name), ('_table', None), ('_table_path', None), ('_checked_at', 0)):
+            patcher = mock.patch.object(similar_movies, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # movie_id: (genre, year, language, director)
+        movies = {
+            701: (18, 1994, 'en', 1), 702: (18, 1994, 'en', 1), 703: (18, 1996, 'en', None),
+            704: (35, 2015, 'fr', 3), 705: (35, 2016, 'fr', 3), 706: (27, 1980, 'en', 4),
+        }
+        for movie_id, (genre_id, year, language, director_id) in movies.items():
+            movie = CatalogMovie.objects.create(
+                id=movie_id, title=f"Movie {movie_id}", release_date=datetime.date(year, 1, 1),
+                original_language=language, vote_average=7, vote_count=500, popularity=10,
+                poster_path=f"/poster{movie_id}.jpg",
+            )
+            movie.genres.create(genre_id=genre_id)
+            if director_id:
+                credits = {'cast': [], 'crew': [{'id': director_id, 'name': "Someone", 'job': 'Director'}]}
+                entry = (records.movie_record(self.tmdb.movie(movie_id)), records.credits_record(credits))
+                cache.set(f"movie_full_{movie_id}", fetch_cache.wrap(entry))
+
+    def build(self):
+        call_command('build_similar_movies', stdout=StringIO())
+        similar_movies._checked_at = 0
+
+    def test_neighbors_share_genre_and_director(self):
+        self.build()
+        table = similar_movies.get_table()
+        self.assertEqual(table.lookup(701, 2), [702, 703])
+        self.assertEqual(table.lookup(704, 1), [705])
+        self.assertEqual(table.lookup(999), [])
+        self.assertEqual(table.neighbors.dtype, 'int32')
+
+    def test_more_like_this_on_the_movie_page(self):
+        url = reverse('movie_recommendation', args=[701])
+        self.assertNotContains(self.client.get(url), "More like this")
+
+        self.build()
+        # Titles and posters come from the catalog in one query
+        with self.budget('movie_recommendation_similar', queries=1, tmdb_calls=0):
+            response = self.client.get(url)
+        self.assertContains(response, "More like this")
+        self.assertContains(response, reverse('movie_recommendation', args=[702]))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LoadTestSmokeTests(LiveServerTestCase):
+    """load_test against this app, served here, with fake_tmdb standing in for TMDB."""
+
+    def setUp(self):
+        cache.clear()
+        movies = fake_tmdb.synthetic_movies(500, seed=1)
+        server = fake_tmdb.FakeTMDBServer(('127.0.0.1', 0), movies, latency=0, jitter=0, error_rate=0, throttle_rate=0, seed=1)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.fake = server
+
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        for patcher in (
+            mock.patch.object(tmdb_api, 'BASE_URL', f"http://127.0.0.1:{server.server_port}/3"),
+            mock.patch.object(tmdb_client, 'breaker', resilience.CircuitBreaker(failure_threshold=5, reset_timeout=30)),
+            mock.patch.object(tmdb_client, 'rate_limiter', resilience.SharedTokenBucket(
+                os.path.join(files.name, 'ratelimit.sqlite3'), rate=1000, capacity=1000)),
+            mock.patch.object(fetch_cache, 'run_in_background', run_inline),
+            mock.patch.object(metrics, 'store', metrics.MetricsStore(os.path.join(files.name, 'metrics.sqlite3'))),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_load_test_runs_against_fake_tmdb(self):
+        out = StringIO()
+        call_command('load_test', url=self.live_server_url, users=2, sessions=1, next_clicks=2, seed=1, stdout=out)
+        report = out.getvalue()
+        for step in ('signup', 'filter', 'next', 'movie_page', 'add_to_list', 'profile'):
+            self.assertRegex(report, rf"\n{step} +\d+ +0 ")
+        self.assertIn("0.0% errors", report)
+        self.assertGreater(self.fake.counts['requests'], 0)
@@ -1,17 +1,44 @@
+import asyncio
+import contextvars
+import hashlib
+import itertools
 import requests
 import random
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from django.conf import settings
 from django.core.cache import cache
+from . import catalog, fetch_cache, metrics, records, tmdb_client
 
-BASE_URL = "https://api.themoviedb.org/3"
+BASE_URL = getattr(settings, 'TMDB_BASE_URL', "https://api.themoviedb.org/3")
 API_KEY = settings.TMDB_API_KEY
+
+# Upper bound on parallel TMDB requests made by one batch lookup
+MAX_WORKERS = getattr(settings, 'TMDB_MAX_WORKERS', 8)
+
+# Same, for the async client. Coroutines are cheap, so this can be higher.
+ASYNC_CONCURRENCY = getattr(settings, 'TMDB_ASYNC_CONCURRENCY', 20)
+
+# How many queued recommendations to fetch ahead of the user. They are
+# fetched on fetch_cache's background pool (TMDB_WARM_WORKERS threads).
+WARM_AHEAD = getattr(settings, 'TMDB_WARM_AHEAD', 3)
+WARM_LOCK_TIMEOUT = 30
+
+# Discover pages change slowly; popular filter combinations stay warm for hours
+DISCOVER_CACHE_TIMEOUT = getattr(settings, 'TMDB_DISCOVER_CACHE_TIMEOUT', 60 * 60 * 6)
+
+# Recommendations are drawn from the top pages of popularity-sorted results
+MAX_DISCOVER_PAGES = getattr(settings, 'TMDB_DISCOVER_DEPTH', 10)
+
+# Each queue batch pools this many of those pages, fetched in parallel
+DISCOVER_PAGES_PER_BATCH = getattr(settings, 'TMDB_DISCOVER_PAGES_PER_BATCH', 3)
+
+# MovieFilterForm fields that affect discover results
+FILTER_FIELDS = ('genre', 'year_from', 'year_to', 'rating', 'language')
     
-def discover_and_prefetch_movies(filters):
-    """
-    Fetches a shuffled list of movies from a single, random page
-    within the top 10 pages of TMDB results.
-    """
-    endpoint = f"{BASE_URL}/discover/movie"
+def _discover_params(filters):
+    """Builds the /discover/movie query params for the user's filters."""
     params = {
         'api_key': API_KEY,
         'sort_by': 'popularity.desc',
@@ -30,89 +57,447 @@ def discover_and_prefetch_movies(filters):
         params['vote_average.gte'] = filters['rating']
     if filters.get('language'):
         params['with_original_language'] = filters['language']
+    return params
 
-    try:
-        # First call to get the total number of pages
-        response = requests.get(endpoint, params=params)
-        response.raise_for_status()
-        data = response.json()
-        total_pages = data.get('total_pages', 1)
+def _filters_hash(filters):
+    """
+    Short, stable hash of the normalized filters. Empty form values and
+    missing keys hash the same, so equivalent searches share cache entries.
+    """
+    normalized = tuple(str(filters.get(name) or '') for name in FILTER_FIELDS)
+    # The record version is mixed in so a layout change starts from fresh keys
+    normalized += (str(fetch_cache.RECORD_VERSION),)
+    return hashlib.md5('|'.join(normalized).encode()).hexdigest()[:16]
+
+def _discover_cache_entries(filters_hash, page, data):
+    """
+    Cache entries for one page of discover results and the total page count.
+    Only the movie IDs are kept; everything shown later comes from the
+    per-movie entries.
+    """
+    return {
+        f"discover_{filters_hash}_p{page}": tuple(movie['id'] for movie in data.get('results', [])),
+        f"discover_{filters_hash}_pages": data.get('total_pages', 1),
+    }
+
+def _record_discover(movie_ids):
+    # All discover_ keys count as one family, whatever the filters hash
+    if movie_ids is None:
+        metrics.record_cache('discover_', misses=1)
+    else:
+        metrics.record_cache('discover_', hits=1)
+
+def _fetch_discover_page(filters, page):
+    params = _discover_params(filters)
+    params['page'] = page
+    return tmdb_client.get(f"{BASE_URL}/discover/movie", params=params)
+
+def _store_discover_pages(filters_hash, found, fetched):
+    """
+    Adds the fetched pages to found ({page: movie_ids}) and caches them, with
+    the total page count. fetched maps pages to a response or the exception
+    the fetch raised; errors are only raised when no page came back at all.
+    """
+    entries = {}
+    errors = []
+    for page, data in fetched.items():
+        if isinstance(data, requests.RequestException):
+            errors.append(data)
+            continue
+        page_entries = _discover_cache_entries(filters_hash, page, data)
+        found[page] = page_entries[f"discover_{filters_hash}_p{page}"]
+        entries.update(page_entries)
+    if errors and not found:
+        raise errors[0]
+    return entries
+
+def get_discover_pages(filters, pages):
+    """
+    Returns {page: movie IDs} for several pages of discover results for the
+    filters. Cached pages are read with one get_many and the rest fetched
+    from TMDB in parallel, so N pages take about as long as one. Pages that
+    fail are left out; raises requests.RequestException only if none could
+    be had.
+    """
+    filters_hash = _filters_hash(filters)
+    keys = {page: f"discover_{filters_hash}_p{page}" for page in pages}
+    cached = cache.get_many(list(keys.values()))
+    found = {page: cached[key] for page, key in keys.items() if key in cached}
+    missing = [page for page in pages if page not in found]
+    metrics.record_cache('discover_', hits=len(found), misses=len(missing))
+    if not missing:
+        return found
+
+    def fetch(page):
+        try:
+            return _fetch_discover_page(filters, page)
+        except requests.RequestException as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(missing))) as executor:
+        # Copies of our context, so the calls count towards this request
+        futures = {page: executor.submit(contextvars.copy_context().run, fetch, page) for page in missing}
+        fetched = {page: future.result() for page, future in futures.items()}
+    entries = _store_discover_pages(filters_hash, found, fetched)
+    if entries:
+        cache.set_many(entries, DISCOVER_CACHE_TIMEOUT)
+    return found
 
-        # Limit the random page selection to the first 10 pages
-        random_page = random.randint(1, min(total_pages, 10))
-        params['page'] = random_page
+def _batch_rng(seed, batch):
+    return random.Random(f"{seed}:{batch}")
 
-        # Second call to get the movies from our chosen random page
-        response = requests.get(endpoint, params=params)
-        response.raise_for_status()
-        data = response.json()
-        results = data.get('results', [])
+def _batch_page(seed, position, total_pages):
+    """
+    The discover page at a position in a queue's page order. The top
+    MAX_DISCOVER_PAGES pages are visited in a seeded random order, so a
+    queue goes through all of them before repeating one. If total_pages
+    isn't known yet it is guessed.
+
+    The order for fewer pages is the guessed order with the pages past the
+    end left out. A queue whose guess was too high therefore keeps the real
+    pages it already picked, and later batches, which know total_pages,
+    don't come back to them within the cycle.
+    """
+    page_count = min(total_pages or MAX_DISCOVER_PAGES, MAX_DISCOVER_PAGES)
+    cycle, position = divmod(position, page_count)
+    # Shuffle all MAX_DISCOVER_PAGES and drop the ones past the end, so the
+    # order agrees with a guess made before total_pages was known
+    pages = list(range(1, MAX_DISCOVER_PAGES + 1))
+    random.Random(f"{seed}:pages:{cycle}").shuffle(pages)
+    return [page for page in pages if page <= page_count][position]
+
+def _batch_pages(seed, batch, page_count):
+    """The DISCOVER_PAGES_PER_BATCH pages a queue batch is drawn from."""
+    per_batch = min(DISCOVER_PAGES_PER_BATCH, page_count)
+    # A batch that straddles two cycles can draw a page twice
+    return list(dict.fromkeys(_batch_page(seed, batch * per_batch + i, page_count) for i in range(per_batch)))
+
+def _merge_pages(seed, batch, pages, found):
+    """
+    Shuffles each page and interleaves them, so movies from different
+    popularity ranks alternate, dropping any movie a second page repeats.
+    """
+    rng = _batch_rng(seed, batch)
+    shuffled = []
+    for page in pages:
+        movie_ids = list(found.get(page, ()))
+        rng.shuffle(movie_ids)
+        shuffled.append(movie_ids)
+    interleaved = (movie_id for row in itertools.zip_longest(*shuffled) for movie_id in row if movie_id is not None)
+    return list(dict.fromkeys(interleaved))
+
+def _catalog_batch(filters, seed, batch):
+    # The sample is random, so it's cached to be able to derive the batch again
+    key = f"discover_{_filters_hash(filters)}_s{seed}_b{batch}"
+    movie_ids = cache.get(key)
+    _record_discover(movie_ids)
+    if movie_ids is None:
+        results = catalog.discover(filters, MAX_DISCOVER_PAGES, _batch_rng(seed, batch))
+        movie_ids = tuple(movie['id'] for movie in results)
+        cache.set(key, movie_ids, DISCOVER_CACHE_TIMEOUT)
+    return list(movie_ids)
+
+def _pool_key(filters_hash, seed, batch, page_count):
+    return f"discover_{filters_hash}_s{seed}_b{batch}_n{page_count}"
+
+def discover_batch(filters, seed, batch, page_count=None):
+    """
+    Returns (page_count, movie_ids) for one batch of a recommendation queue
+    (see recommendation_queue). A batch is a pool of DISCOVER_PAGES_PER_BATCH
+    discover pages, fetched in parallel, deduped and interleaved in an order
+    fixed by seed and batch. The pool is cached, so re-deriving the batch
+    later is one cache read.
+
+    The pages are picked from the top page_count pages (0 for the local
+    catalog). Pass it back in to re-derive the batch; with page_count=None
+    the cached total page count is used. When that isn't known yet it is
+    guessed; a guess past the last page costs a second round of calls,
+    which only fetches pages the first didn't. movie_ids is empty if TMDB
+    can't be reached.
+    """
+    if catalog.is_available():
+        return 0, _catalog_batch(filters, seed, batch)
 
-        if not results:
-            return []
+    filters_hash = _filters_hash(filters)
+    if page_count:
+        movie_ids = cache.get(_pool_key(filters_hash, seed, batch, page_count))
+        _record_discover(movie_ids)
+        if movie_ids is not None:
+            return page_count, list(movie_ids)
 
-        # Shuffle the list of movies and return it
-        random.shuffle(results)
-        return results
+    known_pages = None
+    if not page_count:
+        known_pages = cache.get(f"discover_{filters_hash}_pages")
+        page_count = min(known_pages or MAX_DISCOVER_PAGES, MAX_DISCOVER_PAGES)
+    try:
+        pages = _batch_pages(seed, batch, page_count)
+        found = get_discover_pages(filters, pages)
 
+        if known_pages is None:
+            # The responses told us how many pages there are. If the guess was
+            # too high, pick again from the real ones so later batches agree.
+            total_pages = min(cache.get(f"discover_{filters_hash}_pages") or page_count, MAX_DISCOVER_PAGES)
+            if total_pages < page_count:
+                page_count = total_pages
+                pages = _batch_pages(seed, batch, page_count)
+                found = get_discover_pages(filters, pages)
     except requests.RequestException as e:
         print(f"API request failed: {e}")
-        return []
-    
-def get_movie_details(movie_id):
-    """Fetches detailed info for a movie, using cache if available."""
-    cache_key = f"movie_details_{movie_id}"
-    cached_data = cache.get(cache_key)
+        return page_count, []
 
-    if cached_data:
-        return cached_data # Return cached data if it exists
+    movie_ids = _merge_pages(seed, batch, pages, found)
+    if len(found) == len(pages):
+        cache.set(_pool_key(filters_hash, seed, batch, page_count), tuple(movie_ids), DISCOVER_CACHE_TIMEOUT)
+    return page_count, movie_ids
     
-    """Fetches the detailed information for a specific movie from TMDB."""
+def _fetch_movie_details(movie_id):
+    """Fetches a movie from TMDB as a compact record (see records.py)."""
     endpoint = f"{BASE_URL}/movie/{movie_id}"
     params = {'api_key': API_KEY}
 
     try:
-        response = requests.get(endpoint, params=params)
-        response.raise_for_status() # Raise an error for bad responses
-        data = response.json()
-        cache.set(cache_key, data, 60 * 60 * 24)
-        return data
-    
+        return records.movie_record(tmdb_client.get(endpoint, params=params))
     except requests.RequestException as e:
         print(f"API request failed for movie ID {movie_id}: {e}")
         return None
-    
-# In movies/tmdb_api.py
 
-def get_movie_credits(movie_id):
+def _movies_from_results(results, keys, movie_ids):
+    movies = []
+    for movie_id in movie_ids:
+        record = results.get(keys[movie_id])
+        movies.append(records.movie_from_record(record) if record else None)
+    return movies
+
+def get_movie_details_many(movie_ids):
     """
-    Fetches the cast (top 3) and the director for a specific movie, using cache.
-    Returns a dictionary: {'cast': [...], 'director': ...}
+    Fetches details for several movies at once. Cached entries are read with
+    a single get_many, and only the misses are fetched from TMDB in parallel.
+    Returns a list in the same order as movie_ids, with None for any movie
+    that could not be fetched.
+
+    This is for lists, which only show titles and posters. A movie's own
+    page uses get_movie_with_credits, which caches details and credits as
+    one movie_full_ entry.
     """
-    cache_key = f"movie_credits_and_director_{movie_id}"
-    cached_data = cache.get(cache_key)
-    if cached_data is not None:
-        return cached_data
+    keys = {movie_id: f"movie_details_{movie_id}" for movie_id in movie_ids}
+    results = fetch_cache.lookup_many(
+        {key: movie_id for movie_id, key in keys.items()}, _fetch_movie_details, MAX_WORKERS
+    )
+    return _movies_from_results(results, keys, movie_ids)
+
+def _fetch_movie_with_credits(movie_id):
+    endpoint = f"{BASE_URL}/movie/{movie_id}"
+    params = {'api_key': API_KEY, 'append_to_response': 'credits'}
+    try:
+        movie = tmdb_client.get(endpoint, params=params)
+    except requests.RequestException as e:
+        print(f"API request failed for movie ID {movie_id}: {e}")
+        return None
+    return (records.movie_record(movie), records.credits_record(movie.get('credits', {})))
+
+def _movie_with_credits_from_entry(entry):
+    if entry is None:
+        return None, records.credits_from_record(None)
+    movie, credits = entry
+    return records.movie_from_record(movie), records.credits_from_record(credits)
 
-    endpoint = f"{BASE_URL}/movie/{movie_id}/credits"
+def get_movie_with_credits(movie_id):
+    """
+    Fetches a movie's details and credits in a single TMDB request
+    (append_to_response=credits), cached as one entry.
+    Returns (movie, credits), where credits is {'cast': [...], 'director': ...}.
+    movie is None if the movie could not be fetched.
+    """
+    entry = fetch_cache.lookup(f"movie_full_{movie_id}", partial(_fetch_movie_with_credits, movie_id))
+    return _movie_with_credits_from_entry(entry)
+
+def _search_key(title, year):
+    # Titles can be long and contain anything; hash them into a safe key
+    query = f"{title.strip().casefold()}|{year or ''}"
+    return f"movie_search_{hashlib.sha1(query.encode()).hexdigest()[:16]}"
+
+def _best_match(results, title, year):
+    """Prefers an exact title match from the right year, then TMDB's own ranking."""
+    def score(movie):
+        same_title = (movie.get('title') or '').casefold() == title.strip().casefold()
+        same_year = bool(year) and (movie.get('release_date') or '')[:4] == str(year)
+        return (same_title and same_year, same_title)
+    return max(results, key=score) if results else None
+
+def _fetch_search(query):
+    """
+    Searches TMDB for a (title, year) and returns (id, title, poster_path),
+    () if nothing matched, or None if TMDB couldn't be reached. () is
+    cached so the same unknown title isn't searched again.
+    """
+    title, year = query
+    params = {'api_key': API_KEY, 'query': title}
+    if year:
+        params['primary_release_year'] = year
+
+    try:
+        data = tmdb_client.get(f"{BASE_URL}/search/movie", params=params)
+    except requests.RequestException as e:
+        print(f"API search failed for {title!r}: {e}")
+        return None
+    movie = _best_match(data.get('results', []), title, year)
+    if movie is None:
+        return ()
+    return (movie['id'], movie.get('title') or '', movie.get('poster_path') or '')
+
+def search_movies(queries):
+    """
+    Looks up TMDB IDs for (title, year) pairs, using cache. Misses are
+    searched in parallel. Returns {(title, year): (id, title, poster_path)},
+    with () for a title TMDB has no match for and None for one that
+    couldn't be searched because TMDB failed.
+    """
+    keys = {query: _search_key(*query) for query in queries}
+    results = fetch_cache.lookup_many({key: query for query, key in keys.items()}, _fetch_search, MAX_WORKERS)
+    return {query: results.get(key) for query, key in keys.items()}
+
+def movie_version(movie_id):
+    """
+    A version stamp for the cached movie_full_ entry (when it was fetched),
+    or None if it isn't cached or is stale. Never calls TMDB.
+    """
+    return fetch_cache.stamp(f"movie_full_{movie_id}")
+
+def _warm_movie(movie_id):
+    try:
+        get_movie_with_credits(movie_id)
+    finally:
+        cache.delete(f"warming_{movie_id}")
+
+def warm_movies(movie_ids):
+    """
+    Fetches details and credits for upcoming recommendations into the cache
+    in the background, so the "next movie" click doesn't wait on TMDB.
+    A movie that is already cached or being warmed elsewhere is skipped;
+    the warming_ marker is claimed with cache.add, so with a shared cache
+    only one worker fetches it.
+    """
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return
+
+    cached = cache.get_many([f"movie_full_{movie_id}" for movie_id in movie_ids])
+    for movie_id in movie_ids:
+        if f"movie_full_{movie_id}" in cached:
+            continue
+        if cache.add(f"warming_{movie_id}", True, WARM_LOCK_TIMEOUT):
+            fetch_cache.run_in_background(_warm_movie, movie_id)
+
+# Async versions of the lookups above, for the ASGI views in async_views.py.
+# They share cache keys and payload shapes with the sync functions.
+
+async def _afetch_discover_page(filters, page):
+    params = _discover_params(filters)
+    params['page'] = page
+    try:
+        return await tmdb_client.aget(f"{BASE_URL}/discover/movie", params=params)
+    except requests.RequestException as e:
+        return e
+
+async def aget_discover_pages(filters, pages):
+    """Async version of get_discover_pages(); the missing pages are fetched concurrently."""
+    filters_hash = _filters_hash(filters)
+    keys = {page: f"discover_{filters_hash}_p{page}" for page in pages}
+    cached = await cache.aget_many(list(keys.values()))
+    found = {page: cached[key] for page, key in keys.items() if key in cached}
+    missing = [page for page in pages if page not in found]
+    metrics.record_cache('discover_', hits=len(found), misses=len(missing))
+    if not missing:
+        return found
+
+    fetched = dict(zip(missing, await asyncio.gather(*(_afetch_discover_page(filters, page) for page in missing))))
+    entries = _store_discover_pages(filters_hash, found, fetched)
+    if entries:
+        await cache.aset_many(entries, DISCOVER_CACHE_TIMEOUT)
+    return found
+
+async def _acatalog_batch(filters, seed, batch):
+    key = f"discover_{_filters_hash(filters)}_s{seed}_b{batch}"
+    movie_ids = await cache.aget(key)
+    _record_discover(movie_ids)
+    if movie_ids is None:
+        results = await sync_to_async(catalog.discover)(filters, MAX_DISCOVER_PAGES, _batch_rng(seed, batch))
+        movie_ids = tuple(movie['id'] for movie in results)
+        await cache.aset(key, movie_ids, DISCOVER_CACHE_TIMEOUT)
+    return list(movie_ids)
+
+async def adiscover_batch(filters, seed, batch, page_count=None):
+    """Async version of discover_batch()."""
+    if await sync_to_async(catalog.is_available)():
+        return 0, await _acatalog_batch(filters, seed, batch)
+
+    filters_hash = _filters_hash(filters)
+    if page_count:
+        movie_ids = await cache.aget(_pool_key(filters_hash, seed, batch, page_count))
+        _record_discover(movie_ids)
+        if movie_ids is not None:
+            return page_count, list(movie_ids)
+
+    known_pages = None
+    if not page_count:
+        known_pages = await cache.aget(f"discover_{filters_hash}_pages")
+        page_count = min(known_pages or MAX_DISCOVER_PAGES, MAX_DISCOVER_PAGES)
+    try:
+        pages = _batch_pages(seed, batch, page_count)
+        found = await aget_discover_pages(filters, pages)
+
+        if known_pages is None:
+            total_pages = min(await cache.aget(f"discover_{filters_hash}_pages") or page_count, MAX_DISCOVER_PAGES)
+            if total_pages < page_count:
+                page_count = total_pages
+                pages = _batch_pages(seed, batch, page_count)
+                found = await aget_discover_pages(filters, pages)
+    except requests.RequestException as e:
+        print(f"API request failed: {e}")
+        return page_count, []
+
+    movie_ids = _merge_pages(seed, batch, pages, found)
+    if len(found) == len(pages):
+        await cache.aset(_pool_key(filters_hash, seed, batch, page_count), tuple(movie_ids), DISCOVER_CACHE_TIMEOUT)
+    return page_count, movie_ids
+
+async def _afetch_movie_details(movie_id):
+    endpoint = f"{BASE_URL}/movie/{movie_id}"
     params = {'api_key': API_KEY}
+
     try:
-        response = requests.get(endpoint, params=params)
-        response.raise_for_status()
-        data = response.json()
-
-        cast = data.get('cast', [])[:3]
-        director = None
-        # Find the director in the crew list
-        for member in data.get('crew', []):
-            if member.get('job') == 'Director':
-                director = member
-                break # Stop after finding the first director
-
-        credits = {'cast': cast, 'director': director}
-        cache.set(cache_key, credits, 60 * 60 * 24) 
-        return credits
+        return records.movie_record(await tmdb_client.aget(endpoint, params=params))
+    except requests.RequestException as e:
+        print(f"API request failed for movie ID {movie_id}: {e}")
+        return None
+
+async def aget_movie_details_many(movie_ids):
+    """Async version of get_movie_details_many(); misses are fetched concurrently."""
+    keys = {movie_id: f"movie_details_{movie_id}" for movie_id in movie_ids}
+    results = await fetch_cache.alookup_many(
+        {key: movie_id for movie_id, key in keys.items()},
+        _afetch_movie_details, _fetch_movie_details, ASYNC_CONCURRENCY,
+    )
+    return _movies_from_results(results, keys, movie_ids)
 
+async def _afetch_movie_with_credits(movie_id):
+    endpoint = f"{BASE_URL}/movie/{movie_id}"
+    params = {'api_key': API_KEY, 'append_to_response': 'credits'}
+    try:
+        movie = await tmdb_client.aget(endpoint, params=params)
     except requests.RequestException as e:
-        print(f"API request for credits failed for movie ID {movie_id}: {e}")
-        return {'cast': [], 'director': None} 
\ No newline at end of file
+        print(f"API request failed for movie ID {movie_id}: {e}")
+        return None
+    return (records.movie_record(movie), records.credits_record(movie.get('credits', {})))
+
+async def amovie_version(movie_id):
+    return await fetch_cache.astamp(f"movie_full_{movie_id}")
+
+async def aget_movie_with_credits(movie_id):
+    """Async version of get_movie_with_credits()."""
+    entry = await fetch_cache.alookup(
+        f"movie_full_{movie_id}",
+        partial(_afetch_movie_with_credits, movie_id),
+        partial(_fetch_movie_with_credits, movie_id),
+    )
+    return _movie_with_credits_from_entry(entry)
@@ -0,0 +1,294 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .resilience import OPEN, CircuitBreaker, SharedTokenBucket
+
+# Connect/read timeouts in seconds. A slow TMDB response should fail the
+# request, not hang the worker that is waiting on it.
+CONNECT_TIMEOUT = getattr(settings, 'TMDB_CONNECT_TIMEOUT', 3.05)
+READ_TIMEOUT = getattr(settings, 'TMDB_READ_TIMEOUT', 10)
+
+# Keep-alive pool size. Should be at least the number of threads that can
+# talk to TMDB at the same time in one process.
+POOL_SIZE = getattr(settings, 'TMDB_POOL_SIZE', 16)
+
+# Retries for connection errors, 429s and 5xx responses. The delay between
+# attempts is backoff_factor * 2**n plus up to backoff_jitter seconds of noise,
+# so workers that failed together don't retry together. Both clients retry
+# in their own loop rather than in urllib3, so that every attempt takes a
+# rate-limit token and is seen by the circuit breaker.
+MAX_RETRIES = getattr(settings, 'TMDB_MAX_RETRIES', 3)
+BACKOFF_FACTOR = getattr(settings, 'TMDB_BACKOFF_FACTOR', 0.3)
+BACKOFF_JITTER = getattr(settings, 'TMDB_BACKOFF_JITTER', 0.3)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Requests per second allowed to TMDB from all workers on this host, the burst
+# size, and how long a request may wait for a token before giving up
+RATE_LIMIT = getattr(settings, 'TMDB_RATE_LIMIT', 40)
+RATE_BURST = getattr(settings, 'TMDB_RATE_BURST', 40)
+RATE_LIMIT_WAIT = getattr(settings, 'TMDB_RATE_LIMIT_WAIT', 2)
+RATE_LIMIT_DB = getattr(settings, 'TMDB_RATE_LIMIT_DB', os.path.join(settings.BASE_DIR, 'tmdb_ratelimit.sqlite3'))
+
+# Consecutive failures before requests fail fast, and how long to wait
+# before letting a trial request through
+BREAKER_THRESHOLD = getattr(settings, 'TMDB_BREAKER_THRESHOLD', 5)
+BREAKER_RESET_TIMEOUT = getattr(settings, 'TMDB_BREAKER_RESET_TIMEOUT', 30)
+
+# The image CDN isn't part of the API quota, so poster fetches get their own
+# bucket (in the same file) and their own breaker
+IMAGE_RATE_LIMIT = getattr(settings, 'TMDB_IMAGE_RATE_LIMIT', 20)
+IMAGE_RATE_BURST = getattr(settings, 'TMDB_IMAGE_RATE_BURST', 20)
+
+rate_limiter = SharedTokenBucket(RATE_LIMIT_DB, RATE_LIMIT, RATE_BURST)
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET_TIMEOUT)
+image_rate_limiter = SharedTokenBucket(RATE_LIMIT_DB, IMAGE_RATE_LIMIT, IMAGE_RATE_BURST, name='tmdb_images')
+image_breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+
+class CircuitOpenError(requests.RequestException):
+    """TMDB has been failing; the request was not sent."""
+
+
+class RateLimitedError(requests.RequestException):
+    """No TMDB quota was free within TMDB_RATE_LIMIT_WAIT seconds."""
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+# One AsyncClient per event loop; httpx clients can't be shared across loops
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _build_session():
+    # No retries in the adapter; _guarded_get does them (see MAX_RETRIES)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=0)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """
+    Returns the process-wide TMDB session, creating it on first use.
+    A new session is built after a fork so workers never share sockets.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def is_available():
+    """False while the circuit breaker is open and TMDB calls fail fast."""
+    return breaker.state != OPEN
+
+
+def _is_failure(status_code):
+    # 404s and other client errors mean TMDB is up and answering
+    return status_code == 429 or status_code >= 500
+
+
+def get(url, params=None):
+    """
+    GETs a TMDB url on the shared session and returns the decoded JSON.
+    Raises CircuitOpenError or RateLimitedError (both RequestExceptions)
+    without sending anything when TMDB is failing or the quota is used up.
+    """
+    # Counted and timed for the current request, including any wait for quota
+    with metrics.tmdb_call():
+        return _get(url, params)
+
+
+def _get(url, params):
+    return _guarded_get(url, params, breaker, rate_limiter).json()
+
+
+def _record(breaker, status_code):
+    if _is_failure(status_code):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def _backoff_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number `attempt` (0-based)."""
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), READ_TIMEOUT)
+        except ValueError:
+            pass
+    return BACKOFF_FACTOR * (2 ** attempt) + random.uniform(0, BACKOFF_JITTER)
+
+
+def _retry_delay(attempt, status_code=None, retry_after=None):
+    """
+    Seconds to wait before trying again after attempt number `attempt`
+    (0-based) got status_code, or no response at all for None. Returns None
+    when there's nothing to retry or that was the last attempt. This is the
+    retry policy of both the sync and the async client.
+    """
+    if attempt >= MAX_RETRIES or (status_code is not None and status_code not in RETRY_STATUSES):
+        return None
+    return _backoff_delay(attempt, retry_after)
+
+
+def _guarded_get(url, params, breaker, rate_limiter):
+    for attempt in range(MAX_RETRIES + 1):
+        # Every attempt is a request against the quota and the breaker
+        if not breaker.allow():
+            raise CircuitOpenError("TMDB circuit is open")
+        if not rate_limiter.acquire(RATE_LIMIT_WAIT):
+            raise RateLimitedError("TMDB rate limit reached")
+
+        try:
+            response = get_session().get(url, params=params, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        except requests.RequestException as e:
+            breaker.record_failure()
+            delay = _retry_delay(attempt) if isinstance(e, (requests.ConnectionError, requests.Timeout)) else None
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+
+        _record(breaker, response.status_code)
+        delay = _retry_delay(attempt, response.status_code, response.headers.get('Retry-After'))
+        if delay is None:
+            response.raise_for_status()
+            return response
+        time.sleep(delay)
+
+
+def get_image(url):
+    """
+    GETs an image from TMDB's image CDN on the shared session and returns
+    the bytes. Goes through image_rate_limiter and image_breaker, so a
+    flood of poster misses can't hammer the CDN or wait on it while it's down.
+    """
+    with metrics.tmdb_call():
+        return _guarded_get(url, None, image_breaker, image_rate_limiter).content
+
+
+def get_connection_stats():
+    """
+    Returns request and connection counters for this process. 'reused' is the
+    number of requests that went out on an already-open keep-alive connection.
+    """
+    stats = {'requests': 0, 'connections': 0}
+    if _session is None or _session_pid != os.getpid():
+        stats['reused'] = 0
+        return stats
+
+    seen = set()
+    for adapter in _session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
+    stats['reused'] = max(stats['requests'] - stats['connections'], 0)
+    return stats
+
+
+async def _aacquire_token():
+    """Async version of rate_limiter.acquire(); waits without blocking the loop."""
+    deadline = time.monotonic() + RATE_LIMIT_WAIT
+    while True:
+        wait = await sync_to_async(rate_limiter.try_acquire, thread_sensitive=False)()
+        if wait == 0:
+            return True
+        if time.monotonic() + wait > deadline:
+            rate_limiter.rejected += 1
+            return False
+        rate_limiter.waited += wait
+        await asyncio.sleep(wait)
+
+
+def get_async_client():
+    """Returns the pooled httpx.AsyncClient for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def aget(url, params=None):
+    """
+    Async version of get(), with the same timeouts, retry policy, rate
+    limit and circuit breaker.
+    Failures are raised as requests.RequestException so callers handle
+    both paths the same way.
+    """
+    with metrics.tmdb_call():
+        return await _aget(url, params)
+
+
+async def _aget(url, params):
+    client = get_async_client()
+    for attempt in range(MAX_RETRIES + 1):
+        # Every attempt is a request against the quota and the breaker, as
+        # in _guarded_get
+        if not breaker.allow():
+            raise CircuitOpenError("TMDB circuit is open")
+        if not await _aacquire_token():
+            raise RateLimitedError("TMDB rate limit reached")
+
+        try:
+            response = await client.get(url, params=params)
+        except httpx.TransportError as e:
+            breaker.record_failure()
+            delay = _retry_delay(attempt)
+            if delay is None:
+                raise requests.ConnectionError(str(e)) from e
+            await asyncio.sleep(delay)
+            continue
+
+        _record(breaker, response.status_code)
+        delay = _retry_delay(attempt, response.status_code, response.headers.get('Retry-After'))
+        if delay is None:
+            try:
+                response.raise_for_status()
+                return response.json()
+            except httpx.HTTPStatusError as e:
+                raise requests.HTTPError(str(e)) from e
+            except ValueError as e:
+                raise requests.RequestException(f"Invalid JSON from TMDB: {e}") from e
+        await asyncio.sleep(delay)
+
+
+def get_client_stats():
+    """
+    Connection reuse, and the rate limiter and circuit breaker state of the
+    API ('api') and the image CDN ('images') clients, for this process.
+    """
+    return {
+        'connections': get_connection_stats(),
+        'api': {'rate_limiter': rate_limiter.stats(), 'breaker': breaker.stats()},
+        'images': {'rate_limiter': image_rate_limiter.stats(), 'breaker': image_breaker.stats()},
+    }
@@ -1,25 +1,41 @@
+from django.conf import settings
 from django.urls import path
 from . import views 
+from . import async_views
+
+# Views that wait on TMDB have async versions for the ASGI deployment
+tmdb_views = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
     path('', views.landing_page, name='landing_page'),
 
-    path('find/', views.filter_page, name='filter_page'),
+    path('find/', tmdb_views.filter_page, name='filter_page'),
 
     path('signup/', views.signup_page, name='signup'),
 
-    path('movie/<int:movie_id>/', views.movie_recommendation_page, name='movie_recommendation'),
+    path('movie/<int:movie_id>/', tmdb_views.movie_recommendation_page, name='movie_recommendation'),
 
     path('list/add/', views.add_to_list, name='add_to_list'),
 
-    path('profile/', views.profile_page, name='profile_page'), 
+    path('profile/', tmdb_views.profile_page, name='profile_page'), 
+
+    path('profile/list/<str:status>/', views.profile_list_page, name='profile_list_page'),
+
+    path('profile/export/', views.export_list, name='export_list'),
 
-    path('next/', views.next_movie, name='next_movie'),
+    path('next/', tmdb_views.next_movie, name='next_movie'),
 
-    path('my-movie/<int:movie_id>/', views.my_movie_details, name='my_movie_details'),
+    path('my-movie/<int:movie_id>/', tmdb_views.my_movie_details, name='my_movie_details'),
+
+    path('list/import/', views.import_list, name='import_list'),
 
     path('list/delete/', views.delete_from_list, name='delete_from_list'), 
     
     path('list/move-to-watched/', views.move_to_watched, name='move_to_watched'), 
 
     path('profile/delete/', views.delete_profile, name='delete_profile'),
+
+    path('poster/<str:size>/<str:image_format>/<str:name>', views.poster, name='poster'),
+
+    path('metrics/', views.metrics_page, name='metrics'),
 ]
\ No newline at end of file
@@ -1,17 +1,24 @@
+import io
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
-from django.http import Http404
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import logout
 from django.contrib import messages
+from django.utils import timezone
+from django.utils.http import parse_etags
 from .models import UserMovieList
-from .forms import MovieFilterForm, CustomUserCreationForm, LANGUAGE_CHOICES
-from . import tmdb_api
+from .forms import MovieFilterForm, CustomUserCreationForm, ListImportForm, LANGUAGE_CHOICES
+from . import list_details, list_export, list_import, metrics, page_cache, posters, profile_lists, recommendation_queue, seen_movies, similar_movies, tmdb_api, tmdb_client
 
 LANGUAGE_MAP = {code: name for code, name in LANGUAGE_CHOICES if code}
 
+TMDB_UNAVAILABLE_MESSAGE = "Movie data is temporarily unavailable. Please try again in a minute."
+
 def landing_page(request):
     return render(request, 'movies/landing_page.html')
 
@@ -29,27 +36,25 @@ def signup_page(request):
 
 def filter_page(request):
     """
-    Handles the initial movie search, prefetching, and storing results in the session.
+    Handles the initial movie search and starts the user's recommendation
+    queue in the session (see recommendation_queue).
     """
     if request.method == 'GET' and 'genre' in request.GET:
         form = MovieFilterForm(request.GET)
         if form.is_valid():
             filters = form.cleaned_data
-            # Call API function to get a list of movies
-            prefetched_movies = tmdb_api.discover_and_prefetch_movies(filters)
-
-            if prefetched_movies:
-                # Get just the IDs from the movie list
-                movie_ids = [movie['id'] for movie in prefetched_movies]
-
-                # Pop the first movie ID to redirect to
-                first_movie_id = movie_ids.pop(0)
+            # Movies already in the user's lists are skipped
+            seen = seen_movies.for_user(request.user)
+            first_movie_id = recommendation_queue.start(request.session, filters, seen)
 
-                # Store the REMAINING list of IDs in the session
-                request.session['prefetched_movie_ids'] = movie_ids
+            if first_movie_id:
+                # Start fetching the next few while the first one loads
+                tmdb_api.warm_movies(recommendation_queue.upcoming(request.session, tmdb_api.WARM_AHEAD, seen))
 
                 # Redirect to the first movie's recommendation page
                 return redirect('movie_recommendation', movie_id=first_movie_id)
+            elif not tmdb_client.is_available():
+                messages.error(request, TMDB_UNAVAILABLE_MESSAGE)
             else:
                 # No movies found, fall through to render the form again
                 pass
@@ -60,19 +65,12 @@ def filter_page(request):
 
 def next_movie(request):
     """
-    Gets the next movie ID from the session and redirects.
-    If the list is empty, redirects to the filter page.
+    Moves the session's queue on and redirects to the next movie.
+    If there's no queue or it can't be refilled, redirects to the filter page.
     """
-    # Get the list of IDs from the session, default to an empty list
-    movie_ids = request.session.get('prefetched_movie_ids', [])
-
-    if movie_ids:
-        # Pop the next ID from the list
-        next_movie_id = movie_ids.pop(0)
-
-        # Save the now-shorter list back to the session
-        request.session['prefetched_movie_ids'] = movie_ids
+    next_movie_id = recommendation_queue.advance(request.session, seen_movies.for_user(request.user))
 
+    if next_movie_id:
         # Redirect to the next movie's page
         return redirect('movie_recommendation', movie_id=next_movie_id)
     else:
@@ -80,12 +78,29 @@ def next_movie(request):
         return redirect('filter_page')
 
 def movie_recommendation_page(request, movie_id):
-    movie = tmdb_api.get_movie_details(movie_id)
+    # Repeat views and back-navigation get a 304 straight from the cached
+    # movie's version stamp, without rendering or warming (see page_cache)
+    cacheable = not page_cache.has_pending_messages(request)
+    stamp = tmdb_api.movie_version(movie_id) if cacheable else None
+    validators = page_cache.Validators(request, request.user, movie_id, stamp) if stamp else None
+    if validators:
+        response = page_cache.check(request, validators)
+        if response:
+            return page_cache.finish(response, validators)
+
+    # Warm the cache for the next movies in the queue while this one renders
+    seen = seen_movies.for_user(request.user)
+    tmdb_api.warm_movies(recommendation_queue.upcoming(request.session, tmdb_api.WARM_AHEAD, seen))
+
+    # Details and credits come back from TMDB in one request
+    movie, credits = tmdb_api.get_movie_with_credits(movie_id)
     if not movie:
+        if not tmdb_client.is_available():
+            # TMDB is down, not the movie; don't show a 404
+            messages.error(request, TMDB_UNAVAILABLE_MESSAGE)
+            return redirect('filter_page')
         raise Http404("Movie not found.")
 
-    # Get the new credits dictionary
-    credits = tmdb_api.get_movie_credits(movie_id)
     cast = credits.get('cast')
     director = credits.get('director')
 
@@ -99,8 +114,18 @@ def movie_recommendation_page(request, movie_id):
         'cast': cast,
         'director': director, 
         'full_language_name': full_language_name, 
+        # Precomputed; never calls TMDB
+        'similar': similar_movies.for_movie(movie_id),
     }
-    return render(request, 'movies/movie_recommendation.html', context)
+    response = render(request, 'movies/movie_recommendation.html', context)
+
+    if cacheable and not validators:
+        # The movie was only just fetched; rendering may also have set a CSRF token
+        stamp = tmdb_api.movie_version(movie_id)
+        validators = page_cache.Validators(request, request.user, movie_id, stamp) if stamp else None
+    if validators:
+        page_cache.store(validators, response)
+    return page_cache.finish(response, validators)
 
 @login_required
 def add_to_list(request):
@@ -109,15 +134,24 @@ def add_to_list(request):
     Expects a POST request with 'movie_id' and 'status'.
     """
     if request.method == 'POST':
-        movie_id = request.POST.get('movie_id')
+        movie_id = request.POST.get('movie_id', '')
         status = request.POST.get('status')
         user = request.user
-
-        UserMovieList.objects.update_or_create(
-            user=user,
-            movie_id=movie_id,
-            defaults={'status': status}
-        )
+        if not movie_id.isdigit() or status not in profile_lists.STATUSES:
+            return HttpResponseBadRequest("Unknown movie or list.")
+        movie_id = int(movie_id)
+
+        # Keep the title and poster on the row so the profile page doesn't
+        # need TMDB. They're copied from the cache only; if the movie isn't
+        # there, list_details.prepare() fills them in later.
+        defaults = {'status': status}
+        cached = list_details.from_cache([movie_id])
+        if movie_id in cached:
+            title, poster_path = cached[movie_id]
+            defaults.update(title=title, poster_path=poster_path, details_refreshed_on=timezone.now())
+
+        UserMovieList.objects.update_or_create(user=user, movie_id=movie_id, defaults=defaults)
+        seen_movies.changed(user)
 
         messages.success(request, "Movie list updated successfully!")
         return redirect(request.META.get('HTTP_REFERER', 'filter_page'))
@@ -139,35 +173,40 @@ def profile_page(request):
         random_avatar = random.randint(1, 6)
         user_profile = UserProfile.objects.create(user=user, avatar_choice=random_avatar)
     
-    watch_later_list = UserMovieList.objects.filter(user=user, status='watch_later')
-    watched_list = UserMovieList.objects.filter(user=user, status='watched')
-
-    watch_later_details = [tmdb_api.get_movie_details(item.movie_id) for item in watch_later_list]
-    watched_details = [tmdb_api.get_movie_details(item.movie_id) for item in watched_list]
+    # First page of each list; the rest load as the user scrolls (profile_list_page).
+    # Titles and posters are stored on the rows, so this needs no TMDB calls.
+    watch_later_details, watch_later_next = profile_lists.page(user, 'watch_later')
+    watched_details, watched_next = profile_lists.page(user, 'watched')
+    counts = profile_lists.counts(user)
 
     context = {
         'user_profile': user_profile,
         'watch_later_movies': watch_later_details,
         'watched_movies': watched_details, 
-        'watch_later_count': watch_later_list.count(),
-        'watched_count': watched_list.count(),
+        'watch_later_next': watch_later_next,
+        'watched_next': watched_next,
+        'watch_later_count': counts['watch_later'],
+        'watched_count': counts['watched'],
     }
     return render(request, 'movies/profile_page.html', context)
 
 @login_required
 def my_movie_details(request, movie_id):
-    movie = tmdb_api.get_movie_details(movie_id)
+    movie, credits = tmdb_api.get_movie_with_credits(movie_id)
+    if not movie and not tmdb_client.is_available():
+        messages.error(request, TMDB_UNAVAILABLE_MESSAGE)
+        return redirect('profile_page')
+
+    list_entry = get_object_or_404(UserMovieList, user=request.user, movie_id=movie_id)
     if not movie:
-        raise Http404("Movie not found in TMDB.")
+        # TMDB doesn't have it any more; show what the row has so it can still be removed
+        movie, credits = list_details.as_movie(list_entry), {}
 
-    credits = tmdb_api.get_movie_credits(movie_id)
     cast = credits.get('cast')
     director = credits.get('director')
 
     full_language_name = LANGUAGE_MAP.get(movie.get('original_language'), movie.get('original_language'))
 
-    list_entry = get_object_or_404(UserMovieList, user=request.user, movie_id=movie_id)
-
     context = {
         'movie': movie,
         'cast': cast,
@@ -184,10 +223,77 @@ def delete_from_list(request):
         # Ensure the user can only delete their own entries
         list_entry = get_object_or_404(UserMovieList, id=entry_id, user=request.user)
         list_entry.delete()
+        seen_movies.changed(request.user)
 
     messages.success(request, "Movie list updated successfully!")
     return redirect('profile_page') 
 
+@login_required
+def profile_list_page(request, status):
+    """
+    JSON for the next page of one of the user's lists, for infinite scroll.
+    Expects ?after=<cursor> from the previous page.
+    """
+    if status not in profile_lists.STATUSES:
+        raise Http404("Unknown list.")
+
+    movies, next_cursor = profile_lists.page(request.user, status, request.GET.get('after'))
+    for movie in movies:
+        movie['url'] = reverse('my_movie_details', args=[movie['id']])
+        if movie['poster_path']:
+            movie['poster'] = posters.image_attrs(movie['poster_path'])
+    return JsonResponse({'movies': movies, 'next': next_cursor})
+
+@login_required
+def export_list(request):
+    """
+    Streams the user's lists as a download. ?format=csv (default) or jsonl,
+    and optionally ?status=watch_later or watched for just one list.
+    """
+    export_format = request.GET.get('format', 'csv')
+    status = request.GET.get('status') or None
+    if export_format not in list_export.FORMATS or (status and status not in profile_lists.STATUSES):
+        raise Http404("Unknown export.")
+
+    # Under ASGI a sync iterator would be read into a list before sending
+    chunks = list_export.achunks if settings.ASYNC_VIEWS else list_export.chunks
+    response = StreamingHttpResponse(
+        chunks(export_format, request.user, status),
+        content_type=list_export.FORMATS[export_format],
+    )
+    filename = f"pickamovie-{status or 'lists'}.{export_format}".replace('_', '-')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@login_required
+def import_list(request):
+    """Imports a CSV watchlist (e.g. a Letterboxd export) into one of the user's lists."""
+    form = ListImportForm(request.POST or None, request.FILES or None)
+    if request.method == 'POST' and form.is_valid():
+        # Read the upload as text a line at a time instead of all at once
+        lines = io.TextIOWrapper(form.cleaned_data['file'], encoding='utf-8-sig', newline='')
+        try:
+            result = list_import.import_rows(request.user, lines, form.cleaned_data['status'])
+        except (list_import.ListImportError, UnicodeDecodeError) as e:
+            form.add_error('file', f"Couldn't import this file: {e}")
+        else:
+            messages.success(request, f"{result}.")
+            if not result.complete:
+                messages.warning(request, f"Only the first {result.rows} rows were imported to keep this page quick; "
+                                          "the rows after them were skipped. Upload those as a separate file.")
+            if result.unmatched:
+                messages.warning(request, f"No match found for: {_titles(result.unmatched, result.unmatched_count)}")
+            if result.failed:
+                messages.warning(request, f"Couldn't reach TMDB to look up: {_titles(result.failed, result.failed_count)}. "
+                                          "Import the file again later to add them.")
+            return redirect('profile_page')
+    return render(request, 'movies/import_list.html', {'form': form})
+
+def _titles(titles, count):
+    """Lists some titles, e.g. "A, B and 3 more" when count is 5."""
+    more = count - len(titles)
+    return ", ".join(titles) + (f" and {more} more" if more else "")
+
 @login_required
 def move_to_watched(request):
     if request.method == 'POST':
@@ -204,6 +310,7 @@ def move_to_watched(request):
             movie_id=movie_id,
             status='watch_later'
         ).exclude(id=list_entry.id).delete()
+        # The movie is still listed, so the seen set doesn't change
 
         messages.success(request, "Movie marked as watched!")
     return redirect('profile_page')
@@ -216,6 +323,7 @@ def delete_profile(request):
         # Log the user out before deleting them
         logout(request)
         # Delete the user object from the database
+        seen_movies.forget(user)
         user.delete()
         # Add a success message to be displayed on the next page
         messages.success(request, 'Your account has been successfully deleted.')
@@ -224,3 +332,30 @@ def delete_profile(request):
     
     # If the request is a GET, just show the confirmation page
     return render(request, 'movies/delete_profile.html')
+
+def poster(request, size, image_format, name):
+    """A resized TMDB poster from the disk cache (see posters.py)."""
+    if not posters.is_valid(size, image_format, name):
+        raise Http404("Unknown poster.")
+
+    variant = posters.get_variant(size, image_format, name)
+    if variant is None:
+        # Let the browser try TMDB itself
+        return redirect(f"{posters.IMAGE_BASE_URL}/{size}/{name}")
+    variant_file, content_type, etag = variant
+
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        variant_file.close()
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(variant_file, content_type=content_type)
+    # The URL names one exact image, so browsers and CDNs can keep it forever
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response['ETag'] = etag
+    return response
+
+def metrics_page(request):
+    # Prometheus scrape target; only reachable from the hosts it's meant for
+    if not settings.DEBUG and request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1']):
+        raise Http404
+    return HttpResponse(metrics.store.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
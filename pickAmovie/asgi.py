@@ -13,4 +13,7 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pickAmovie.settings')
 
+# Use the async views in movies/async_views.py when served over ASGI
+os.environ.setdefault('DJANGO_ASYNC_VIEWS', 'True')
+
 application = get_asgi_application()
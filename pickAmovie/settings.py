@@ -37,6 +37,12 @@ RENDER_EXTERNAL_HOSTNAME = os.getenv('RENDER_EXTERNAL_HOSTNAME')
 if RENDER_EXTERNAL_HOSTNAME:
     ALLOWED_HOSTS.append(RENDER_EXTERNAL_HOSTNAME)
 
+# Comma-separated extra hosts. DEBUG is off, so a local instance (e.g. one
+# under load_test) needs 127.0.0.1 here to answer at all.
+EXTRA_ALLOWED_HOSTS = os.getenv('DJANGO_ALLOWED_HOSTS')
+if EXTRA_ALLOWED_HOSTS:
+    ALLOWED_HOSTS.extend(host.strip() for host in EXTRA_ALLOWED_HOSTS.split(',') if host.strip())
+
 PYTHONANYWHERE_HOSTNAME = os.getenv('PYTHONANYWHERE_HOSTNAME')
 if PYTHONANYWHERE_HOSTNAME:
     ALLOWED_HOSTS.append(PYTHONANYWHERE_HOSTNAME)
@@ -54,8 +60,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'movies.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # WhiteNoise, able to run async (see movies/middleware.py)
+    'movies.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -68,7 +76,7 @@ ROOT_URLCONF = 'pickAmovie.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'movies.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -91,6 +99,17 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Several gunicorn workers write to the same file. A deferred
+            # transaction that reads and then writes can't wait for the
+            # lock, so it fails at once with "database is locked"; an
+            # IMMEDIATE one takes the write lock up front and waits up to
+            # timeout seconds for it. WAL lets reads go on during a write,
+            # and synchronous=NORMAL is safe with WAL.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
     }
 }
 
@@ -153,10 +172,90 @@ LOGOUT_REDIRECT_URL = '/'
 # Custom settings
 TMDB_API_KEY = os.getenv('TMDB_API_KEY')
 
+# Point this at `manage.py fake_tmdb` to load-test without hitting TMDB
+TMDB_BASE_URL = os.getenv('TMDB_BASE_URL', 'https://api.themoviedb.org/3')
+TMDB_IMAGE_BASE_URL = os.getenv('TMDB_IMAGE_BASE_URL', 'https://image.tmdb.org/t/p')
+
+# TMDB HTTP client (see movies/tmdb_client.py)
+TMDB_CONNECT_TIMEOUT = 3.05
+TMDB_READ_TIMEOUT = 10
+TMDB_POOL_SIZE = 16
+TMDB_MAX_RETRIES = 3
+
+# TMDB quota shared by all workers on the host (requests/second and burst), and
+# the circuit breaker that fails fast while TMDB is down
+TMDB_RATE_LIMIT = 40
+TMDB_RATE_BURST = 40
+TMDB_RATE_LIMIT_WAIT = 2
+TMDB_RATE_LIMIT_DB = BASE_DIR / 'tmdb_ratelimit.sqlite3'
+TMDB_BREAKER_THRESHOLD = 5
+TMDB_BREAKER_RESET_TIMEOUT = 30
+# Poster fetches from the image CDN have their own quota and breaker
+TMDB_IMAGE_RATE_LIMIT = 20
+TMDB_IMAGE_RATE_BURST = 20
+
+# TMDB lookups (see movies/tmdb_api.py)
+TMDB_MAX_WORKERS = 8
+TMDB_ASYNC_CONCURRENCY = 20
+TMDB_DISCOVER_CACHE_TIMEOUT = 60 * 60 * 6
+# Recommendations come from the top TMDB_DISCOVER_DEPTH discover pages; each
+# queue batch pools TMDB_DISCOVER_PAGES_PER_BATCH of them, fetched in parallel
+TMDB_DISCOVER_DEPTH = 10
+TMDB_DISCOVER_PAGES_PER_BATCH = 3
+TMDB_WARM_AHEAD = 3
+TMDB_WARM_WORKERS = 4
+
+# Cached movie data is served fresh for the soft TTL, then served stale while
+# it is refreshed in the background, until the hard TTL (see movies/fetch_cache.py)
+TMDB_CACHE_SOFT_TTL = 60 * 60 * 24
+TMDB_CACHE_HARD_TTL = 60 * 60 * 24 * 7
+
+# Serve discovery from the local catalog (movies.CatalogMovie) once it has been
+# ingested with `manage.py ingest_catalog`
+TMDB_CATALOG_ENABLED = True
+
+# Memory-mapped NumPy snapshot of the catalog, built with `manage.py build_catalog_index`
+CATALOG_INDEX_DIR = BASE_DIR / 'catalog_index'
+
+# "More like this" neighbors, built with `manage.py build_similar_movies`
+SIMILAR_INDEX_DIR = BASE_DIR / 'similar_index'
+SIMILAR_NEIGHBORS = 20
+SIMILAR_COUNT = 6
+
+# Serve the TMDB-backed views asynchronously. asgi.py turns this on by default.
+ASYNC_VIEWS = os.getenv('DJANGO_ASYNC_VIEWS', 'False') == 'True'
+
 # CACHING CONFIGURATION
+# A small in-process LRU in front of a SQLite file shared by every worker on
+# the host. See movies/cache_backends.py.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': 'movies.cache_backends.TieredCache',
+        'LOCATION': BASE_DIR / 'cache.sqlite3',
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 500,
+            'L1_TIMEOUT': 30,
+            'MAX_BYTES': 256 * 1024 * 1024,
+        },
     }
-}
\ No newline at end of file
+}
+
+# Resized posters, made from TMDB's images on first request (see movies/posters.py).
+# The oldest files are deleted once the cache grows past POSTER_CACHE_MAX_BYTES.
+POSTER_CACHE_DIR = BASE_DIR / 'poster_cache'
+POSTER_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Movie page HTTP caching (see movies/page_cache.py). Anonymous pages may be
+# cached for MOVIE_PAGE_MAX_AGE seconds; MOVIE_PAGE_CACHE also keeps them
+# rendered in the cache above.
+MOVIE_PAGE_MAX_AGE = 300
+MOVIE_PAGE_CACHE = os.getenv('MOVIE_PAGE_CACHE', 'False') == 'True'
+MOVIE_PAGE_CACHE_TIMEOUT = 60 * 10
+
+# PERFORMANCE METRICS
+# Per-request TMDB, cache, SQL and template timings go out in a Server-Timing
+# header; the totals from all workers are served at /metrics for Prometheus.
+METRICS_ENABLED = True
+METRICS_SERVER_TIMING = True
+METRICS_DB = BASE_DIR / 'metrics.sqlite3'
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')